@@ -0,0 +1,208 @@
+# src/assemble.py
+# Parallel page assembly: each report section is laid out as its own PDF fragment in a
+# process pool (charts + flowables + doc.build, all on separate cores), then the fragments
+# are concatenated in page order with pypdf, a bookmark per section and "Page i of N"
+# footers stamped on the finished document.
+#
+#   python src/assemble.py district "Irvine Unified"
+#   python src/assemble.py district "Irvine Unified" "Alameda Unified" --workers 4
+#
+# Every section already starts on a new page (build_report's page builders open with a
+# PageBreak), so laying sections out separately gives the same pages as build_pdf's single
+# doc.build. The enrollment table is already cut into page-sized Tables, so a long one is
+# laid out SPLIT_PAGES pages per fragment and the pieces rejoined under one bookmark.
+# Workers are forked after the source files, KPI table and peer index are loaded, so they
+# start with warm caches; one pool serves a whole batch. Needs pypdf
+# (without it this falls back to build_report.build_pdf).
+import argparse
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import PageBreak
+
+import build_report as br
+from build_context import BuildContext
+from pipeline import preload_sources
+from report_template import BuildTimings, batch_summary, get_template, timed
+
+# (bookmark title, page builder, page counter); every builder is build(ctx, doc, story).
+# Sections with a page counter(ctx) can be laid out in pieces: build(ctx, doc, story, pages=range).
+SECTIONS = [
+    ("Executive Summary", br.build_page_one, None),
+    ("Enrollment by School", br.build_page_two_enrollment_table, br.enrollment_page_count),
+    ("Reading (CAASPP ELA)", br.build_page_caaspp_ela, None),
+    ("Speaking (ELPAC)", br.build_page_elpac_speaking, None),
+    ("Trends", br.build_page_trends, None),
+]
+SPLIT_PAGES = 4  # pages of a splittable section per fragment
+REFERENCES_TITLE = "Data Sources & References"
+FOOTER_FONT = ("Helvetica", 8)
+FOOTER_Y = 20  # points above the bottom edge (inside the unused bottom margin)
+
+
+def default_workers() -> int:
+    return max(1, min(len(SECTIONS), os.cpu_count() or 1))
+
+
+def make_pool(workers: int | None = None) -> ProcessPoolExecutor:
+    """Worker processes forked from this (warm) process; spawned where fork is unavailable."""
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+    return ProcessPoolExecutor(workers or default_workers(), mp_context=ctx)
+
+
+def _pieces(ctx: BuildContext, index: int) -> list:
+    """Page ranges to lay SECTIONS[index] out in ([None]: the whole section at once)."""
+    count = SECTIONS[index][2]
+    n = count(ctx) if count is not None else 0
+    if n <= SPLIT_PAGES:
+        return [None]
+    return [range(p, min(p + SPLIT_PAGES, n)) for p in range(0, n, SPLIT_PAGES)]
+
+
+def _fragment(ctx: BuildContext, index: int, pages: range | None = None) -> tuple[int, int, bytes | None, int]:
+    """
+    Lay out SECTIONS[index] (only `pages` of it, if given) on its own:
+    (index, first page, PDF bytes or None if empty, page count).
+    """
+    _, build, _ = SECTIONS[index]
+    buf = io.BytesIO()
+    doc = get_template().doc(buf)
+    story = []
+    if pages is None:
+        build(ctx, doc, story)
+    else:
+        build(ctx, doc, story, pages=pages)
+    while story and isinstance(story[0], PageBreak):
+        story.pop(0)  # the fragment starts on a fresh page anyway
+    first = pages.start if pages is not None else 0
+    if not story:
+        return index, first, None, 0
+    doc.build(story)
+    return index, first, buf.getvalue(), doc.page
+
+
+def _footer_overlay(page_sizes) -> io.BytesIO:
+    """One PDF page per report page carrying only its "Page i of N" footer."""
+    buf = io.BytesIO()
+    canv = Canvas(buf)
+    n = len(page_sizes)
+    for i, (w, h) in enumerate(page_sizes, start=1):
+        canv.setPageSize((w, h))
+        canv.setFont(*FOOTER_FONT)
+        canv.setFillGray(0.4)
+        canv.drawCentredString(w / 2, FOOTER_Y, f"Page {i} of {n}")
+        canv.showPage()
+    canv.save()
+    buf.seek(0)
+    return buf
+
+
+def concatenate(fragments, out_path, page_numbers: bool = True, compress_level: int | None = None) -> int:
+    """
+    fragments: [(bookmark title, PDF path or bytes)] in page order. Writes out_path with a
+    top-level bookmark per fragment (at its first page; title None: continues the previous
+    one, no bookmark) and, optionally, page footers;
+    with compress_level the streams are re-deflated (build_report.recompress). Returns the
+    page count.
+    """
+    from pypdf import PdfReader, PdfWriter
+    writer = PdfWriter()
+    starts = []
+    for title, frag in fragments:
+        starts.append((title, len(writer.pages)))
+        writer.append(io.BytesIO(frag) if isinstance(frag, bytes) else frag)
+    for title, page in starts:
+        if title is not None:
+            writer.add_outline_item(title, page)
+    if page_numbers:
+        overlay = PdfReader(_footer_overlay([(float(p.mediabox.width), float(p.mediabox.height))
+                                                for p in writer.pages]))
+        for page, footer in zip(writer.pages, overlay.pages):
+            page.merge_page(footer)
+    if compress_level is not None:
+        br.recompress(writer, compress_level)
+    writer.page_mode = "/UseOutlines"
+    tmp = out_path + br._tmp_suffix()
+    with open(tmp, "wb") as fh:
+        writer.write(fh)
+    os.replace(tmp, out_path)
+    return len(writer.pages)
+
+
+def build_pdf(entity_type, entity_name, out_path=None, pool=None, image_profile=None, page_numbers=True, cds=None):
+    """
+    build_report.build_pdf with the sections laid out in parallel (pool: a make_pool()
+    executor to reuse across reports; one is created and shut down otherwise).
+    cds: the entity's (county, district, school) codes, as for build_report.build_pdf.
+    """
+    if br.PdfWriter is None:
+        print("[warn] pypdf not installed: building sequentially")
+        return br.build_pdf(entity_type, entity_name, out_path, image_profile=image_profile, cds=cds)
+
+    timings = BuildTimings(entity=f"{entity_type}:{entity_name}", template_reused=bool(br.BUILD_TIMINGS))
+    with BuildContext(entity_type, entity_name, out_path, image_profile=image_profile, cds=cds) as ctx:
+        with timed(timings, "data"):
+            ctx.df_enr = br.get_enrollment_for_report(entity_type, entity_name, ctx.cds)
+            try:
+                ctx.ela_info = br.summarize_district_ela(entity_type, entity_name, cds=ctx.cds)
+            except Exception as e:
+                print("[warn] ELA summary failed:", e)
+                ctx.ela_info = {}
+
+        own_pool = pool is None
+        if own_pool:
+            with timed(timings, "warm"):
+                preload_sources()  # so forked workers inherit it
+            pool = make_pool()
+        try:
+            with timed(timings, "sections"):  # charts + layout, one process per section (or piece)
+                jobs = [pool.submit(_fragment, ctx, i, pages)
+                        for i in range(len(SECTIONS)) for pages in _pieces(ctx, i)]
+                references = br.references_fragment(cache_dir=ctx.cache_dir)
+                parts = sorted(j.result() for j in jobs)
+        finally:
+            if own_pool:
+                pool.shutdown()
+
+        with timed(timings, "merge"):
+            fragments, seen = [], set()
+            for i, _, data, _ in parts:
+                if data is not None:
+                    fragments.append((None if i in seen else SECTIONS[i][0], data))
+                    seen.add(i)
+            concatenate(fragments + [(REFERENCES_TITLE, references)], ctx.out_path, page_numbers,
+                        ctx.image_profile.compress_level)
+    br.BUILD_TIMINGS.append(timings)
+    return ctx.out_path
+
+
+def build_many(entity_type, names, workers=None, image_profile=None, page_numbers=True) -> list:
+    """Several reports in sequence, sharing one warm worker pool."""
+    t0 = time.perf_counter()
+    preload_sources()
+    with make_pool(workers) as pool:
+        print(f"[assemble] {workers or default_workers()} worker(s), sources loaded in {time.perf_counter() - t0:.2f}s")
+        return [build_pdf(entity_type, n, pool=pool, image_profile=image_profile, page_numbers=page_numbers)
+                for n in names]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build reports with sections laid out in parallel processes")
+    ap.add_argument("entity_type", choices=["district", "school"])
+    ap.add_argument("names", nargs="+")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (default: one per section, up to the CPU count)")
+    ap.add_argument("--image-profile", default=None, help="report_template.IMAGE_PROFILES name")
+    ap.add_argument("--no-page-numbers", action="store_true", help="don't stamp 'Page i of N' footers")
+    args = ap.parse_args(argv)
+    for path in build_many(args.entity_type, args.names, args.workers, args.image_profile, not args.no_page_numbers):
+        print(f"[info] PDF successfully built at: {path}")
+    print(batch_summary(br.BUILD_TIMINGS))
+
+
+if __name__ == "__main__":
+    main()
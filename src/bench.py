@@ -0,0 +1,302 @@
+# src/bench.py
+# Benchmark runner + regression gate over the pipeline's entry points.
+#
+# Each case runs in a fresh process (so "cold" really means cold and peak memory is per
+# case), `--repeat` times; the median wall time is compared against a stored baseline and
+# the run exits 1 when a case got slower, or its peak memory grew, beyond the threshold.
+#
+#   python src/bench.py --save-baseline            # record output/bench/baseline.json
+#   python src/bench.py                            # compare; exit 1 on regression
+#   python src/bench.py --cases read_caaspp,build_pdf --threshold 0.2
+#
+# Cases (rows = data rows in the source file):
+#   read_caaspp            raw parse of the CAASPP research file            rows/s
+#   summarize_ela_cold     parse + normalize + district summary             rows/s
+#   summarize_ela_warm     district summary from the in-process cache       calls/s
+#   elpac_speaking_cold    parse + per-domain metrics + district grades     rows/s
+#   elpac_speaking_warm    district grades from the in-process cache        calls/s
+#   fetch_enrollment       enrollment file -> district K–5 table            rows/s
+#   build_pdf              full district report                             reports/min
+#   build_pdf_parallel     same, sections laid out in a warm process pool   reports/min
+# Snapshots (snapshot.py) are disabled while benchmarking so cold cases measure parsing.
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_mod
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from cde_io import BASE_DIR
+
+BENCH_DIR = BASE_DIR / "output" / "bench"
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+REPEAT = 3
+THRESHOLD = 0.10           # fail when a case is >10% slower than the baseline
+MEM_THRESHOLD = 0.25       # ... or its peak memory above imports grew by >25%
+MEM_FLOOR_MB = 20          # memory growth below this is noise, whatever the ratio
+ENTITY = "Irvine Unified"
+CASE_TIMEOUT = 1800        # seconds before a case that never reports is killed
+
+
+def _source_rows(path) -> int:
+    from cde_io import open_text
+    with open_text(path) as fh:
+        return max(sum(1 for _ in fh) - 1, 0)
+
+
+# ---- cases: setup() -> (run, units, unit_name); run() is timed, setup is not ----
+
+def _case_read_caaspp(entity):
+    from caaspp_summary import _read_caaspp, resolve_caaspp_path
+    return (lambda: _read_caaspp()), _source_rows(resolve_caaspp_path()), "rows"
+
+
+def _case_summarize_ela_cold(entity):
+    from caaspp_summary import _load_caaspp_subjects, resolve_caaspp_path, summarize_district_ela
+    def run():
+        _load_caaspp_subjects.cache_clear()
+        summarize_district_ela("district", entity)
+    return run, _source_rows(resolve_caaspp_path()), "rows"
+
+
+def _case_summarize_ela_warm(entity):
+    from caaspp_summary import summarize_district_ela
+    summarize_district_ela("district", entity)
+    return (lambda: summarize_district_ela("district", entity)), 1, "calls"
+
+
+def _case_elpac_speaking_cold(entity):
+    from fetch_elpac import _load_elpac_metrics, district_elpac_speaking_pct_below_by_grade, resolve_elpac_path
+    def run():
+        _load_elpac_metrics.cache_clear()
+        district_elpac_speaking_pct_below_by_grade(entity)
+    return run, _source_rows(resolve_elpac_path()), "rows"
+
+
+def _case_elpac_speaking_warm(entity):
+    from fetch_elpac import district_elpac_speaking_pct_below_by_grade
+    district_elpac_speaking_pct_below_by_grade(entity)
+    return (lambda: district_elpac_speaking_pct_below_by_grade(entity)), 1, "calls"
+
+
+def _case_fetch_enrollment(entity):
+    from fetch_enrollment_ca import fetch_enrollment_from_txt, resolve_enrollment_path
+    return (lambda: fetch_enrollment_from_txt(entity)), _source_rows(resolve_enrollment_path()), "rows"
+
+
+def _case_build_pdf(entity):
+    import build_report
+    out = os.path.join(tempfile.mkdtemp(prefix="bench_"), "report.pdf")
+    return (lambda: build_report.build_pdf("district", entity, out_path=out)), 1, "reports"
+
+
+def _case_build_pdf_parallel(entity):
+    import assemble
+    out = os.path.join(tempfile.mkdtemp(prefix="bench_"), "report.pdf")
+    assemble.preload_sources()
+    pool = assemble.make_pool()  # one pool for all repeats, as build_many uses it
+    return (lambda: assemble.build_pdf("district", entity, out_path=out, pool=pool)), 1, "reports"
+
+
+CASES = {
+    "read_caaspp": _case_read_caaspp,
+    "summarize_ela_cold": _case_summarize_ela_cold,
+    "summarize_ela_warm": _case_summarize_ela_warm,
+    "elpac_speaking_cold": _case_elpac_speaking_cold,
+    "elpac_speaking_warm": _case_elpac_speaking_warm,
+    "fetch_enrollment": _case_fetch_enrollment,
+    "build_pdf": _case_build_pdf,
+    "build_pdf_parallel": _case_build_pdf_parallel,
+}
+WARM_REPEAT = 50  # cached calls are microseconds: time a batch per repeat
+
+
+def _run_case(name, entity, repeat, queue):
+    """Child process: set up, time `repeat` runs, report times and memory."""
+    os.environ["CA_REPORT_SNAPSHOT"] = "0"
+    from cde_io import current_rss_mb
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # the loaders print debug lines
+            run, units, unit_name = CASES[name](entity)
+            rss_before = current_rss_mb()
+            inner = WARM_REPEAT if name.endswith("_warm") else 1
+            runs = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                for _ in range(inner):
+                    run()
+                runs.append((time.perf_counter() - t0) / inner)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        res = {"runs": runs, "units": units, "unit": unit_name,
+               "peak_rss_mb": round(peak, 1), "peak_delta_mb": round(max(peak - rss_before, 0), 1)}
+        if "build_report" in sys.modules:  # report builds also record their own stage times
+            stages = {}
+            for b in sys.modules["build_report"].BUILD_TIMINGS:
+                for k, v in b.stages.items():
+                    stages.setdefault(k, []).append(v)
+            res["stages_ms"] = {k: round(1000 * statistics.median(v), 2) for k, v in stages.items()}
+        queue.put(res)
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_case(name, entity=ENTITY, repeat=REPEAT) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_case, args=(name, entity, repeat, queue))
+    proc.start()
+    deadline = time.monotonic() + CASE_TIMEOUT
+    while True:
+        try:
+            res = queue.get(timeout=5)
+            break
+        except queue_mod.Empty:
+            if proc.exitcode is not None:  # died without reporting (OOM kill, segfault)
+                res = {"error": f"worker exited with code {proc.exitcode} before reporting"}
+                break
+            if time.monotonic() > deadline:
+                proc.terminate()
+                res = {"error": f"no result after {CASE_TIMEOUT}s"}
+                break
+    proc.join()
+    if "error" in res:
+        return res
+    med = statistics.median(res["runs"])
+    res["seconds"] = med
+    res["min_seconds"] = min(res["runs"])
+    rate = res["units"] / med if med > 0 else float("inf")
+    if res["unit"] == "reports":
+        res["throughput"], res["throughput_unit"] = 60 * rate, "reports/min"
+    else:
+        res["throughput"], res["throughput_unit"] = rate, f"{res['unit']}/s"
+    return res
+
+
+def machine_info() -> dict:
+    info = {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "cpu": platform.processor() or platform.machine(),
+    }
+    try:
+        with open("/proc/cpuinfo") as fh:
+            info["cpu"] = next(l.split(":", 1)[1].strip() for l in fh if l.startswith("model name"))
+    except (OSError, StopIteration):
+        pass
+    try:
+        info["memory_gb"] = round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30, 1)
+    except (ValueError, OSError, AttributeError):
+        pass
+    for mod in ("pandas", "numpy", "reportlab", "matplotlib"):
+        try:
+            info[mod] = __import__(mod).__version__
+        except ImportError:
+            info[mod] = None
+    try:
+        info["git_commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                            capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        info["git_commit"] = None
+    return info
+
+
+def run_suite(cases=None, entity=ENTITY, repeat=REPEAT) -> dict:
+    out = {"created_at": datetime.now().isoformat(timespec="seconds"), "entity": entity,
+           "repeat": repeat, "machine": machine_info(), "cases": {}}
+    for name in cases or CASES:
+        res = run_case(name, entity, repeat)
+        out["cases"][name] = res
+        if "error" in res:
+            print(f"[bench] {name:<20} error: {res['error']}")
+        else:
+            print(f"[bench] {name:<20} {1000 * res['seconds']:9.2f} ms  "
+                  f"{res['throughput']:12,.1f} {res['throughput_unit']:<11}  peak {res['peak_rss_mb']:7.1f} MB "
+                  f"(+{res['peak_delta_mb']:.1f})")
+            for stage, ms in res.get("stages_ms", {}).items():
+                print(f"[bench]   {stage:<18} {ms:9.2f} ms")
+    return out
+
+
+def compare(current: dict, baseline: dict, threshold=THRESHOLD, mem_threshold=MEM_THRESHOLD) -> list:
+    """Regressions as human-readable strings ([] = pass). Cases missing from either side are skipped."""
+    problems = []
+    for name, cur in current["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if not base or "error" in base:
+            continue
+        if "error" in cur:
+            problems.append(f"{name}: failed ({cur['error']})")
+            continue
+        ratio = cur["seconds"] / base["seconds"] if base["seconds"] > 0 else 1.0
+        if ratio > 1 + threshold:
+            problems.append(f"{name}: {ratio:.2f}x slower ({1000 * base['seconds']:.2f} -> "
+                            f"{1000 * cur['seconds']:.2f} ms; {base['throughput']:,.1f} -> "
+                            f"{cur['throughput']:,.1f} {cur['throughput_unit']})")
+        grew = cur["peak_delta_mb"] - base["peak_delta_mb"]
+        if grew > MEM_FLOOR_MB and cur["peak_delta_mb"] > base["peak_delta_mb"] * (1 + mem_threshold):
+            problems.append(f"{name}: peak memory +{grew:.0f} MB ({base['peak_delta_mb']:.0f} -> "
+                            f"{cur['peak_delta_mb']:.0f} MB above imports)")
+    return problems
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the pipeline and gate on regressions")
+    ap.add_argument("--cases", help=f"comma-separated subset of: {', '.join(CASES)}")
+    ap.add_argument("--entity", default=ENTITY, help="district used by the per-entity cases")
+    ap.add_argument("--repeat", type=int, default=REPEAT)
+    ap.add_argument("--baseline", default=str(BASELINE_PATH))
+    ap.add_argument("--save-baseline", action="store_true", help="write this run as the baseline")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown (0.10 = 10%%)")
+    ap.add_argument("--mem-threshold", type=float, default=MEM_THRESHOLD, help="allowed peak-memory growth")
+    ap.add_argument("--out", help="results file (default output/bench/<timestamp>.json)")
+    args = ap.parse_args(argv)
+
+    cases = [c.strip() for c in args.cases.split(",")] if args.cases else None
+    unknown = [c for c in cases or [] if c not in CASES]
+    if unknown:
+        ap.error(f"unknown case(s): {', '.join(unknown)}")
+
+    result = run_suite(cases, args.entity, args.repeat)
+    BENCH_DIR.mkdir(parents=True, exist_ok=True)
+    out = Path(args.out or BENCH_DIR / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    out.write_text(json.dumps(result, indent=2))
+    print(f"[bench] results: {out}")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(result, indent=2))
+        print(f"[bench] baseline saved: {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"[bench] no baseline at {baseline_path} (run with --save-baseline); not gating")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text())
+    for key in ("cpu", "cpu_count", "python", "pandas"):
+        if baseline["machine"].get(key) != result["machine"].get(key):
+            print(f"[warn] baseline {key} differs ({baseline['machine'].get(key)} vs "
+                  f"{result['machine'].get(key)}): timings may not be comparable")
+    problems = compare(result, baseline, args.threshold, args.mem_threshold)
+    for p in problems:
+        print(f"[regression] {p}")
+    print(f"[bench] {'FAIL' if problems else 'ok'}: {len(problems)} regression(s) vs baseline "
+          f"from {baseline['created_at']} (threshold {args.threshold:.0%})")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
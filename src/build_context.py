@@ -0,0 +1,81 @@
+# src/build_context.py
+# Per-build state for one report, passed to every page builder in build_report instead of
+# module globals: the entity, where the PDF goes, a private scratch folder for the chart
+# PNGs, the chart image profile and the report's own data (enrollment table, ELA summary).
+# Batch callers also pass the entity's CDS codes, which every data lookup then uses instead
+# of the (not unique) name.
+# Two builds never share a chart file, so builds can run side by side in threads or
+# processes; the scratch folder is removed when the build finishes.
+#
+#   with BuildContext("district", "Irvine Unified") as ctx:
+#       png = ctx.chart("enrollment_g1_5.png")      # <workspace>/enrollment_g1_5.png
+#
+# Paths are absolute and anchored at the repository (not the caller's working directory).
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from cde_io import BASE_DIR, cds_code
+from report_template import IMAGE_PROFILES, ImageProfile
+
+REPORTS_DIR = str(BASE_DIR / "reports")
+STATIC_CACHE_DIR = os.path.join(REPORTS_DIR, "_cache")  # static page fragments (references), shared by all builds
+
+
+def report_filename(entity_name: str, cds=None) -> str:
+    """
+    'Irvine Unified' -> 'Irvine_Unified_Report.pdf'; with (county, district, school) codes
+    the CDS code is added, so same-named schools get their own file:
+    'Lincoln Elementary', (19, 64733, 6016323) -> 'Lincoln_Elementary_19647336016323_Report.pdf'.
+    """
+    stem = entity_name.replace(' ', '_').replace('/', '-')
+    return f"{stem}_{cds_code(cds)}_Report.pdf" if cds is not None else f"{stem}_Report.pdf"
+
+
+@dataclass
+class BuildContext:
+    """
+    One report build. out_path defaults to <out_dir>/<name>_Report.pdf and out_dir to
+    REPORTS_DIR (or out_path's folder); image_profile is an ImageProfile or a name in
+    report_template.IMAGE_PROFILES. cds: (county, district, school) codes that identify the
+    entity (school 0 for a district); the name is then only a label. df_enr / ela_info are
+    filled in by the build's data step.
+    """
+    entity_type: str
+    entity_name: str
+    out_path: str | None = None
+    out_dir: str | None = None
+    image_profile: ImageProfile | str | None = None
+    cache_dir: str = STATIC_CACHE_DIR
+    cds: tuple[int, int, int] | None = None
+    df_enr: pd.DataFrame | None = None
+    ela_info: dict = field(default_factory=dict)
+    workspace: str = field(init=False)
+
+    def __post_init__(self):
+        if self.image_profile is None or isinstance(self.image_profile, str):
+            self.image_profile = IMAGE_PROFILES[self.image_profile or "default"]
+        if self.out_path:
+            self.out_path = os.path.abspath(self.out_path)
+            self.out_dir = os.path.abspath(self.out_dir or os.path.dirname(self.out_path))
+        else:
+            self.out_dir = os.path.abspath(self.out_dir or REPORTS_DIR)
+            self.out_path = os.path.join(self.out_dir, report_filename(self.entity_name, self.cds))
+        os.makedirs(os.path.dirname(self.out_path), exist_ok=True)
+        self.workspace = tempfile.mkdtemp(prefix="report-")
+
+    def chart(self, name: str) -> str:
+        """Path for a chart PNG in this build's private workspace."""
+        return os.path.join(self.workspace, name)
+
+    def close(self):
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,22 +1,30 @@
+import io
 import os
+import threading
+import zlib
 from datetime import date
 import math
 import pandas as pd
 import sys
 
 # ---- Charts (matplotlib) ----
-import matplotlib.pyplot as plt
+# Figure objects, not pyplot: no global figure state, so charts can render in worker threads
+from matplotlib.figure import Figure
 
 # ---- PDF (reportlab) ----
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak, LongTable
+    SimpleDocTemplate, Paragraph, Spacer, Image, Table, PageBreak
 )
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.platypus import ListFlowable, ListItem
 
+try:
+    from pypdf import PdfWriter  # optional: merge cached static pages instead of laying them out per report
+except ImportError:
+    PdfWriter = None
+
 
 
 #----- real data import form our save files-----
@@ -27,7 +35,17 @@ from caaspp_summary import district_ela_by_grade
 from fetch_elpac import district_elpac_speaking_by_grade
 from caaspp_summary import district_ela_pct_below_standard_by_grade
 from fetch_elpac import district_elpac_speaking_pct_below_by_grade
-from fetch_enrollment_ca import fetch_enrollment_from_txt, fetch_enrollment_school_row
+from fetch_enrollment_ca import enrollment_k5_table, fetch_enrollment_from_txt, fetch_enrollment_school_row
+import metric_store
+import entity_resolver
+from kpi import kpi_for
+from rollups import comparison
+from peers import peer_districts
+from build_context import STATIC_CACHE_DIR, BuildContext
+from report_template import (
+    REFERENCES, REFERENCES_NOTE, TABLE_FONT, TABLE_FONT_BOLD, TABLE_FONT_SIZE,
+    IMAGE_PROFILES, BuildTimings, batch_summary, get_template, timed,
+)
 
 
 
@@ -64,8 +82,6 @@ from fetch_enrollment_ca import fetch_enrollment_from_txt, fetch_enrollment_scho
 
 #---------main config
 
-IMG_DIR = "reports/_tmp"
-PAGE_MARGINS = dict(left=0.5*inch, right=0.5*inch, top=0.5*inch, bottom=0.5*inch)
 CHART_W_IN = 6.5  # fixed chart slot width
 CHART_H_IN = 3.2  # fixed chart slot height
 CHART_W_PX = 1300
@@ -112,41 +128,71 @@ grades = ["K", "1", "2", "3", "4", "5"]
 # -----------------------------
 # Helpers
 # -----------------------------
-def ensure_dirs():
-    os.makedirs("reports", exist_ok=True)
-    os.makedirs(IMG_DIR, exist_ok=True)
+def save_figure(fig, out_png, profile=None, **kwargs):
+    """
+    fig.savefig under an image profile (report_template.ImageProfile, default if None): its
+    dpi is the resolution at the chart's slot width (CHART_W_IN), and with `colors` the
+    PNG is re-saved palette-quantized.
+    """
+    prof = profile or IMAGE_PROFILES["default"]
+    if prof.dpi:
+        kwargs["dpi"] = prof.dpi * CHART_W_IN / fig.get_figwidth()
+    # scratch files: reportlab decodes the PNG and deflates the pixels itself, so write fast
+    fig.savefig(out_png, pil_kwargs={"compress_level": 1}, **kwargs)
+    if prof.colors:
+        from PIL import Image as PILImage
+        with PILImage.open(out_png) as im:
+            q = im.convert("RGB").quantize(colors=prof.colors, method=PILImage.Quantize.FASTOCTREE)
+        q.save(out_png, compress_level=1)
+
+
+def chart_image(png, height=CHART_H_IN*inch):
+    """A chart PNG at the full chart slot width."""
+    return Image(png, width=CHART_W_IN*inch, height=height)
 
 # in build_report.py
-def save_bar_chart_with_na(labels, values, out_png, title="", y_label="", cut_scores=None, y_max=None):
-    import matplotlib.pyplot as plt
-    import math
+def save_bar_chart_with_na(labels, values, out_png, title="", y_label="", cut_scores=None, y_max=None, profile=None):
     xs = range(len(labels))
     heights = [0 if (v is None or (isinstance(v, float) and math.isnan(v))) else v for v in values]
 
-    plt.figure(figsize=(CHART_W_IN, CHART_H_IN))
-    plt.bar(xs, heights)
-    plt.xticks(xs, labels)
-    plt.title(title)
-    plt.ylabel(y_label)
+    fig = Figure(figsize=(CHART_W_IN, CHART_H_IN))
+    ax = fig.add_subplot(111)
+    ax.bar(xs, heights)
+    ax.set_xticks(list(xs), labels)
+    ax.set_title(title)
+    ax.set_ylabel(y_label)
     if y_max is not None:
-        plt.ylim(0, y_max)
+        ax.set_ylim(0, y_max)
 
     for i, v in enumerate(values):
         if v is None or (isinstance(v, float) and math.isnan(v)):
-            plt.text(i, 0.5, "N/A", ha="center", va="bottom", fontsize=9)
+            ax.text(i, 0.5, "N/A", ha="center", va="bottom", fontsize=9)
 
     # (cut_scores ignored for this chart type)
-    plt.tight_layout()
-    plt.savefig(out_png, dpi=150)
-    plt.close()
+    fig.tight_layout()
+    save_figure(fig, out_png, profile, dpi=150)
 
-def get_enrollment_for_report(entity_type: str, entity_name: str):
+def get_enrollment_for_report(entity_type: str, entity_name: str, cds=None):
     """
     Returns a DataFrame shaped like:
       School | K | 1 | 2 | 3 | 4 | 5 | Total
     For DISTRICT: existing behavior (all schools in the district).
     For SCHOOL: filters the district table down to that one school.
+    With `cds` (county, district, school codes) the rows are picked by code from the
+    statewide K–5 table instead of by name.
     """
+    if cds is not None:
+        if entity_type not in ("district", "school"):
+            raise ValueError(f"Unknown entity_type: {entity_type}")
+        t = enrollment_k5_table()
+        t = t[(t["county_code"] == cds[0]) & (t["district_code"] == cds[1])]
+        if entity_type == "school":
+            t = t[t["school_code"] == cds[2]]
+        if t.empty:
+            raise ValueError(f"No enrollment rows found for {entity_type} '{entity_name}' (CDS {cds}).")
+        out = t.rename(columns={"school_name": "School"})[["School", "K", "1", "2", "3", "4", "5", "Total"]]
+        return out.sort_values("School").reset_index(drop=True)
+
     # reuse your existing district fetcher
     # df_all = fetch_enrollment_from_txt(entity_name if entity_type == "district" else None)
 
@@ -193,21 +239,20 @@ def get_enrollment_for_report(entity_type: str, entity_name: str):
 
 
 
-def save_bar_chart_enrollment(grades, counts, out_png):
-    plt.figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
-    plt.bar(grades, counts)
-    plt.title("Enrollment by Grade")
-    plt.ylabel("Students")
-    plt.tight_layout()
-    plt.savefig(out_png, bbox_inches="tight")
-    plt.close()
+def save_bar_chart_enrollment(grades, counts, out_png, profile=None):
+    fig = Figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
+    ax = fig.add_subplot(111)
+    ax.bar(grades, counts)
+    ax.set_title("Enrollment by Grade")
+    ax.set_ylabel("Students")
+    fig.tight_layout()
+    save_figure(fig, out_png, profile, bbox_inches="tight")
 
-def save_bar_chart_reading_gap(labels, pct_below, out_png):
+def save_bar_chart_reading_gap(labels, pct_below, out_png, profile=None):
     """
     Reused name: accepts labels ['1'..'5'] and pct_below (None for 1–2).
     Draws % below standard with tight Y axis + bar labels.
     """
-    import matplotlib.pyplot as plt
     from math import ceil
 
     values = [v if v is not None else 0 for v in pct_below]
@@ -218,7 +263,7 @@ def save_bar_chart_reading_gap(labels, pct_below, out_png):
         y_max = 30
 
     # keep your existing sizing constants if you have them
-    fig = plt.figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
+    fig = Figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
     ax = fig.add_subplot(111)
 
     bars = ax.bar(labels, values)
@@ -236,16 +281,14 @@ def save_bar_chart_reading_gap(labels, pct_below, out_png):
             ax.text(x, bar.get_height() + pad, f"{v:.0f}%", ha="center", va="bottom", fontsize=10)
 
     fig.tight_layout()
-    fig.savefig(out_png, bbox_inches="tight")
-    plt.close(fig)
+    save_figure(fig, out_png, profile, bbox_inches="tight")
 
-def save_bar_chart_elpac_speaking(labels, levels, out_png):
+def save_bar_chart_elpac_speaking(labels, levels, out_png, profile=None):
     """
     labels: ['1','2','3','4','5']
     levels: average speaking performance level per grade (1–3), or None for missing
     """
     import math
-    import matplotlib.pyplot as plt
 
     # Plot 0 when missing; we’ll overlay “N/A”
     values = [v if v is not None else 0.0 for v in levels]
@@ -256,7 +299,7 @@ def save_bar_chart_elpac_speaking(labels, levels, out_png):
     y_max = min(3.2, round(max(2.0, maxv + 0.15), 2))  # gentle headroom
     y_min = 0.8  # keeps labels readable; below level 1
 
-    fig = plt.figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
+    fig = Figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
     ax = fig.add_subplot(111)
 
     bars = ax.bar(labels, values)
@@ -275,15 +318,13 @@ def save_bar_chart_elpac_speaking(labels, levels, out_png):
             ax.text(x, bar.get_height() + pad, f"{raw:.1f}", ha="center", va="bottom", fontsize=10)
 
     fig.tight_layout()
-    fig.savefig(out_png, bbox_inches="tight")
-    plt.close(fig)
+    save_figure(fig, out_png, profile, bbox_inches="tight")
 
-def save_bar_chart_elpac_pct_below(labels, pct_below, out_png):
+def save_bar_chart_elpac_pct_below(labels, pct_below, out_png, profile=None):
     """
     labels: ['1','2','3','4','5']
     pct_below: list of percents (0–100) or None
     """
-    import matplotlib.pyplot as plt
     from math import ceil
 
     values = [v if v is not None else 0 for v in pct_below]
@@ -293,7 +334,7 @@ def save_bar_chart_elpac_pct_below(labels, pct_below, out_png):
     if y_max < 30:
         y_max = 30
 
-    fig = plt.figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
+    fig = Figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
     ax = fig.add_subplot(111)
     bars = ax.bar(labels, values)
 
@@ -311,50 +352,92 @@ def save_bar_chart_elpac_pct_below(labels, pct_below, out_png):
             ax.text(x, bar.get_height() + pad, f"{v:.0f}%", ha="center", va="bottom", fontsize=10)
 
     fig.tight_layout()
-    fig.savefig(out_png, bbox_inches="tight")
-    plt.close(fig)
+    save_figure(fig, out_png, profile, bbox_inches="tight")
 
 
-def kpi_tiles(total_k5: int, avg_read_gap: float, avg_speak_gap: float):
+def save_comparison_chart(labels, series, out_png, title="", y_label="", profile=None):
+    """
+    Grouped bars per grade, one bar per scope: series = {label -> [value or None per grade]}
+    (entity first, then county / state from rollups.comparison).
+    """
+    fig = Figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
+    ax = fig.add_subplot(111)
+    n = max(len(series), 1)
+    width = 0.8 / n
+    for i, (name, values) in enumerate(series.items()):
+        xs = [x + (i - (n - 1) / 2) * width for x in range(len(labels))]
+        ax.bar(xs, [v if v is not None else 0 for v in values], width, label=name)
+    ax.set_xticks(range(len(labels)))
+    ax.set_xticklabels([f"Grade {g}" for g in labels])
+    ax.set_ylim(0, 100)
+    ax.set_title(title)
+    ax.set_ylabel(y_label)
+    ax.legend(loc="upper right", fontsize=9)
+    fig.tight_layout()
+    save_figure(fig, out_png, profile, bbox_inches="tight")
+
+
+def add_comparison_chart(ctx, story, dataset, labels, own_values, chart_name, title="", y_label="", **filters):
+    """Entity vs county vs state bars from the precomputed rollups (skipped if unavailable)."""
+    entity_type, entity_name = ctx.entity_type, ctx.entity_name
+    out_png = ctx.chart(chart_name)
+    try:
+        parents = comparison(dataset, entity_type, entity_name, grades=labels, include_self=False,
+                             cds=ctx.cds, **filters)
+    except Exception as e:
+        print("[warn] rollup comparison unavailable:", e)
+        return
+    if not parents:
+        return
+    series = {entity_name: own_values, **parents}
+    save_comparison_chart(labels, series, out_png, title=title, y_label=y_label, profile=ctx.image_profile)
+    story.append(Spacer(1, 8))
+    story.append(chart_image(out_png, height=CHART_H_IN*0.8*inch))
+
+
+def _fmt_pctl(p):
+    return "–" if p is None or pd.isna(p) else f"{p:.0f}"
+
+
+def kpi_tiles(total_k5: int, avg_read_gap: float, avg_speak_gap: float, kpi: dict | None = None):
     """
     Returns a Platypus Table that shows 3 KPI tiles.
+    Gaps are percentages (0–100, None = not reported). With a precomputed `kpi` row
+    (kpi.kpi_for) each tile also shows its statewide / county percentile.
     """
-    styles = getSampleStyleSheet()
-    tile_style = ParagraphStyle(
-        "Tile", parent=styles["Heading3"], alignment=1, textColor=colors.white
-    )
-    val_style = ParagraphStyle(
-        "Val", parent=styles["Title"], alignment=1, textColor=colors.white
-    )
+    tpl = get_template()
+    tile_style = tpl.styles["Tile"]
+    val_style = tpl.styles["Val"]
+    rank_style = tpl.styles["Rank"]
     # Format values
     k1 = Paragraph("Total K-5 Enrollment", tile_style)
-    v1 = Paragraph(f"{total_k5:,}", val_style)
+    v1 = Paragraph(f"{total_k5:,}" if total_k5 is not None else "–", val_style)
 
     k2 = Paragraph("Avg Reading Gap (3–5)", tile_style)
-    v2 = Paragraph(f"{avg_read_gap*100:.0f}%", val_style)
+    v2 = Paragraph(f"{avg_read_gap:.0f}%" if avg_read_gap is not None else "–", val_style)
 
     k3 = Paragraph("Avg Speaking Gap (K–5 ELs)", tile_style)
-    v3 = Paragraph(f"{avg_speak_gap*100:.0f}%", val_style)
+    v3 = Paragraph(f"{avg_speak_gap:.0f}%" if avg_speak_gap is not None else "–", val_style)
 
     data = [
         [v1, v2, v3],
         [k1, k2, k3],
     ]
-    t = Table(data, colWidths=[2.8*inch, 2.8*inch, 2.8*inch], rowHeights=[0.9*inch, 0.5*inch])
-    t.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#2563EB")),  # values row
-        ("BACKGROUND", (0,1), (-1,1), colors.HexColor("#1E40AF")),  # labels row
-        ("ALIGN", (0,0), (-1,-1), "CENTER"),
-        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-        ("TEXTCOLOR", (0,0), (-1,-1), colors.white),
-        ("INNERGRID", (0,0), (-1,-1), 0.0, colors.white),
-        ("BOX", (0,0), (-1,-1), 0.0, colors.white),
-        ("BOTTOMPADDING", (0,1), (-1,1), 6),
-    ]))
+    row_heights = [0.9*inch, 0.5*inch]
+    if kpi:
+        # percentile = share of same-level entities at or below this value
+        data.append([
+            Paragraph(f"State pctl {_fmt_pctl(kpi.get(f'{m}_state_pctl'))} · "
+                      f"County pctl {_fmt_pctl(kpi.get(f'{m}_county_pctl'))}", rank_style)
+            for m in ("total_k5", "read_gap", "speak_gap")
+        ])
+        row_heights.append(0.35*inch)
+    t = Table(data, colWidths=[2.5*inch, 2.5*inch, 2.5*inch], rowHeights=row_heights)
+    t.setStyle(tpl.table_styles["kpi_tiles"])
     return t
 
 def footnote_paragraph():
-    styles = getSampleStyleSheet()
+    styles = get_template().styles
     note = (
         "Notes: Reading reflects CAASPP (typically grades 3–5 at elementary). "
         "K–2 are not assessed on CAASPP. Speaking gap is based on ELPAC thresholds for English Learners."
@@ -364,8 +447,9 @@ def footnote_paragraph():
 from caaspp_summary import district_ela_by_grade
 
 # Page: Enrollment (Grades 1–5)
-def build_page_enrollment(story, df_enr):
-    styles = getSampleStyleSheet()
+def build_page_enrollment(ctx, doc, story):
+    df_enr = ctx.df_enr
+    styles = get_template().styles
     story.append(PageBreak())
     story.append(Paragraph("Enrollment by Grade (1–5)", styles["Heading2"]))
     story.append(Spacer(1, 8))
@@ -373,14 +457,16 @@ def build_page_enrollment(story, df_enr):
     labels = ["1","2","3","4","5"]
     by_grade = [int(df_enr[g].sum()) if g in df_enr.columns else 0 for g in labels]
 
-    png = os.path.join(IMG_DIR, "enrollment_g1_5.png")
-    save_bar_chart_with_na(labels, by_grade, png, title="Enrollment by Grade (1–5)", y_label="Students")
-    story.append(Image(png, width=CHART_W_IN*inch, height=CHART_H_IN*inch))
+    png = ctx.chart("enrollment_g1_5.png")
+    save_bar_chart_with_na(labels, by_grade, png, title="Enrollment by Grade (1–5)", y_label="Students",
+                           profile=ctx.image_profile)
+    story.append(chart_image(png))
 
 
 
-def build_page_caaspp_ela(story, entity_type, entity_name):
-    styles = getSampleStyleSheet()
+def build_page_caaspp_ela(ctx, doc, story):
+    entity_type, entity_name = ctx.entity_type, ctx.entity_name
+    styles = get_template().styles
     story.append(PageBreak())
     story.append(Paragraph("Reading (CAASPP ELA) — % Not Meeting Standard", styles["Heading2"]))
     story.append(Spacer(1, 8))
@@ -389,12 +475,15 @@ def build_page_caaspp_ela(story, entity_type, entity_name):
         story.append(Paragraph("School-level CAASPP wiring coming soon.", styles["Italic"]))
         return
 
-    labels, pct_below, _tested = district_ela_pct_below_standard_by_grade(entity_name)
+    labels, pct_below, _tested = district_ela_pct_below_standard_by_grade(entity_name, cds=ctx.cds)
 
-    png = os.path.join(IMG_DIR, "caaspp_ela_pct_below_g1_5.png")
-    save_bar_chart_reading_gap(labels, pct_below, png)
+    png = ctx.chart("caaspp_ela_pct_below_g1_5.png")
+    save_bar_chart_reading_gap(labels, pct_below, png, profile=ctx.image_profile)
 
-    story.append(Image(png, width=CHART_W_IN*inch, height=CHART_H_IN*inch))
+    story.append(chart_image(png))
+    add_comparison_chart(ctx, story, "caaspp", labels, pct_below, "caaspp_ela_pct_below_compare.png",
+                         title="Reading Gap vs County and State", y_label="% Not Meeting Standard",
+                         subject="ELA")
     story.append(Spacer(1, 6))
     story.append(Paragraph(
         """Note: CAASPP ELA is administered starting in grade 3; grades 1–2 display as N/A.<br/>
@@ -410,8 +499,9 @@ def build_page_caaspp_ela(story, entity_type, entity_name):
 
 
 
-def build_page_elpac_speaking(story, entity_type, entity_name):
-    styles = getSampleStyleSheet()
+def build_page_elpac_speaking(ctx, doc, story):
+    entity_type, entity_name = ctx.entity_type, ctx.entity_name
+    styles = get_template().styles
     story.append(PageBreak())
     story.append(Paragraph("Speaking (ELPAC) by Grade (1–5)", styles["Heading2"]))
     story.append(Spacer(1, 8))
@@ -421,12 +511,15 @@ def build_page_elpac_speaking(story, entity_type, entity_name):
         return
 
     # % below Developed (Levels 1+2)
-    labels, pct_below, _tested = district_elpac_speaking_pct_below_by_grade(entity_name)
+    labels, pct_below, _tested = district_elpac_speaking_pct_below_by_grade(entity_name, cds=ctx.cds)
 
-    png = os.path.join(IMG_DIR, "elpac_speaking_pct_below_g1_5.png")
-    save_bar_chart_elpac_pct_below(labels, pct_below, png)
+    png = ctx.chart("elpac_speaking_pct_below_g1_5.png")
+    save_bar_chart_elpac_pct_below(labels, pct_below, png, profile=ctx.image_profile)
 
-    story.append(Image(png, width=CHART_W_IN*inch, height=CHART_H_IN*inch))
+    story.append(chart_image(png))
+    add_comparison_chart(ctx, story, "elpac", labels, pct_below, "elpac_speaking_pct_below_compare.png",
+                         title="Speaking Gap vs County and State", y_label="% in Levels 1 + 2",
+                         domain="Speaking")
     story.append(Spacer(1, 6))
     story.append(Paragraph(
         """Note: ELPAC Speaking uses performance levels.
@@ -439,35 +532,135 @@ def build_page_elpac_speaking(story, entity_type, entity_name):
     ))
 
 
-def build_school_table_flowables(headers, rows):
+def save_trend_chart(trend, out_png, title="", y_label="", profile=None):
+    """
+    trend: DataFrame from metric_store.trend (index = year, columns = grade).
+    One line per grade so year-over-year movement is visible per grade.
+    """
+    fig = Figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
+    ax = fig.add_subplot(111)
+    years = [str(y) for y in trend.index]
+    for g in sorted(trend.columns, key=lambda x: (len(str(x)), str(x))):
+        ax.plot(years, trend[g].tolist(), marker="o", label=f"Grade {g}")
+    ax.set_title(title)
+    ax.set_ylabel(y_label)
+    ax.legend(loc="best", fontsize=9)
+    fig.tight_layout()
+    save_figure(fig, out_png, profile, bbox_inches="tight")
+
+
+def build_page_trends(ctx, doc, story):
+    """
+    Year-over-year reading and speaking gaps (grades 1–5) from the metric store
+    (src/metric_store.py). Skipped until at least two years have been ingested.
+    """
+    entity_type, entity_name = ctx.entity_type, ctx.entity_name
+    grades_1_5 = ["1", "2", "3", "4", "5"]
+    reading = metric_store.trend(entity_type, entity_name, "caaspp", "pct_below", subject="ELA", cds=ctx.cds)
+    speaking = metric_store.trend(entity_type, entity_name, "elpac", "pct_below", domain="Speaking", cds=ctx.cds)
+    if len(reading) < 2 and len(speaking) < 2:
+        return
+
+    styles = get_template().styles
+    story.append(PageBreak())
+    story.append(Paragraph("Trends — Year over Year by Grade", styles["Heading2"]))
+    story.append(Spacer(1, 8))
+    for trend, name, title, y_label in [
+        (reading, "trend_reading.png", "Reading Gap by Grade (CAASPP ELA, % Levels 1 + 2)", "% Below Standard"),
+        (speaking, "trend_speaking.png", "Speaking Gap by Grade (ELPAC, % Levels 1 + 2)", "% Below Developed"),
+    ]:
+        cols = [g for g in grades_1_5 if g in trend.columns]
+        if len(trend) < 2 or not cols:
+            continue
+        png = ctx.chart(name)
+        save_trend_chart(trend[cols], png, title, y_label, profile=ctx.image_profile)
+        story.append(chart_image(png))
+        story.append(Spacer(1, 8))
+
+
+TABLE_PAD = 6  # reportlab's default left/right cell padding, points
+MAX_GLYPH_EM = 1.0  # no Helvetica glyph is wider than 1 em: len * size bounds a string's width
+
+
+def table_col_widths(headers, rows, total_width, flex_col=0):
+    """
+    Column widths computed once from the widest header/value per column (measured with the
+    font metrics, not by laying out every cell). Fixed columns get what they need; the
+    `flex_col` (school name) takes the rest of `total_width`.
+    """
+    widths = []
+    for j, h in enumerate(headers):
+        longest = max([str(r[j]) for r in rows] or [""], key=len)
+        widths.append(max(stringWidth(str(h), TABLE_FONT_BOLD, TABLE_FONT_SIZE + 1),
+                          stringWidth(longest, TABLE_FONT, TABLE_FONT_SIZE)) + 2 * TABLE_PAD + 2)
+    fixed = sum(w for j, w in enumerate(widths) if j != flex_col)
+    widths[flex_col] = max(total_width - fixed, 1 * inch)
+    return widths
+
+
+def _fit_text(text, width):
+    """Truncate `text` with an ellipsis so it fits `width` points (no wrapping -> fixed row height)."""
+    text = str(text)
+    avail = width - 2 * TABLE_PAD
+    if len(text) * TABLE_FONT_SIZE * MAX_GLYPH_EM <= avail:
+        return text  # can't overflow: skip measuring
+    w = stringWidth(text, TABLE_FONT, TABLE_FONT_SIZE)
+    if w <= avail:
+        return text
+    text = text[:max(int(len(text) * avail / w), 1)]  # proportional first cut, then trim
+    while len(text) > 1 and stringWidth(text + "…", TABLE_FONT, TABLE_FONT_SIZE) > avail:
+        text = text[:-1]
+    return text + "…"
+
+
+def table_page_rows(n_rows, frame_h, first_page_height=None) -> list:
+    """
+    Rows of a fixed-row-height table that land on each page it spans: page 0 is the page
+    the table starts on (0 rows when no row fits there), the rest are full frames.
+    """
+    per_page = max(int(frame_h // ROW_HEIGHT) - 1, 1)  # minus the repeated header
+    first = max(int((first_page_height or frame_h) // ROW_HEIGHT) - 1, 0)
+    counts = [first] if first else [0, per_page]  # no room left: start on the next page
+    while sum(counts) < n_rows:
+        counts.append(per_page)
+    return counts
+
+
+def build_school_table_flowables(headers, rows, frame_size, first_page_height=None, flex_col=0, pages=None):
     """
     Returns a list of flowables that render a table which:
       - repeats headers on every page
       - uses a fixed row height
       - auto page-breaks cleanly
+    Column widths are precomputed and rows are cut into page-sized Tables up front, so
+    reportlab never measures or splits a large table cell by cell.
+    `frame_size` is (width, height) of the doc's frame (ReportTemplate.frame_size); `first_page_height`
+    is the space left on the page where the table starts (default: a full page).
+    `pages` limits the output to those pages of the table (table_page_rows indices, default
+    all); widths are still computed from every row, so the pieces line up.
     """
-    # Combine header + rows
-    table_data = [headers] + rows
-
-    # LongTable will handle page breaks; we style for consistency
-    t = LongTable(table_data, repeatRows=1)
-    t.setStyle(TableStyle([
-        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-        ("FONTSIZE", (0,0), (-1,0), 10),
-        ("FONTSIZE", (0,1), (-1,-1), 9),
-        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),  # header gray
-        ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.whitesmoke, colors.white]),
-        ("GRID", (0,0), (-1,-1), 0.25, colors.HexColor("#9CA3AF")),
-        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-        ("LEFTPADDING", (0,0), (-1,-1), 4),
-        ("RIGHTPADDING", (0,0), (-1,-1), 4),
-        ("TOPPADDING", (0,0), (-1,-1), (ROW_HEIGHT-12)/2),   # center text vertically
-        ("BOTTOMPADDING", (0,0), (-1,-1), (ROW_HEIGHT-12)/2),
-    ]))
-    return [t]
-
-
-def save_top10_schools_chart(rows, out_png):
+    frame_w, frame_h = frame_size
+    widths = table_col_widths(headers, rows, frame_w, flex_col)
+    counts = table_page_rows(len(rows), frame_h, first_page_height)
+    pages = range(len(counts)) if pages is None else pages
+    style = get_template().table_styles["school_table"]
+
+    flowables, start = [], 0
+    for i, n in enumerate(counts):
+        if i in pages:
+            if i - 1 in pages:
+                flowables.append(PageBreak())
+            if n:  # page 0 may have no room for any row
+                chunk = [[_fit_text(v, widths[j]) if j == flex_col else v for j, v in enumerate(r)]
+                         for r in rows[start:start + n]]
+                t = Table([headers] + chunk, colWidths=widths, rowHeights=ROW_HEIGHT, repeatRows=1)
+                t.setStyle(style)
+                flowables.append(t)
+        start += n
+    return flowables
+
+
+def save_top10_schools_chart(rows, out_png, profile=None):
     """
     rows: list of lists, where row[0] is school name, row[1:-1] are grades, row[-1] is total enrollment.
     """
@@ -477,14 +670,14 @@ def save_top10_schools_chart(rows, out_png):
     schools = [r[0] for r in top10]
     totals = [r[-1] for r in top10]
 
-    plt.figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
-    plt.barh(schools, totals)
-    plt.gca().invert_yaxis()  # highest at top
-    plt.title("Top 10 Schools by K–5 Enrollment")
-    plt.xlabel("Students")
-    plt.tight_layout()
-    plt.savefig(out_png, bbox_inches="tight")
-    plt.close()
+    fig = Figure(figsize=(CHART_W_PX/100, CHART_H_PX/100), dpi=100)
+    ax = fig.add_subplot(111)
+    ax.barh(schools, totals)
+    ax.invert_yaxis()  # highest at top
+    ax.set_title("Top 10 Schools by K–5 Enrollment")
+    ax.set_xlabel("Students")
+    fig.tight_layout()
+    save_figure(fig, out_png, profile, bbox_inches="tight")
 
 
 # -----------------------------
@@ -497,109 +690,145 @@ def save_top10_schools_chart(rows, out_png):
 
 
 
-def build_page_one(doc, story, df_enr, ela_info=None, entity_type="district", entity_name=""):
-    styles = getSampleStyleSheet()
+def build_page_one(ctx, doc, story):
+    df_enr, entity_type, entity_name = ctx.df_enr, ctx.entity_type, ctx.entity_name
+    styles = get_template().styles
     heading = f"{entity_name} — Executive Summary" if entity_name else "Executive Summary"
     title = Paragraph(heading, styles["Title"])
     date_p = Paragraph(date.today().strftime("%B %d, %Y"), styles["Normal"])
     story += [title, date_p, Spacer(1, 12)]
 
-    # --- KPIs from real data ---
-    total_k5 = int(df_enr["Total"].sum())
+    # --- KPIs: precomputed for every entity in one pass (kpi.py), with percentile ranks ---
+    try:
+        kpi = kpi_for(entity_type, entity_name, cds=ctx.cds)
+    except Exception as e:
+        print("[warn] KPI table unavailable:", e)
+        kpi = None
+    total_k5 = int(df_enr["Total"].sum())  # this report's own enrollment table
+    if kpi is not None:
+        story.append(kpi_tiles(total_k5, kpi.get("read_gap"), kpi.get("speak_gap"), kpi))
+        story.append(Paragraph(
+            "Percentiles compare against all California "
+            f"{entity_type}s (and those in the same county); higher = larger value.",
+            styles["Italic"]))
+    else:
+        story.append(Paragraph(f"<b>Total K-5 Enrollment:</b> {total_k5:,}", styles["BodyText"]))
 
     # Real CAASPP ELA metrics (district-level)
+    ela_info = ctx.ela_info or {}
     ela_avg = ela_info.get("avg_scale_score")
     ela_gap_vs_benchmark = ela_info.get("gap_vs_benchmark")  # positive = above 2500
     ela_tested = ela_info.get("tested")  # available if you want to show later
-
-    kpi_tiles_list = [
-        ("Total K-5 Enrollment", f"{total_k5:,}"),
-        #commenting out the 2 peices of info with direct CAASPP score and Total average compared to benchmark
-        #("Reading (CAASPP) Avg", f"{ela_avg:.1f}" if ela_avg is not None else "–"),
-        #("Gap vs Standard (2500)", f"{ela_gap_vs_benchmark:+.1f}" if ela_gap_vs_benchmark is not None else "–"),
-    ]
-    for label, value in kpi_tiles_list:
-        story.append(Paragraph(f"<b>{label}:</b> {value}", styles["BodyText"]))
+    #commenting out the 2 peices of info with direct CAASPP score and Total average compared to benchmark
+    #("Reading (CAASPP) Avg", f"{ela_avg:.1f}" if ela_avg is not None else "–"),
+    #("Gap vs Standard (2500)", f"{ela_gap_vs_benchmark:+.1f}" if ela_gap_vs_benchmark is not None else "–"),
     story.append(Spacer(1, 14))
 
     # --- Enrollment by Grade (1–5) on Page 1 ---
     labels = ["1", "2", "3", "4", "5"]
     by_grade = [int(df_enr[g].sum()) if g in df_enr.columns else 0 for g in labels]
 
-    enroll_png = os.path.join(IMG_DIR, "enrollment_g1_5.png")
+    enroll_png = ctx.chart("enrollment_g1_5.png")
     save_bar_chart_with_na(labels, by_grade, enroll_png,
                            title="Enrollment by Grade (1–5)",
-                           y_label="Students")
+                           y_label="Students",
+                           profile=ctx.image_profile)
 
-    enroll_img = Image(enroll_png, width=CHART_W_IN*inch, height=CHART_H_IN*inch)
+    enroll_img = chart_image(enroll_png)
     story.append(enroll_img)
     story.append(Spacer(1, 10))
 
+    if entity_type == "district":
+        build_peer_table(story, entity_name, cds=ctx.cds)
+
+
+def build_peer_table(story, district_name, k=5, cds=None):
+    """The k most similar districts (size, reading gap, speaking gap) from the peer index."""
+    styles = get_template().styles
+    try:
+        peers = peer_districts(district_name, k, cds)
+    except Exception as e:
+        print("[warn] peer index unavailable:", e)
+        return
+    if not peers:
+        return
+    fmt = lambda v, spec: format(v, spec) if v is not None else "–"
+    rows = [["District", "County", "K-5 Enrollment", "Reading Gap", "Speaking Gap"]]
+    rows += [[p.district_name, p.county_name, fmt(p.total_k5, ","),
+              fmt(p.read_gap, ".0f") + ("%" if p.read_gap is not None else ""),
+              fmt(p.speak_gap, ".0f") + ("%" if p.speak_gap is not None else "")] for p in peers]
+    story.append(Paragraph("Similar Districts", styles["Heading3"]))
+    t = Table(rows, colWidths=[2.3*inch, 1.4*inch, 1.3*inch, 1.1*inch, 1.1*inch], rowHeights=ROW_HEIGHT)
+    t.setStyle(get_template().table_styles["peers"])
+    story.append(t)
 
 
-# def build_page_two_enrollment_table(story, df_enr, entity_type="district", entity_name=""):
-#     styles = getSampleStyleSheet()
-#     story.append(PageBreak())
-#     story.append(Paragraph(
-#         "Enrollment by School (K–5)" if entity_type == "district" else f"Enrollment — {entity_name} (K–5)",
-#         styles["Heading2"]
-#     ))
-#     story.append(Spacer(1, 6))
-
-#     # If SCHOOL mode, df_enr will be a single row (one school) — that’s fine.
-#     headers = ["School", "K", "1", "2", "3", "4", "5", "Total"]
-#     rows = df_enr[headers].values.tolist()
-#     # Top-10 chart only really applies in district mode; skip in school mode.
-#     if entity_type == "district":
-#         top10_png = os.path.join(IMG_DIR, "top10_schools.png")
-#         save_top10_schools_chart(rows, top10_png)
-#         story.append(Image(top10_png, width=CHART_W_IN*inch, height=CHART_H_IN*inch))
-#         story.append(Spacer(1, 12))
-
-#     story += build_school_table_flowables(headers, rows)
+
+ENROLLMENT_HEADERS = ["School", "K", "1", "2", "3", "4", "5", "Total"]
+
+
+def _enrollment_table_top(entity_type) -> float:
+    """Points used above the school table on the section's first page."""
+    used = 40  # heading + spacer
+    if entity_type == "district":
+        used += CHART_H_IN*inch + 12  # top-10 chart + spacer
+    return used
+
+
+def enrollment_page_count(ctx) -> int:
+    """Pages build_page_two_enrollment_table fills (no layout needed: rows have a fixed height)."""
+    frame_h = get_template().frame_size[1]
+    return len(table_page_rows(len(ctx.df_enr), frame_h, frame_h - _enrollment_table_top(ctx.entity_type)))
+
+
+def build_page_two_enrollment_table(ctx, doc, story, pages=None):
+    """
+    pages: which of the section's pages to add (indices < enrollment_page_count; 0 carries
+    the heading and chart), default all. assemble.py lays long tables out in pieces this way.
+    """
+    df_enr, entity_type, entity_name = ctx.df_enr, ctx.entity_type, ctx.entity_name
+    styles = get_template().styles
+    first_page = pages is None or 0 in pages
+    if first_page:
+        story.append(PageBreak())
+        story.append(Paragraph(
+            "Enrollment by School (K–5)" if entity_type == "district" else f"Enrollment — {entity_name} (K–5)",
+            styles["Heading2"]
+        ))
+        story.append(Spacer(1, 6))
+
+    # If SCHOOL mode, df_enr will be a single row (one school) — that’s fine.
+    headers = ENROLLMENT_HEADERS
+    rows = [[r[0]] + [int(v) for v in r[1:]] for r in df_enr[headers].values.tolist()]
+    # Top-10 chart only really applies in district mode; skip in school mode.
+    if entity_type == "district" and first_page:
+        top10_png = ctx.chart("top10_schools.png")
+        save_top10_schools_chart(rows, top10_png, profile=ctx.image_profile)
+        story.append(chart_image(top10_png))
+        story.append(Spacer(1, 12))
+
+    # show the thousands separator; widths/pagination are computed from these strings
+    rows = [[r[0]] + [f"{v:,}" for v in r[1:]] for r in rows]
+    size = get_template().frame_size
+    story += build_school_table_flowables(headers, rows, size, first_page_height=size[1] - _enrollment_table_top(entity_type),
+                                          pages=pages)
 
 def sanitize_filename(name: str) -> str:
     """Turn 'Irvine Unified' into 'Irvine_Unified'."""
     return name.replace(" ", "_").replace("/", "-")
 
-def build_references_page(story):
-    styles = getSampleStyleSheet()
-    story.append(PageBreak())
+def build_references_page(story, page_break=True):
+    styles = get_template().styles
+    if page_break:
+        story.append(PageBreak())
     story.append(Paragraph("Data Sources & References", styles["Heading2"]))
     story.append(Spacer(1, 6))
 
     accessed = date.today().strftime("%B %d, %Y")
 
-    refs = [
-        {
-            "title": "California Department of Education — Enrollment by Grade (2024–25)",
-            "desc": "Official enrollment counts by grade for all public schools and districts in California.",
-            "url": "https://www.cde.ca.gov/ds/sd/sd/",
-        },
-        {
-            "title": "CAASPP Research Files — 2024 ELA Summative Assessment",
-            "desc": "ELA (English Language Arts) results for grades 3–8 and 11, including mean scale scores and proficiency levels.",
-            "url": "https://caaspp-elpac.ets.org/caaspp/ResearchFileListSB.aspx",
-        },
-        {
-            "title": "CAASPP Program Overview & Documentation",
-            "desc": "Benchmarks and performance level descriptors for CAASPP ELA.",
-            "url": "https://www.cde.ca.gov/ta/tg/ca/",
-        },
-        {
-            "title": "ELPAC Research Files — 2024 Summative Assessment",
-            "desc": "Speaking domain results for grades 1–5, including performance levels and counts for California public schools and districts.",
-            "url": "https://www.cde.ca.gov/ta/tg/ep/elpacresearch.asp",
-        },
-        {
-            "title": "ELPAC Program Overview & Documentation",
-            "desc": "Benchmarks, domains, and performance level descriptors for the ELPAC.",
-            "url": "https://www.cde.ca.gov/ta/tg/ep/",
-        },
-    ]
 
     items = []
-    for r in refs:
+    for r in REFERENCES:
         html = (
             f"<b>{r['title']}</b><br/>"
             f"<font size=9>{r['desc']}</font><br/>"
@@ -610,49 +839,146 @@ def build_references_page(story):
 
     story.append(ListFlowable(items, bulletType="bullet", start="•"))
     story.append(Spacer(1, 6))
-    story.append(Paragraph(
-        "Notes: Enrollment is sourced from CDE’s statewide census file; CAASPP ELA results are computed as weighted averages across tested grades. "
-        "District-level CAASPP rows are identified by School Code 0000000; “All Students” corresponds to Student Group ID 1.",
-        styles["Italic"]
-    ))
+    story.append(Paragraph(REFERENCES_NOTE, styles["Italic"]))
 
 
-def build_pdf(entity_type, entity_name, out_path=None):
-    # 0) Resolve output path
-    if out_path is None:
-        safe_name = entity_name.replace(" ", "_")
-        out_path = f"reports/{safe_name}_Report.pdf"
+def _tmp_suffix() -> str:
+    """Per process and thread, so concurrent builds never write the same temp file."""
+    return f".{os.getpid()}-{threading.get_ident()}.tmp"
 
-    ensure_dirs()
 
-    # 1) Prepare doc + story
-    doc = SimpleDocTemplate(out_path, pagesize=letter, **PAGE_MARGINS)
+def references_fragment(day=None, cache_dir=STATIC_CACHE_DIR):
+    """
+    The references page as a standalone PDF, laid out once per day (only its "Accessed"
+    date changes) and cached in cache_dir; older days' fragments are removed.
+    """
+    day = day or date.today()
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"references_{day:%Y-%m-%d}.pdf")
+    if os.path.exists(path):
+        return path
+
+    tmp = path + _tmp_suffix()  # concurrent builders never see a half-written fragment
     story = []
+    build_references_page(story, page_break=False)
+    get_template().doc(tmp).build(story)
+    os.replace(tmp, path)
+    for name in os.listdir(cache_dir):
+        if name.startswith("references_") and name.endswith(".pdf") and name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass  # another build cleaned it up first
+    return path
+
+
+def recompress(writer, level):
+    """
+    Re-deflate every page's content stream and image XObjects in a pypdf writer at zlib
+    `level`. reportlab deflates them at zlib's default level and wraps them in ASCII85;
+    this stores each as plain /FlateDecode at `level` instead.
+    """
+    from pypdf.generic import NameObject, StreamObject
+    seen = set()
+    for page in writer.pages:
+        page.compress_content_streams(level=level)
+        xobjects = list(page.get("/Resources", {}).get("/XObject", {}).values())
+        while xobjects:
+            stream = xobjects.pop().get_object()
+            filters = stream.get("/Filter", [])
+            filters = [filters] if isinstance(filters, str) else list(filters)
+            if id(stream) in seen or not set(filters) <= {"/FlateDecode", "/ASCII85Decode"}:
+                continue  # already done, or not ours to re-encode (JPEG, ...)
+            seen.add(id(stream))
+            raw = stream.get_data()
+            stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+            stream.pop("/DecodeParms", None)
+            # the base-class setter: EncodedStreamObject.set_data deflates at the default level
+            StreamObject.set_data(stream, zlib.compress(raw, level))
+            xobjects += stream.get("/Resources", {}).get("/XObject", {}).values()
+
+
+def append_static_pages(pdf_bytes, fragments, out_path, compress_level=None):
+    """
+    Write the laid-out report (`pdf_bytes`) to `out_path` with the cached fragment PDFs
+    appended page by page (links/annotations kept). The report is written to disk once;
+    with compress_level its streams are re-deflated at that level (recompress).
+    """
+    writer = PdfWriter(clone_from=io.BytesIO(pdf_bytes))
+    for frag in fragments:
+        writer.append(frag)
+    if compress_level is not None:
+        recompress(writer, compress_level)
+    tmp = out_path + _tmp_suffix()
+    with open(tmp, "wb") as fh:
+        writer.write(fh)
+    os.replace(tmp, out_path)
 
-    # 2) Data
-    df_enr = get_enrollment_for_report(entity_type, entity_name)
 
-    try:
-        ela_info = summarize_district_ela(entity_type, entity_name)
-    except Exception as e:
-        print("[warn] ELA summary failed:", e)
-        ela_info = {}
-
-    # 3) Build pages
-    build_page_one(
-        doc,
-        story,
-        df_enr,
-        ela_info=ela_info,
-        entity_type=entity_type,
-        entity_name=entity_name,
-    )
-    build_page_caaspp_ela(story, entity_type, entity_name)   # % below standard
-    build_page_elpac_speaking(story, entity_type, entity_name)
-    build_references_page(story)
+# per-build stage timings for this process (batch runs: report_template.batch_summary(BUILD_TIMINGS))
+BUILD_TIMINGS = []
+
+
+def build_pdf(entity_type, entity_name, out_path=None, profile=None, image_profile=None, cds=None):
+    """
+    Build one report (default path: build_context.REPORTS_DIR/<Name>_Report.pdf) and return
+    its absolute path. All per-build state lives in a BuildContext whose chart workspace is
+    removed afterwards, so concurrent calls (threads or processes) are independent.
+    profile: path for a collapsed-stack (flame graph) profile of the layout step, timing
+    every flowable's wrap/split/draw (report_template.ProfilingDocTemplate).
+    image_profile: name in report_template.IMAGE_PROFILES ("default", "archive", "draft")
+    for chart resolution, palette and compression.
+    cds: the entity's (county, district, school) codes; every lookup then goes by code
+    (batch callers pass them, since school names are not unique).
+    """
+    with BuildContext(entity_type, entity_name, out_path, image_profile=image_profile, cds=cds) as ctx:
+        return _build_pdf(ctx, profile)
+
 
-    # 4) Write file
-    doc.build(story)
+def _build_pdf(ctx, profile=None):
+    entity_type, entity_name, out_path = ctx.entity_type, ctx.entity_name, ctx.out_path
+    timings = BuildTimings(entity=f"{entity_type}:{entity_name}", template_reused=bool(BUILD_TIMINGS))
+
+    # 1) Prepare doc + story (in memory when static pages get merged in afterwards)
+    with timed(timings, "template"):
+        tpl = get_template()  # styles/table styles compiled once per process
+        merge_static = PdfWriter is not None
+        buf = io.BytesIO() if merge_static else None
+        doc = tpl.doc(buf if merge_static else out_path, profile=bool(profile))
+    story = []
+
+    # 2) Data
+    with timed(timings, "data"):
+        ctx.df_enr = get_enrollment_for_report(entity_type, entity_name, ctx.cds)
+
+        try:
+            ctx.ela_info = summarize_district_ela(entity_type, entity_name, cds=ctx.cds)
+        except Exception as e:
+            print("[warn] ELA summary failed:", e)
+            ctx.ela_info = {}
+
+    # 3) Build pages (flowables + chart images)
+    with timed(timings, "pages"):
+        build_page_one(ctx, doc, story)
+        build_page_two_enrollment_table(ctx, doc, story)
+        build_page_caaspp_ela(ctx, doc, story)   # % below standard
+        build_page_elpac_speaking(ctx, doc, story)
+        build_page_trends(ctx, doc, story)
+        if not merge_static:
+            build_references_page(story)  # no pypdf: lay the static page out inline
+
+    # 4) Write file (+ the cached static pages)
+    with timed(timings, "layout"):
+        doc.build(story)
+    if profile:
+        doc.profile.write_folded(profile)
+        print(doc.profile.summary())
+        print(f"[layout] flame graph stacks: {profile}")
+    if merge_static:
+        with timed(timings, "merge"):
+            append_static_pages(buf.getvalue(), [references_fragment(cache_dir=ctx.cache_dir)], out_path,
+                                ctx.image_profile.compress_level)
+    BUILD_TIMINGS.append(timings)
 
     # 5) Return path (no printing here; do it in __main__)
     return out_path
@@ -666,10 +992,31 @@ if __name__ == "__main__":
     # ENTITY_TYPE = "district"   # or "school"
     # ENTITY_NAME = "Irvine Unified"
 
+    # --profile FILE: write a flame-graph profile of the layout step (builds in this process;
+    # otherwise the sections are laid out in parallel by assemble.build_pdf)
+    profile = None
+    if "--profile" in sys.argv:
+        i = sys.argv.index("--profile")
+        profile = sys.argv[i + 1] if i + 1 < len(sys.argv) else "layout.folded"
+        del sys.argv[i:i + 2]
+
+    # --image-profile NAME: chart dpi / palette / compression (report_template.IMAGE_PROFILES)
+    image_profile = None
+    if "--image-profile" in sys.argv:
+        i = sys.argv.index("--image-profile")
+        image_profile = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+
+    # --strict: a name without an exact match is an error (no prompt, no best guess)
+    strict = "--strict" in sys.argv
+    if strict:
+        sys.argv.remove("--strict")
+
     # CLI overrides globals if provided:
     #   python src/build_report.py
     #   python src/build_report.py district "Alameda Unified"
     #   python src/build_report.py school "ARISE High"
+    #   python src/build_report.py --strict district "Alameda"   # exit 1 unless the name matches exactly
     if len(sys.argv) >= 3:
         etype = sys.argv[1].strip().lower()       # "district" | "school"
         ename = " ".join(sys.argv[2:]).strip()
@@ -678,7 +1025,46 @@ if __name__ == "__main__":
         etype = (globals().get("ENTITY_TYPE") or "district").strip().lower()
         ename = (globals().get("ENTITY_NAME") or "Alameda Unified").strip()
 
+    # Catch misspelled names before any research file is parsed
+    try:
+        resolver = entity_resolver.get_resolver()
+    except FileNotFoundError:
+        resolver = None  # no entities files: build with the name as given
+    if resolver is not None and resolver.lookup(ename, etype) is None:
+        suggestions = resolver.resolve(ename, etype, limit=5)
+        if not suggestions:
+            sys.exit(f"[error] No {etype} named {ename!r} in the entities files.")
+        print(f"[warn] No {etype} named {ename!r}. Did you mean:")
+        for i, c in enumerate(suggestions, 1):
+            print(f"  {i}. {c.name}  ({c.county_name} County, CDS {c.cds_code})")
+        if strict:
+            sys.exit(1)
+        if not sys.stdin.isatty():
+            # scripted / batch runs: take the best match rather than failing the run
+            print(f"[warn] Not a terminal: using the top match {suggestions[0].name!r}")
+            idx = 0
+        else:
+            while True:
+                choice = input("Pick a number (Enter = 1, q = quit): ").strip().lower()
+                if choice == "q":
+                    sys.exit(1)
+                if choice == "":
+                    idx = 0
+                    break
+                if choice.isdigit() and 1 <= int(choice) <= len(suggestions):
+                    idx = int(choice) - 1
+                    break
+                print(f"  Enter a number from 1 to {len(suggestions)}, or q.")
+        ename = suggestions[idx].name
+    elif resolver is not None:
+        ename = resolver.lookup(ename, etype).name  # canonical spelling
+
     print(f"[info] Building report for {etype!r}: {ename}")
-    out_path = build_pdf(etype, ename)
+    if profile:
+        out_path, timings = build_pdf(etype, ename, profile=profile, image_profile=image_profile), BUILD_TIMINGS
+    else:
+        import assemble
+        out_path, timings = assemble.build_pdf(etype, ename, image_profile=image_profile), assemble.br.BUILD_TIMINGS
     print(f"[info] PDF successfully built at: {out_path}")
+    print(batch_summary(timings))
 
@@ -1,8 +1,13 @@
 # src/caaspp_summary.py
 import re
+from functools import lru_cache
 import pandas as pd
 from pathlib import Path
 
+from cde_io import cds_level, cds_rows, normalize_code, normalize_grade, normalize_numeric, read_chunked, read_delimited, resolve_data_path
+from schema import file_column_map
+import snapshot
+
 # Resolve paths relative to the repo root (one level up from src/)
 BASE_DIR = Path(__file__).resolve().parents[1]
 DEFAULT_CAASPP_PATH = BASE_DIR / "data_raw" / "caaspp_2024_ela.txt"
@@ -11,98 +16,211 @@ BENCHMARK = 2500.0
 VALID_GRADES = {"3", "4", "5", "6", "7", "8", "11"}
 ALL_STUDENTS_ID = "1"  # All Students subgroup id in the CAASPP file
 
+# Smarter Balanced "Test ID" codes in the research file
+TEST_IDS = {"ELA": 1, "Math": 2}
+DEFAULT_SUBJECT = "ELA"
+
+# Canonical columns (schema.CAASPP_SCHEMA), normalized once at load
+CODE_COLS  = ["county_code", "district_code", "school_code", "test_id", "student_group"]
+COUNT_COLS = ["tested", "enrolled"]
+SCORE_COLS = ["mean_scale_score", "pct_exceeded", "pct_met", "pct_nearly_met", "pct_not_met"]
+NAME_COLS  = ["county_name", "district_name", "school_name"]
+
+def resolve_caaspp_path(filepath: str | None = None) -> Path:
+    # plain .txt, or the CDE .zip / a .gz / .xz copy next to it
+    return resolve_data_path(filepath, DEFAULT_CAASPP_PATH, "Put the CAASPP research file (.txt/.zip/.gz/.xz) there.")
+
 def _read_caaspp(filepath: str | None = None) -> pd.DataFrame:
     """
-    Read the statewide CAASPP ELA research file (caret-delimited).
+    Read the statewide CAASPP research file (caret-delimited), original headers.
     If `filepath` is None or relative, resolve it relative to the repo root.
+    Zipped/gzipped/xz downloads are streamed straight into the parser.
     """
-    path = Path(filepath) if filepath else DEFAULT_CAASPP_PATH
-    if not path.is_absolute():
-        path = BASE_DIR / path
-    if not path.exists():
-        raise FileNotFoundError(f"Missing {path}. Put the CAASPP ELA research file there.")
+    path = resolve_caaspp_path(filepath)
 
     # CAASPP research files are caret-delimited with headers on the first row
-    return pd.read_csv(path, sep="^", engine="python", header=0, dtype=str, encoding="latin1")
+    return read_delimited(path, sep="^", dtype=str)
 
 
-# --- % Below Standard (Not Met + Nearly Met) by grade for a district ---
-def district_ela_pct_below_standard_by_grade(district_name: str, filepath: str | None = None):
+def _max_tested_per_grade(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per (test, entity, grade): the one with the largest tested count."""
+    if df.empty:
+        return df
+    key = [c for c in ("test_id", "county_code", "district_code", "school_code",
+                       "district_name", "school_name", "grade") if c in df.columns]
+    order = df["tested"].sort_values(ascending=False, kind="stable").index
+    return df.loc[order].drop_duplicates(subset=key, keep="first")
+
+
+def _caaspp_metric_rows(chunk: pd.DataFrame) -> pd.DataFrame:
     """
-    Returns (labels, pct_below, tested) for grades 1–5, where:
-      pct_below = Percentage Standard Not Met + Percentage Standard Nearly Met (0–100)
-    Source rows: district-level (School Code 0/0000000), All Students (Student Group ID = 1).
+    Reduce canonical-named research-file rows to what the metric functions read and
+    normalize them once:
+      - All Students, tested grades (3–8, 11), one max-tested row per entity and grade
+      - CDS codes / test_id / student_group as ints ('0000000' -> 0)
+      - canonical grade codes ('03' -> '3'), stripped names
+      - tested counts as ints (suppressed -> 0); scale scores and percentages as floats
+        (suppressed -> NaN) with '<col>_suppressed' masks
     """
-    df = _read_caaspp(filepath)  # <-- single source of truth for path + reading
-
-    # Column names in the statewide research file
-    COL_DNAME  = "District Name"
-    COL_SCODE  = "School Code"
-    COL_SGID   = "Student Group ID"
-    COL_GRADE  = "Grade"
-    # prefer Tested-with-scores if present, else Total Tested
-    COL_TESTED = (
-        "Total Students Tested with Scores"
-        if "Total Students Tested with Scores" in df.columns
-        else "Total Students Tested"
+    if "student_group" in chunk.columns:
+        chunk = chunk[chunk["student_group"].astype(str).str.strip() == ALL_STUDENTS_ID]
+    grade = normalize_grade(chunk["grade"])
+    chunk = chunk[grade.isin(VALID_GRADES)].copy()
+    chunk["grade"] = grade[chunk.index]
+
+    for c in CODE_COLS:
+        if c in chunk.columns:
+            chunk[c] = normalize_code(chunk[c])
+    for c in NAME_COLS:
+        if c in chunk.columns:
+            chunk[c] = chunk[c].fillna("").astype(str).str.strip()
+    normalize_numeric(chunk, COUNT_COLS, fill=0)
+    for c in COUNT_COLS:
+        if c in chunk.columns:
+            chunk[c] = chunk[c].astype(int)
+    normalize_numeric(chunk, SCORE_COLS)
+    for c in SCORE_COLS:
+        if c not in chunk.columns:  # older vintages: keep the canonical set fixed
+            chunk[c] = float("nan")
+    if "school_name" not in chunk.columns:
+        chunk["school_name"] = ""
+    return _max_tested_per_grade(chunk)
+
+
+@lru_cache(maxsize=4)
+def _load_caaspp_subjects(path: str, mtime: float) -> dict:
+    """
+    Parse the research file once and split its rows by Test ID.
+    Cached per (path, mtime) so every metric call for every subject shares one parse;
+    a re-downloaded file (new mtime) is picked up automatically.
+    Headers are mapped to the canonical schema once per file (schema.file_column_map);
+    only mapped columns are parsed.
+    With a memory budget (cde_io.MEMORY_BUDGET_MB / CA_REPORT_MEMORY_MB) the file is
+    reduced chunk by chunk and the per-grade max-tested rows are merged across chunks.
+    A new process reads the normalized frames from their snapshot (snapshot.py) when one
+    exists for this exact file, and writes it after parsing otherwise.
+    """
+    cached = snapshot.load("caaspp", path)
+    if cached is not None:
+        return cached
+    mapping = file_column_map(path, "^", "CAASPP")
+    df = read_chunked(
+        path, "^",
+        reduce=lambda chunk: _caaspp_metric_rows(chunk.rename(columns=mapping)),
+        merge=lambda acc, part: _max_tested_per_grade(pd.concat([acc, part])),
+        usecols=list(mapping),
+        dtype=str,
     )
-    COL_PCT_L1 = "Percentage Standard Not Met"
-    COL_PCT_L2 = "Percentage Standard Nearly Met"
+    if "test_id" not in df.columns:
+        # single-subject extract (e.g. caaspp_2024_ela.txt with the Test ID column dropped)
+        subjects = {DEFAULT_SUBJECT: df}
+    else:
+        by_code = {code: part for code, part in df.groupby("test_id", sort=False)}
+        subjects = {subject: by_code[code] for subject, code in TEST_IDS.items() if code in by_code}
+    snapshot.save("caaspp", path, subjects)
+    return subjects
 
-    required = [COL_DNAME, COL_SCODE, COL_SGID, COL_GRADE, COL_TESTED, COL_PCT_L1, COL_PCT_L2]
-    missing = [c for c in required if c not in df.columns]
-    if missing:
-        raise ValueError(f"CAASPP: missing columns {missing}\nHave: {list(df.columns)}")
 
-    # District match (tolerant of 'School District' suffix)
+def load_caaspp_subject(subject: str = DEFAULT_SUBJECT, filepath: str | None = None) -> pd.DataFrame:
+    """
+    CAASPP rows for one subject ("ELA" or "Math"): All Students, tested grades,
+    one (largest tested) row per entity and grade, with canonical column names
+    (schema.CAASPP_SCHEMA) and normalized values (see _caaspp_metric_rows).
+    The returned frame is shared between callers: filter/copy before mutating it.
+    """
+    if subject not in TEST_IDS:
+        raise ValueError(f"Unknown CAASPP subject {subject!r}. Expected one of {list(TEST_IDS)}.")
+    path = resolve_caaspp_path(filepath)
+    subjects = _load_caaspp_subjects(str(path), path.stat().st_mtime)
+    if subject not in subjects:
+        raise ValueError(f"No {subject} rows (Test ID {TEST_IDS[subject]}) in {path}.")
+    return subjects[subject]
+
+
+ENTITY_COLS = ["county_code", "district_code", "school_code",
+               "county_name", "district_name", "school_name"]
+
+
+def caaspp_grade_table(filepath: str | None = None) -> pd.DataFrame:
+    """
+    Per-entity, per-grade CAASPP metrics for every subject in the file, built from the
+    shared parse: one row per (subject, entity, grade) with
+      level (state/county/district/school), CDS codes and names, grade, tested,
+      mean_scale_score, pct_below (Not Met + Nearly Met; NaN when both are suppressed).
+    This is the compact table the metric store keeps per year.
+    """
+    path = resolve_caaspp_path(filepath)
+    subjects = _load_caaspp_subjects(str(path), path.stat().st_mtime)
+    parts = []
+    for subject, df in subjects.items():
+        part = df[ENTITY_COLS + ["grade", "tested", "mean_scale_score"]].copy()
+        part.insert(0, "subject", subject)
+        part.insert(1, "level", cds_level(df))
+        part["pct_below"] = df[["pct_not_met", "pct_nearly_met"]].sum(axis=1, min_count=1)
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def _district_rows(df: pd.DataFrame, district_name: str, cds=None) -> pd.DataFrame:
+    """
+    District-level rows for the district with codes `cds` (county, district, school), or else
+    whose name contains `district_name` (tolerant of a 'School District' suffix).
+    """
+    if cds is not None:
+        work = cds_rows(df, (cds[0], cds[1], 0))
+        if work.empty:
+            raise ValueError(f"No CAASPP rows found for district {district_name!r} (codes {cds[0]}/{cds[1]}).")
+        return (work.sort_values(["grade", "tested"], ascending=[True, False])
+                    .drop_duplicates(subset=["grade"], keep="first"))
     norm = lambda s: re.sub(r"\s+school\s+district$", "", str(s or "").strip(), flags=re.I)
     target = norm(district_name).lower()
-    work = df[df[COL_DNAME].astype(str).str.lower().str.contains(target, na=False)].copy()
+    work = df[df["district_name"].str.lower().str.contains(target, na=False, regex=False)]
     if work.empty:
         raise ValueError(f"No CAASPP rows found for district containing '{district_name}'.")
 
-    # District-level only (School Code == 0 or 0000000)
-    sc = work[COL_SCODE].astype(str).str.strip()
-    work = work[(sc == "0") | (sc == "0000000")].copy()
+    # District-level only (School Code 0000000 -> 0 at load)
+    work = work[work["school_code"] == 0]
     if work.empty:
         raise ValueError("Found district, but no district-level rows (School Code == 0000000).")
 
-    # All Students, CAASPP-valid grades
-    work = work[work[COL_SGID].astype(str).str.strip() == ALL_STUDENTS_ID].copy()
-    work[COL_GRADE] = work[COL_GRADE].astype(str).str.strip()
-    valid_caaspp = {"3", "4", "5", "6", "7", "8", "11"}
-    work = work[work[COL_GRADE].isin(valid_caaspp)].copy()
-
-    # Coerce numerics
-    work[COL_TESTED] = pd.to_numeric(work[COL_TESTED], errors="coerce").fillna(0).astype(int)
-    work[COL_PCT_L1] = pd.to_numeric(work[COL_PCT_L1], errors="coerce")  # already percentages 0–100
-    work[COL_PCT_L2] = pd.to_numeric(work[COL_PCT_L2], errors="coerce")
-
-    # One row per grade: pick the largest tested count when duplicates exist
-    work = (
-        work.sort_values([COL_GRADE, COL_TESTED], ascending=[True, False])
-            .drop_duplicates(subset=[COL_GRADE], keep="first")
-    )
+    # One row per grade: pick the largest tested count when several districts match
+    return (work.sort_values(["grade", "tested"], ascending=[True, False])
+                .drop_duplicates(subset=["grade"], keep="first"))
+
+
+# --- % Below Standard (Not Met + Nearly Met) by grade for a district ---
+def district_ela_pct_below_standard_by_grade(district_name: str, filepath: str | None = None,
+                                              subject: str = DEFAULT_SUBJECT, cds=None):
+    """
+    Returns (labels, pct_below, tested) for grades 1–5, where:
+      pct_below = Percentage Standard Not Met + Percentage Standard Nearly Met (0–100)
+    Source rows: district-level (School Code 0/0000000), All Students (Student Group ID = 1).
+    `subject` picks the test ("ELA" or "Math") from the shared parse of the research file;
+    `cds` picks the district by its codes instead of its name.
+    """
+    df = load_caaspp_subject(subject, filepath)  # <-- single source of truth; canonical + normalized
+    work = _district_rows(df, district_name, cds)
 
     # Output x-axis 1–5 (grades 1–2 will show None/N/A)
     axis = ["1", "2", "3", "4", "5"]
     pct_map  = {g: None for g in axis}
     test_map = {g: 0    for g in axis}
 
-    for _, r in work.iterrows():
-        g = r[COL_GRADE]                      # '3','4','5',...
+    for r in work.itertuples(index=False):
+        g = r.grade                           # '3','4','5',...
         if g in pct_map:                      # only fills 3–5; 1–2 stay None
-            p = (r[COL_PCT_L1] if pd.notna(r[COL_PCT_L1]) else 0.0) + \
-                (r[COL_PCT_L2] if pd.notna(r[COL_PCT_L2]) else 0.0)
+            p = (r.pct_not_met if pd.notna(r.pct_not_met) else 0.0) + \
+                (r.pct_nearly_met if pd.notna(r.pct_nearly_met) else 0.0)
             pct_map[g]  = float(p)
-            test_map[g] = int(r[COL_TESTED])
+            test_map[g] = int(r.tested)
 
     labels    = axis
     pct_below = [pct_map[g]  for g in labels]  # [None, None, %, %, %]
     tested    = [test_map[g] for g in labels]  # [0, 0, n, n, n]
     return labels, pct_below, tested
 
-def district_ela_by_grade(district_name: str, filepath: str | None = None):
+def district_ela_by_grade(district_name: str, filepath: str | None = None,
+                          subject: str = DEFAULT_SUBJECT, cds=None):
     """
     Returns (axis, scores, tested):
 
@@ -112,121 +230,61 @@ def district_ela_by_grade(district_name: str, filepath: str | None = None):
 
     Filters to district-level rows (School Code 0/0000000),
     All Students (Student Group ID=1), and for each grade keeps the row
-    with the largest tested count.
+    with the largest tested count. `subject` is "ELA" (default) or "Math"; `cds` picks
+    the district by its codes instead of its name.
     """
-    df = _read_caaspp(filepath)
-
-    COL_DNAME  = "District Name"
-    COL_SCODE  = "School Code"
-    COL_SGID   = "Student Group ID"
-    COL_GRADE  = "Grade"
-    COL_TESTED = (
-        "Total Students Tested with Scores"
-        if "Total Students Tested with Scores" in df.columns
-        else "Total Students Tested"
-    )
-    COL_AVG    = "Mean Scale Score"
-
-    # District match (tolerant of “School District” suffix)
-    norm = lambda s: re.sub(r"\s+school\s+district$", "", str(s or "").strip(), flags=re.I)
-    target = norm(district_name).lower()
-    work = df[df[COL_DNAME].astype(str).str.lower().str.contains(target, na=False)].copy()
-
-    # District-level only
-    sc = work[COL_SCODE].astype(str).str.strip()
-    work = work[(sc == "0") | (sc == "0000000")].copy()
-
-    # All Students, CAASPP-valid grades
-    work = work[work[COL_SGID].astype(str).str.strip() == ALL_STUDENTS_ID].copy()
-    work[COL_GRADE] = work[COL_GRADE].astype(str).str.strip()
-    work = work[work[COL_GRADE].isin(VALID_GRADES)].copy()  # {'3','4','5','6','7','8','11'}
-
-    # Numerics
-    work[COL_TESTED] = pd.to_numeric(work[COL_TESTED], errors="coerce").fillna(0).astype(int)
-    work[COL_AVG]    = pd.to_numeric(work[COL_AVG],    errors="coerce")
-
-    # One row per grade (largest tested)
-    work = (
-        work.sort_values([COL_GRADE, COL_TESTED], ascending=[True, False])
-            .drop_duplicates(subset=[COL_GRADE], keep="first")
-    )
+    df = load_caaspp_subject(subject, filepath)  # All Students, tested grades, canonical + normalized
+    work = _district_rows(df, district_name, cds)
 
     # Map to 1–5 axis
     axis = ["1", "2", "3", "4", "5"]
     score_map  = {g: None for g in axis}
     tested_map = {g: 0    for g in axis}
 
-    for _, r in work.iterrows():
-        g = r[COL_GRADE]  # '3','4','5',...
+    for r in work.itertuples(index=False):
+        g = r.grade  # '3','4','5',...
         if g in score_map:
-            score_map[g]  = float(r[COL_AVG]) if pd.notna(r[COL_AVG]) else None
-            tested_map[g] = int(r[COL_TESTED])
+            score_map[g]  = float(r.mean_scale_score) if pd.notna(r.mean_scale_score) else None
+            tested_map[g] = int(r.tested)
 
     scores = [score_map[g]  for g in axis]
     tested = [tested_map[g] for g in axis]
     return axis, scores, tested
 
-# put near the top with your other imports/utilities
-def _pick_col(df, candidates):
-    """Return the first candidate column that exists in df, else raise."""
-    for c in candidates:
-        if c in df.columns:
-            return c
-    raise KeyError(f"None of the columns found: {candidates}. Have: {list(df.columns)}")
-
-
 def summarize_district_ela(entity_type: str,
                   entity_name: str,
                   filepath: str | None = None,
-                  benchmark: float = BENCHMARK) -> dict:
+                  benchmark: float = BENCHMARK,
+                  subject: str = DEFAULT_SUBJECT,
+                  cds=None) -> dict:
     """
-    Compute weighted-average CAASPP ELA scale score and gap vs benchmark
-    for either a DISTRICT or a SCHOOL.
+    Compute weighted-average CAASPP scale score and gap vs benchmark
+    for either a DISTRICT or a SCHOOL, for one subject ("ELA" or "Math").
+    `cds` = (county, district, school) codes picks the entity instead of its name.
     """
-    df = _read_caaspp(filepath)
-
-    # column names (handle both spaced and unspaced variants)
-    COL_DNAME  = _pick_col(df, ["District Name", "DistrictName"])
-    COL_SNAME  = _pick_col(df, ["School Name", "SchoolName"])
-    COL_SCODE  = _pick_col(df, ["School Code", "SchoolCode"])
-    COL_SGID   = _pick_col(df, ["Student Group ID", "StudentGroupID"])
-    COL_GRADE  = _pick_col(df, ["Grade"])
-    COL_AVG    = _pick_col(df, ["Mean Scale Score", "MeanScaleScore"])
-    COL_TESTED = "Total Students Tested with Scores" if "Total Students Tested with Scores" in df.columns \
-                 else _pick_col(df, ["Total Students Tested", "TotalTested"])
-
-    # filter by entity
-    if entity_type.lower() == "district":
+    df = load_caaspp_subject(subject, filepath)
+
+    # filter by entity (names stripped and school_code as int at load)
+    if entity_type.lower() not in ("district", "school"):
+        raise ValueError(f"Unknown entity_type: {entity_type}")
+    if cds is not None:
+        work = cds_rows(df, cds)
+    elif entity_type.lower() == "district":
         # district-level rows only (School Code 0/0000000)
-        sc = df[COL_SCODE].astype(str).str.strip()
-        work = df[(df[COL_DNAME].astype(str).str.strip() == entity_name) &
-                  ((sc == "0") | (sc == "0000000"))].copy()
-    elif entity_type.lower() == "school":
-        # school-level rows (School Code != 0)
-        sc = df[COL_SCODE].astype(str).str.strip()
-        work = df[(df[COL_SNAME].astype(str).str.strip() == entity_name) &
-                  ((sc != "0") & (sc != "0000000"))].copy()
+        work = df[(df["district_name"] == entity_name) & (df["school_code"] == 0)]
     else:
-        raise ValueError(f"Unknown entity_type: {entity_type}")
+        # school-level rows (School Code != 0)
+        work = df[(df["school_name"] == entity_name) & (df["school_code"] != 0)]
 
     if work.empty:
-        raise ValueError(f"No CAASPP rows found for {entity_type}='{entity_name}'.")
-
-    # All Students, tested grades only (3–8,11)
-    work = work[work[COL_SGID].astype(str).str.strip() == "1"].copy()
-    work[COL_GRADE] = work[COL_GRADE].astype(str).str.strip()
-    work = work[work[COL_GRADE].isin({"3", "4", "5", "6", "7", "8", "11"})].copy()
-
-    # numerics
-    work[COL_TESTED] = pd.to_numeric(work[COL_TESTED], errors="coerce").fillna(0).astype(int)
-    work[COL_AVG]    = pd.to_numeric(work[COL_AVG], errors="coerce")
+        raise ValueError(f"No CAASPP {subject} rows found for {entity_type}='{entity_name}'.")
 
-    # one row per grade (largest tested count)
-    work = (work.sort_values([COL_GRADE, COL_TESTED], ascending=[True, False])
-                .drop_duplicates(subset=[COL_GRADE], keep="first"))
+    # rows are All Students, tested grades only (3–8,11) already; one row per grade (largest tested count)
+    work = (work.sort_values(["grade", "tested"], ascending=[True, False])
+                .drop_duplicates(subset=["grade"], keep="first"))
 
-    tested = int(work[COL_TESTED].sum())
-    weighted_sum = float((work[COL_AVG] * work[COL_TESTED]).sum())
+    tested = int(work["tested"].sum())
+    weighted_sum = float((work["mean_scale_score"] * work["tested"]).sum())
     avg_scale = (weighted_sum / tested) if tested > 0 else float("nan")
     gap_vs_benchmark = (avg_scale - benchmark) if pd.notna(avg_scale) else float("nan")
 
@@ -234,6 +292,7 @@ def summarize_district_ela(entity_type: str,
     return {
         "entity": label,
         "entity_type": entity_type,
+        "subject": subject,
         "avg_scale_score": round(avg_scale, 1) if pd.notna(avg_scale) else None,
         "gap_vs_benchmark": round(gap_vs_benchmark, 1) if pd.notna(gap_vs_benchmark) else None,
         "tested": tested,
@@ -0,0 +1,230 @@
+# src/cde_io.py
+import gzip
+import io
+import lzma
+import os
+import resource
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Resolve paths relative to the repo root (one level up from src/)
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+# CDE ships research files as .zip; we also accept re-compressed .gz/.xz copies
+COMPRESSED_SUFFIXES = (".zip", ".gz", ".xz")
+TEXT_MEMBER_SUFFIXES = (".txt", ".csv", ".tsv", ".dat")
+READ_BUFFER = 1 << 20  # 1 MiB decompression reads feeding the parser
+
+# ---- Memory-budgeted (chunked) mode ----
+# None = parse whole files at once (fast, needs ~1–2 GB for the statewide research files).
+# Set a budget in MB (or export CA_REPORT_MEMORY_MB) to stream files in bounded chunks,
+# reducing each chunk to the rows/columns the metrics need before keeping it.
+MEMORY_BUDGET_MB = None
+CHUNK_SHARE = 0.5        # fraction of the remaining headroom one raw chunk may use
+OBJECT_CELL_BYTES = 64   # pandas object cell: pointer + small str object
+MIN_CHUNK_ROWS = 2_000
+SAMPLE_CHARS = 256 * 1024
+
+
+def resolve_data_path(filepath, default: Path, missing_msg: str) -> Path:
+    """
+    Resolve `filepath` (or `default`) against the repo root. If the plain text file is
+    not there, fall back to a compressed download next to it, e.g.
+      data_raw/caaspp_2024_ela.txt -> caaspp_2024_ela.txt.gz / caaspp_2024_ela.zip
+    """
+    path = Path(filepath) if filepath else Path(default)
+    if not path.is_absolute():
+        path = BASE_DIR / path
+    if path.exists():
+        return path
+
+    for suffix in COMPRESSED_SUFFIXES:
+        for cand in (path.with_name(path.name + suffix), path.with_suffix(suffix)):
+            if cand.exists():
+                return cand
+    raise FileNotFoundError(f"Missing {path}. {missing_msg}")
+
+
+def _zip_member(zf: zipfile.ZipFile) -> zipfile.ZipInfo:
+    """The data file inside a CDE archive: the largest text-like member."""
+    members = [m for m in zf.infolist() if not m.is_dir()]
+    text = [m for m in members if m.filename.lower().endswith(TEXT_MEMBER_SUFFIXES)]
+    if not (text or members):
+        raise ValueError(f"{zf.filename} is an empty archive.")
+    return max(text or members, key=lambda m: m.file_size)
+
+
+@contextmanager
+def open_text(path, encoding: str = "latin1"):
+    """
+    Yield a text stream over `path`. Compressed inputs (.zip/.gz/.xz) are decompressed
+    incrementally as the parser pulls lines, so nothing is extracted to disk.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    zf = None
+    if suffix == ".zip":
+        zf = zipfile.ZipFile(path)
+        raw = zf.open(_zip_member(zf))
+    elif suffix == ".gz":
+        raw = gzip.open(path, "rb")
+    elif suffix == ".xz":
+        raw = lzma.open(path, "rb")
+    else:
+        raw = open(path, "rb", buffering=READ_BUFFER)
+
+    try:
+        with io.TextIOWrapper(io.BufferedReader(raw, READ_BUFFER), encoding=encoding, newline="") as fh:
+            yield fh
+    finally:
+        raw.close()
+        if zf is not None:
+            zf.close()
+
+
+def read_delimited(path, sep: str, **kwargs) -> pd.DataFrame:
+    """pd.read_csv over a (possibly compressed) CDE file, latin1 text."""
+    kwargs.setdefault("header", 0)
+    kwargs.setdefault("engine", "python")
+    with open_text(path) as fh:
+        return pd.read_csv(fh, sep=sep, **kwargs)
+
+
+# ---- Ingest normalization ----
+# CDE marks suppressed cells (n < 11) with "*"; blanks mean "not reported".
+SUPPRESSED_MARKERS = ("*", "")
+SUPPRESSED_SUFFIX = "_suppressed"
+
+
+def normalize_numeric(df: pd.DataFrame, cols, fill=None) -> pd.DataFrame:
+    """
+    Replace str columns with numbers in place. For each column also add a boolean
+    '<col>_suppressed' mask (True where the file had '*' or a blank), so callers can
+    tell "suppressed" from a real zero after `fill` is applied.
+    """
+    for c in cols:
+        if c not in df.columns:
+            continue
+        raw = df[c]
+        if raw.dtype == object or pd.api.types.is_string_dtype(raw):
+            df[c + SUPPRESSED_SUFFIX] = raw.isna().to_numpy() | raw.str.strip().isin(SUPPRESSED_MARKERS).to_numpy()
+        num = pd.to_numeric(raw, errors="coerce")
+        df[c] = num.fillna(fill) if fill is not None else num
+    return df
+
+
+def normalize_grade(s: pd.Series) -> pd.Series:
+    """Canonical grade codes: '03' -> '3', ' 11' -> '11'; 'KN', 'TK', '13' unchanged."""
+    return s.astype(str).str.strip().str.replace(r"^0+(?=\d)", "", regex=True)
+
+
+def normalize_code(s: pd.Series) -> pd.Series:
+    """CDS code column -> nullable int ('0000000' -> 0, '01' -> 1, blank -> <NA>)."""
+    return pd.to_numeric(s.astype(str).str.strip(), errors="coerce").astype("Int64")
+
+
+def cds_level(df: pd.DataFrame) -> pd.Series:
+    """
+    Aggregation level of each row from its (int) CDS codes:
+    'school' (school code set), 'district', 'county' or 'state' (all zero).
+    """
+    school   = df["school_code"].fillna(0).to_numpy() != 0
+    district = df["district_code"].fillna(0).to_numpy() != 0
+    county   = df["county_code"].fillna(0).to_numpy() != 0
+    level = np.select([school, district, county], ["school", "district", "county"], default="state")
+    return pd.Series(level, index=df.index)
+
+
+def cds_rows(df: pd.DataFrame, cds) -> pd.DataFrame:
+    """
+    The rows of one entity by its (county, district, school) codes; school 0 picks the
+    district's own rows. Unlike names, codes are unique (hundreds of schools share a name).
+    """
+    county, district, school = cds
+    return df[(df["county_code"] == county) & (df["district_code"] == district) & (df["school_code"] == school)]
+
+
+def cds_code(cds) -> str:
+    """(county, district, school) codes -> the 14-digit CDS code, e.g. (1, 61119, 130229) -> '01611190130229'."""
+    county, district, school = (int(c) for c in cds)
+    return f"{county:02d}{district:05d}{school:07d}"
+
+
+def parse_cds(code: str) -> tuple[int, int, int]:
+    """'01611190130229' -> (1, 61119, 130229)."""
+    code = code.strip()
+    if len(code) != 14 or not code.isdigit():
+        raise ValueError(f"Not a 14-digit CDS code: {code!r}")
+    return int(code[:2]), int(code[2:7]), int(code[7:])
+
+
+def memory_budget_mb():
+    """Configured peak-RSS budget in MB (env CA_REPORT_MEMORY_MB overrides MEMORY_BUDGET_MB)."""
+    env = os.environ.get("CA_REPORT_MEMORY_MB", "").strip()
+    return float(env) if env else MEMORY_BUDGET_MB
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process right now (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _row_bytes(path, sep: str) -> float:
+    """Estimated in-memory size of one parsed dtype=str row, from a sample of the file."""
+    with open_text(path) as fh:
+        sample = fh.read(SAMPLE_CHARS)
+    lines = sample.splitlines()
+    ncols = lines[0].count(sep) + 1 if lines else 1
+    body = lines[1:-1] or lines
+    avg_len = sum(len(l) for l in body) / max(len(body), 1)
+    return ncols * OBJECT_CELL_BYTES + 2 * avg_len
+
+
+def read_chunked(path, sep: str, reduce, merge=None, budget_mb=None, **kwargs) -> pd.DataFrame:
+    """
+    Parse a CDE file and return reduce(frame).
+
+    Without a memory budget this is reduce(read_delimited(...)). With one, the file is
+    pulled in chunks sized from the remaining RSS headroom; each chunk is reduced as soon
+    as it is parsed and the raw chunk is dropped, so only the reduced data accumulates.
+      reduce(chunk) -> partial result
+      merge(acc, partial) -> combined partial (default: collect and concat once at the end);
+                             use it for partial aggregates such as per-grade max-tested rows.
+    Chunks shrink when RSS approaches the budget; the floor is MIN_CHUNK_ROWS rows.
+    """
+    budget = memory_budget_mb() if budget_mb is None else budget_mb
+    if not budget:
+        return reduce(read_delimited(path, sep, **kwargs))
+
+    kwargs.setdefault("header", 0)
+    kwargs.setdefault("engine", "python")
+    row_bytes = _row_bytes(path, sep)
+    parts, acc = [], None
+    with open_text(path) as fh:
+        reader = pd.read_csv(fh, sep=sep, iterator=True, **kwargs)
+        while True:
+            headroom = max(budget - current_rss_mb(), 0) * 2**20
+            rows = max(MIN_CHUNK_ROWS, int(headroom * CHUNK_SHARE / row_bytes))
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                break
+            part = reduce(chunk)
+            del chunk
+            if merge is None:
+                parts.append(part)
+            else:
+                acc = part if acc is None else merge(acc, part)
+
+    if merge is None:
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    return acc if acc is not None else pd.DataFrame()
@@ -0,0 +1,232 @@
+# src/entity_resolver.py
+# Fast fuzzy lookup of district / school / county names over the CDE entities files.
+#
+# A normalized-name dictionary answers exact hits; a trigram inverted index (numpy
+# posting arrays) ranks near misses and partial names, so a misspelled district is
+# caught before any research file is parsed.
+#
+#   python src/entity_resolver.py query "irvin unifed"
+#   python src/entity_resolver.py serve --port 8765     # GET /autocomplete?q=irv&level=district
+import argparse
+import bisect
+import json
+import re
+import unicodedata
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from cde_io import BASE_DIR, cds_level, normalize_code, read_delimited
+from schema import file_column_map
+
+DEFAULT_ENTITIES_PATHS = (
+    BASE_DIR / "data_raw" / "caaspp_2024_entities.txt",
+    BASE_DIR / "data_raw" / "sa_elpac2024_entities_csv_v1.txt",
+)
+LEVELS = ("state", "county", "district", "school")
+
+# spelled-out forms so "Irvine USD" and "Irvine Unified School District" meet
+ABBREVIATIONS = {
+    "usd": "unified", "esd": "elementary", "hsd": "high", "uhsd": "union high",
+    "elem": "elementary", "jt": "joint", "coe": "county office of education",
+}
+DROP_SUFFIX = re.compile(r"\s+school district$")
+
+
+def normalize_name(name: str) -> str:
+    """'Irvine Unified School District' / 'IRVINE  USD' -> 'irvine unified'."""
+    s = unicodedata.normalize("NFKD", str(name or "")).encode("ascii", "ignore").decode()
+    s = re.sub(r"[^a-z0-9]+", " ", s.lower()).strip()
+    s = " ".join(ABBREVIATIONS.get(tok, tok) for tok in s.split())
+    return DROP_SUFFIX.sub("", s)
+
+
+def trigrams(norm: str) -> set:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass
+class Candidate:
+    name: str
+    level: str        # state | county | district | school
+    cds_code: str     # 14-digit County-District-School code
+    county_name: str
+    district_name: str
+    score: float      # 1.0 = exact (normalized) match
+
+
+class EntityResolver:
+    """Name -> ranked CDS candidates. Build once per entities file set; queries are O(trigrams)."""
+
+    def __init__(self, entities: pd.DataFrame):
+        self.entities = entities.reset_index(drop=True)
+        self.norm = self.entities["norm"].tolist()
+        self.records = list(self.entities[["name", "level", "cds_code", "county_name", "district_name"]]
+                            .itertuples(index=False, name=None))
+        levels = self.entities["level"].to_numpy()
+        self.level_mask = {lv: levels == lv for lv in LEVELS}
+        self.norm_len = np.array([len(trigrams(n)) for n in self.norm], dtype=np.int32)
+
+        # sorted names -> a prefix query is a bisect range, not a scan
+        order = sorted(range(len(self.norm)), key=self.norm.__getitem__)
+        self.sorted_norm = [self.norm[i] for i in order]
+        self.sorted_ids = np.array(order, dtype=np.int32)
+
+        self.exact = {}
+        postings = {}
+        for i, n in enumerate(self.norm):
+            self.exact.setdefault(n, []).append(i)
+            for g in trigrams(n):
+                postings.setdefault(g, []).append(i)
+        self.postings = {g: np.array(ids, dtype=np.int32) for g, ids in postings.items()}
+
+    def _candidate(self, i: int, score: float) -> Candidate:
+        return Candidate(*self.records[i], round(score, 3))
+
+    def resolve(self, name: str, level: str | None = "district", limit: int = 5, prefix: bool = False) -> list:
+        """
+        Ranked candidates for `name` at `level` (None = any level).
+        Score is the trigram Dice coefficient; exact normalized matches score 1.0 and
+        come first. With prefix=True names starting with the query get a boost (autocomplete).
+        """
+        q = normalize_name(name)
+        if not q:
+            return []
+        exact = [i for i in self.exact.get(q, []) if level is None or self.level_mask[level][i]]
+
+        grams = [g for g in trigrams(q) if g in self.postings]
+        if not grams:
+            return [self._candidate(i, 1.0) for i in exact[:limit]]
+        hits = np.bincount(np.concatenate([self.postings[g] for g in grams]), minlength=len(self.norm))
+        score = 2.0 * hits / (len(trigrams(q)) + self.norm_len)
+        if level is not None:
+            score = np.where(self.level_mask[level], score, 0.0)
+        if prefix:
+            lo = bisect.bisect_left(self.sorted_norm, q)
+            hi = bisect.bisect_left(self.sorted_norm, q + "\x7f", lo)
+            boost = np.zeros(len(self.norm))
+            boost[self.sorted_ids[lo:hi]] = 0.5
+            if level is not None:
+                boost *= self.level_mask[level]
+            score = score + boost
+        score[exact] = -1.0  # listed separately, first
+
+        k = min(limit, int((score > 0).sum()))
+        top = np.argpartition(-score, k - 1)[:k] if k else np.array([], dtype=int)
+        top = top[np.argsort(-score[top], kind="stable")]
+        ranked = [self._candidate(i, 1.0) for i in exact]
+        ranked += [self._candidate(int(i), min(float(score[i]), 0.999)) for i in top]
+        return ranked[:limit]
+
+    def lookup(self, name: str, level: str = "district") -> Candidate | None:
+        """The entity whose normalized name equals `name` exactly, else None."""
+        hits = self.resolve(name, level, limit=1)
+        return hits[0] if hits and hits[0].score == 1.0 else None
+
+    def autocomplete(self, text: str, level: str | None = None, limit: int = 10) -> list:
+        return self.resolve(text, level, limit, prefix=True)
+
+
+def _load_entities(path: Path) -> pd.DataFrame:
+    mapping = file_column_map(path, "^", "ENTITIES")
+    df = read_delimited(path, sep="^", dtype=str, usecols=list(mapping)).rename(columns=mapping)
+    for c in ("county_code", "district_code", "school_code"):
+        df[c] = normalize_code(df[c]).fillna(0)
+    for c in ("county_name", "district_name", "school_name"):
+        df[c] = df[c].fillna("").astype(str).str.strip()
+    df["level"] = cds_level(df)
+    df["name"] = np.select(
+        [df["level"] == "school", df["level"] == "district"],
+        [df["school_name"], df["district_name"]],
+        default=df["county_name"],
+    )
+    df["cds_code"] = (df["county_code"].astype(int).map("{:02d}".format)
+                      + df["district_code"].astype(int).map("{:05d}".format)
+                      + df["school_code"].astype(int).map("{:07d}".format))
+    return df[["name", "level", "cds_code", "county_name", "district_name"]]
+
+
+@lru_cache(maxsize=4)
+def _build(paths: tuple, mtimes: tuple) -> EntityResolver:
+    frames = [_load_entities(Path(p)) for p in paths]
+    df = pd.concat(frames, ignore_index=True).drop_duplicates(subset=["cds_code"], keep="first")
+    df = df[df["name"] != ""]
+    df["norm"] = df["name"].map(normalize_name)
+    return EntityResolver(df)
+
+
+def get_resolver(paths=None) -> EntityResolver:
+    """Resolver over the entities files (cached per file set + mtimes). Missing files are skipped."""
+    paths = tuple(str(p) for p in (paths or DEFAULT_ENTITIES_PATHS) if Path(p).exists())
+    if not paths:
+        raise FileNotFoundError("No entities files found in data_raw/ (caaspp_2024_entities.txt).")
+    return _build(paths, tuple(Path(p).stat().st_mtime for p in paths))
+
+
+def did_you_mean(name: str, level: str = "district", limit: int = 5) -> list:
+    """Suggested names for a name that did not match exactly."""
+    return [c.name for c in get_resolver().resolve(name, level, limit)]
+
+
+class _AutocompleteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/autocomplete":
+            self.send_error(404)
+            return
+        qs = parse_qs(url.query)
+        level = qs.get("level", [None])[0] or None
+        if level is not None and level not in LEVELS:
+            self.send_error(400, f"level must be one of {LEVELS}")
+            return
+        try:
+            limit = int(qs.get("limit", ["10"])[0])
+        except ValueError:
+            self.send_error(400, "limit must be an integer")
+            return
+        limit = max(1, min(limit, 50))
+        hits = get_resolver().autocomplete(qs.get("q", [""])[0], level, limit)
+        body = json.dumps([asdict(c) for c in hits]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765):
+    """Serve GET /autocomplete?q=...&level=district&limit=10 as JSON (portal autocomplete)."""
+    get_resolver()  # build the index before accepting requests
+    ThreadingHTTPServer((host, port), _AutocompleteHandler).serve_forever()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fuzzy district/school name lookup")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    q = sub.add_parser("query")
+    q.add_argument("name")
+    q.add_argument("--level", choices=LEVELS, default=None)
+    q.add_argument("--limit", type=int, default=5)
+    s = sub.add_parser("serve")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "query":
+        for c in get_resolver().resolve(args.name, args.level, args.limit):
+            print(f"{c.score:5.3f}  {c.level:<8} {c.cds_code}  {c.name}  ({c.district_name}, {c.county_name})")
+    else:
+        serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
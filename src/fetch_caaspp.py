@@ -4,6 +4,10 @@ import re
 import pandas as pd
 from pathlib import Path
 
+from caaspp_summary import DEFAULT_SUBJECT, load_caaspp_subject, resolve_caaspp_path
+from cde_io import read_delimited
+from schema import CAASPP_SCHEMA, canonical_column
+
 # Default location for the statewide CAASPP file
 BASE_DIR = Path(__file__).resolve().parents[1]          # project root
 DEFAULT_CAASPP_PATH = BASE_DIR / "data_raw" / "caaspp_2024_ela.txt"
@@ -14,13 +18,10 @@ BENCHMARK_DEFAULT = 2500.0  # “Standard Met” scale-score cut near 2500 for E
 def _read_caaspp(filepath: str | None = None) -> pd.DataFrame:
     """
     Read the CAASPP ELA research file (caret-delimited) with robust path handling.
+    Accepts the CDE .zip (or a .gz/.xz copy) without extracting it.
     """
-    path = Path(filepath) if filepath else DEFAULT_CAASPP_PATH
-    if not path.is_absolute():
-        path = BASE_DIR / path
-    if not path.exists():
-        raise FileNotFoundError(f"Missing {path}. Put the CAASPP ELA research file there.")
-    return pd.read_csv(path, sep="^", engine="python", header=0, dtype=str, encoding="latin1")
+    path = resolve_caaspp_path(filepath)
+    return read_delimited(path, sep="^", dtype=str)
 
 def load_caaspp(filepath: str | None = None) -> pd.DataFrame:
     """Public wrapper so you can import and quickly inspect districts, etc."""
@@ -28,11 +29,7 @@ def load_caaspp(filepath: str | None = None) -> pd.DataFrame:
 
 def list_districts(filepath: str | None = None, limit: int = 50):
     df = _read_caaspp(filepath)
-    dcol = "District Name" if "District Name" in df.columns else (
-        "DistrictName" if "DistrictName" in df.columns else None
-    )
-    if dcol is None:
-        raise ValueError(f"Could not find a district name column. Columns are: {list(df.columns)}")
+    dcol = canonical_column(df.columns, CAASPP_SCHEMA, "district_name")
     return sorted(df[dcol].dropna().unique())[:limit]
 
 
@@ -41,6 +38,7 @@ def fetch_caaspp_ela_gap(
     district_name: str,
     filepath: str | None = None,
     benchmark_scale_score: float = BENCHMARK_DEFAULT,
+    subject: str = DEFAULT_SUBJECT,
 ):
     """
     Reads the CAASPP ELA research file (caret-delimited) using the 2024 header names you showed,
@@ -48,62 +46,33 @@ def fetch_caaspp_ela_gap(
     by taking the record with the largest tested count, and returns a weighted average and gap.
 
     Returns: dict {district, avg_scale_score, gap, tested}
+    `subject` ("ELA" or "Math") is taken from the shared, once-parsed research file.
     """
-    # Use the common reader (handles defaults + paths)
-    df = _read_caaspp(filepath)
+    # Use the common per-subject loader (handles defaults + paths, parses the file once)
+    df = load_caaspp_subject(subject, filepath)
 
-    COL_DNAME  = "District Name"
-    COL_SNAME  = "School Name"
-    COL_SCODE  = "School Code"
-    COL_GRADE  = "Grade"
-    COL_TESTED = ("Total Students Tested with Scores"
-                  if "Total Students Tested with Scores" in df.columns
-                  else "Total Students Tested")
-    COL_AVG    = "Mean Scale Score"
-
-    # Map the exact column names from your error message
-    COL_DNAME  = "District Name"
-    COL_SNAME  = "School Name"
-    COL_SCODE  = "School Code"
-    COL_GRADE  = "Grade"
-    # Prefer 'Total Students Tested with Scores' else fallback to 'Total Students Tested'
-    COL_TESTED = "Total Students Tested with Scores" if "Total Students Tested with Scores" in df.columns \
-                 else "Total Students Tested"
-    COL_AVG    = "Mean Scale Score"
-
-    required = [COL_DNAME, COL_SCODE, COL_GRADE, COL_TESTED, COL_AVG]
-    missing = [c for c in required if c not in df.columns]
-    if missing:
-        raise ValueError(f"Required columns missing from CAASPP file: {missing}\nHave: {list(df.columns)}")
+    # Canonical columns (schema.CAASPP_SCHEMA); header variants are resolved once per file at load
+    COL_DNAME  = "district_name"
+    COL_SCODE  = "school_code"
+    COL_GRADE  = "grade"
+    COL_TESTED = "tested"   # Tested-with-scores if the vintage has it, else Total Tested
+    COL_AVG    = "mean_scale_score"
 
     # 1) Filter to the chosen district (tolerant match; strip 'School District' suffix)
     norm = lambda s: re.sub(r"\s+school\s+district$", "", str(s or "").strip(), flags=re.I)
     target = norm(district_name).lower()
-    df = df[df[COL_DNAME].astype(str).str.lower().str.contains(target, na=False)]
+    df = df[df[COL_DNAME].str.lower().str.contains(target, na=False, regex=False)]
     if df.empty:
         raise ValueError(f"No CAASPP rows found for district name containing '{district_name}'.")
 
-    # 2) District-level rows only: CAASPP uses 0000000 as the district row (no school)
-    #    Keep strings for codes; treat '0000000' and numeric 0 both as district-level
-    scode = df[COL_SCODE].astype(str).str.strip()
-    is_district_level = (scode == "0") | (scode == "0000000")
-    df = df[is_district_level]
+    # 2) District-level rows only: CAASPP uses 0000000 as the district row (no school);
+    #    codes are ints after load, so '0000000' and '0' are both 0
+    df = df[df[COL_SCODE] == 0]
     if df.empty:
         raise ValueError("Found the district, but no district-level rows (School Code == 0000000).")
 
-    # 3a) Coerce numerics
-    df[COL_TESTED] = pd.to_numeric(df[COL_TESTED], errors="coerce").fillna(0).astype(int)
-    df[COL_AVG]    = pd.to_numeric(df[COL_AVG], errors="coerce")
-
-    # 3b) LOCK to All Students group (from your debug: Student Group ID == 1)
-    SG_COL = "Student Group ID"
-    if SG_COL in df.columns:
-        df = df[df[SG_COL].astype(str).str.strip() == "1"]
-
-    # 3c) Exclude the “All grades” rollup row (grade 13), keep tested grades (3–8, 11)
-    valid_grades = {"3", "4", "5", "6", "7", "8", "11"}
-    df[COL_GRADE] = df[COL_GRADE].astype(str).str.strip()
-    df = df[df[COL_GRADE].isin(valid_grades)]
+    # 3) Numerics, the All Students group (Student Group ID 1) and the tested grades
+    #    (3–8, 11; no grade-13 rollup) are all handled once when the file is loaded.
 
     # --- DEBUG: peek which groups exist at district level and their tested totals
     # SG_COL = "Student Group ID" if "Student Group ID" in df.columns else None
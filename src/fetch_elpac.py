@@ -1,7 +1,13 @@
-import os, re
+import re
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
+from cde_io import SUPPRESSED_MARKERS, cds_level, cds_rows, normalize_code, normalize_grade, read_chunked, read_delimited, resolve_data_path
+from schema import ELPAC_DOMAINS, ELPAC_LEVELS, ELPAC_SCHEMA, canonical_column, file_column_map
+import snapshot
+
 ELPAC_PATH = "data_raw/elpac_2024_summative.txt"
 
 
@@ -9,221 +15,247 @@ ELPAC_PATH = "data_raw/elpac_2024_summative.txt"
 BASE_DIR = Path(__file__).resolve().parents[1]
 DEFAULT_ELPAC_PATH = BASE_DIR / "data_raw" / "elpac_2024_summative.txt"
 
+def resolve_elpac_path(filepath: str | None = None) -> Path:
+    # plain .txt, or the CDE .zip / a .gz / .xz copy next to it
+    return resolve_data_path(filepath, DEFAULT_ELPAC_PATH,
+                             "Save the statewide Summative ELPAC research file (.txt/.zip/.gz/.xz) there.")
+
 def _read_elpac(filepath: str | None):
-    path = Path(filepath) if filepath else DEFAULT_ELPAC_PATH
-    if not path.is_absolute():
-        path = BASE_DIR / path
-    if not path.exists():
-        raise FileNotFoundError(f"Missing {path}. Save the statewide Summative ELPAC research file there.")
-    # ELPAC research file is caret-delimited
-    return pd.read_csv(path, sep="^", engine="python", header=0, dtype=str, encoding="latin1")
+    path = resolve_elpac_path(filepath)
+    # ELPAC research file is caret-delimited; compressed downloads are streamed
+    return read_delimited(path, sep="^", dtype=str)
 
 def list_districts(filepath: str | None = None, limit: int = 50):
     df = _read_elpac(filepath)
-    # Try both possible headers
-    dcol = "DistrictName" if "DistrictName" in df.columns else (
-        "District Name" if "District Name" in df.columns else None
-    )
-    if dcol is None:
-        raise ValueError(f"Could not find a district name column. Columns are: {list(df.columns)}")
+    dcol = canonical_column(df.columns, ELPAC_SCHEMA, "district_name")
     return sorted(df[dcol].dropna().unique())[:limit]
 
 
 
-def district_elpac_speaking_pct_below_by_grade(district_name: str, filepath: str | None = None):
+# --- all-domain metric engine ---
+COMPOSITE  = "Composite"                           # all four domains pooled
+GRADES_1_5 = ["1", "2", "3", "4", "5"]
+ID_COLS    = ["county_code", "district_code", "school_code", "county_name",
+              "district_name", "school_name", "grade"]
+
+
+def _num(df: pd.DataFrame, col: str) -> np.ndarray:
+    """Column as float array ('*'/blank -> NaN); all-NaN when the vintage lacks the column."""
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def _key(domain: str) -> str:
+    """'Speaking' -> 'speaking' (prefix of the canonical metric columns)."""
+    return domain.lower()
+
+
+@lru_cache(maxsize=4)
+def _load_elpac_metrics(path: str, mtime: float) -> pd.DataFrame:
     """
-    Returns (labels, pct_below, tested) for grades 1–5 where:
-      pct_below = SpeakingDomainBegin + SpeakingDomainModerate
-                  (as percent of total speaking domain students for the grade).
-    Uses district-level rows (SchoolCode 0/0000000), picks the row with the
-    largest SpeakingDomainTotal per grade when duplicates exist.
+    Read the ELPAC research file once (cached per path + mtime) and return its metric frame.
+    Headers are mapped to the canonical schema once per file; only mapped columns are parsed.
+    With a memory budget set (cde_io.MEMORY_BUDGET_MB / CA_REPORT_MEMORY_MB) the file is
+    converted chunk by chunk, so only the compact numeric metrics are ever held in full.
+    A new process reads the frame from its snapshot (snapshot.py) when one exists.
     """
-    df = _read_elpac(filepath)
+    cached = snapshot.load("elpac", path)
+    if cached is not None:
+        return cached["metrics"]
+    mapping = file_column_map(path, "^", "ELPAC")
+    df = read_chunked(
+        path, "^",
+        reduce=lambda chunk: _elpac_metrics_frame(chunk.rename(columns=mapping)),
+        usecols=list(mapping),
+        dtype=str,
+    )
+    snapshot.save("elpac", path, {"metrics": df})
+    return df
 
-    # Column aliases present in the statewide file
-    COL_DNAME    = "DistrictName" if "DistrictName" in df.columns else "District Name"
-    COL_SCODE    = "SchoolCode"   if "SchoolCode"   in df.columns else "School Code"
-    COL_GRADE    = "Grade"
-    COL_TOT      = "SpeakingDomainTotal"
-    # percentages, if present
-    COL_P1_PCT   = "SpeakingDomainBeginPcnt"
-    COL_P2_PCT   = "SpeakingDomainModeratePcnt"
-    # counts, as fallback
-    COL_P1_CNT   = "SpeakingDomainBeginCount"
-    COL_P2_CNT   = "SpeakingDomainModerateCount"
-
-    needed = [COL_DNAME, COL_SCODE, COL_GRADE, COL_TOT]
-    miss = [c for c in needed if c not in df.columns]
-    if miss:
-        raise ValueError(f"ELPAC: missing columns {miss}\nHave: {list(df.columns)}")
-
-    # --- district match (tolerant of “School District” suffix) ---
-    norm = lambda s: re.sub(r"\s+school\s+district$", "", str(s or "").strip(), flags=re.I)
-    target = norm(district_name).lower()
-    work = df[df[COL_DNAME].astype(str).str.lower().str.contains(target, na=False)].copy()
-    if work.empty:
-        raise ValueError(f"No ELPAC rows found for district containing '{district_name}'.")
-
-    # --- district-level only ---
-    sc = work[COL_SCODE].astype(str).str.strip()
-    work = work[(sc == "0") | (sc == "0000000")].copy()
-    if work.empty:
-        raise ValueError("Found district, but no district-level rows (SchoolCode == 0000000).")
-
-    # --- keep 1–5 for our axis ---
-    work[COL_GRADE] = work[COL_GRADE].astype(str).str.strip()
-    work = work[work[COL_GRADE].isin(["01","1","02","2","03","3","04","4","05","5"])].copy()
-
-    # normalize grade labels to '1'..'5'
-    def gnorm(x: str) -> str:
-        x = x.strip()
-        return x[-1] if x in {"01","02","03","04","05"} else x
-    work["__G"] = work[COL_GRADE].map(gnorm)
-
-    # numeric coercions
-    to_num = lambda s: pd.to_numeric(s, errors="coerce")
-    work[COL_TOT] = to_num(work[COL_TOT]).fillna(0).astype(int)
-
-    have_pct = (COL_P1_PCT in work.columns) and (COL_P2_PCT in work.columns)
-    if have_pct:
-        work[COL_P1_PCT] = to_num(work[COL_P1_PCT])
-        work[COL_P2_PCT] = to_num(work[COL_P2_PCT])
-    else:
-        # counts fallback if needed
-        if (COL_P1_CNT in work.columns) and (COL_P2_CNT in work.columns):
-            work[COL_P1_CNT] = to_num(work[COL_P1_CNT]).fillna(0).astype(int)
-            work[COL_P2_CNT] = to_num(work[COL_P2_CNT]).fillna(0).astype(int)
-
-    # choose the row with largest total per grade
-    work = work.sort_values(["__G", COL_TOT], ascending=[True, False]).drop_duplicates(subset=["__G"], keep="first")
-
-    axis = ["1","2","3","4","5"]
-    pct_map  = {g: None for g in axis}
-    test_map = {g: 0    for g in axis}
-
-    for _, r in work.iterrows():
-        g = r["__G"]
-        if g not in pct_map:
-            continue
-        test_map[g] = int(r[COL_TOT])
-
-        if have_pct and pd.notna(r[COL_P1_PCT]) and pd.notna(r[COL_P2_PCT]):
-            pct_map[g] = float(r[COL_P1_PCT]) + float(r[COL_P2_PCT])
-        else:
-            # compute from counts if possible
-            if (COL_P1_CNT in work.columns) and (COL_P2_CNT in work.columns) and r[COL_TOT] > 0:
-                pct_map[g] = 100.0 * (float(r[COL_P1_CNT]) + float(r[COL_P2_CNT])) / float(r[COL_TOT])
 
-    labels    = axis
-    pct_below = [pct_map[g]  for g in axis]
-    tested    = [test_map[g] for g in axis]
-    return labels, pct_below, tested
+def _elpac_metrics_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    For every (canonical-named) row and every domain compute Begin/Moderate/Developed
+    shares (0–100), pct below Developed, average level (1–3) and the domain total.
+    Domains are processed as (domain x level x row) arrays, so the whole file is one
+    vectorized pass regardless of how many pages use it.
+    """
+    # identity columns normalized once: stripped names, int codes, canonical grades ('01' -> '1')
+    out = pd.DataFrame(index=df.index)
+    for c in ID_COLS:
+        if c not in df.columns:
+            out[c] = pd.NA if c.endswith("_code") else ""
+        elif c.endswith("_code"):
+            out[c] = normalize_code(df[c])
+        elif c == "grade":
+            out[c] = normalize_grade(df[c])
+        else:
+            out[c] = df[c].fillna("").astype(str).str.strip()
+
+    # (domain, level, row) arrays; percentages win when present, counts are the fallback
+    keys   = [_key(d) for d in ELPAC_DOMAINS]
+    levels = [lv.lower() for lv in ELPAC_LEVELS]
+    counts = np.stack([[_num(df, f"{k}_{lv}_count") for lv in levels] for k in keys])
+    pcts   = np.stack([[_num(df, f"{k}_{lv}_pct")   for lv in levels] for k in keys])
+    totals = np.stack([_num(df, f"{k}_total") for k in keys])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        from_counts = np.where(totals[:, None, :] > 0, 100.0 * counts / totals[:, None, :], np.nan)
+    shares = np.where(np.isnan(pcts), from_counts, pcts)
+
+    # composite: pool counts over the four domains (NaN if any domain is suppressed)
+    comp_counts = counts.sum(axis=0)
+    comp_total  = np.nan_to_num(totals).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        comp_shares = np.where(comp_total > 0, 100.0 * comp_counts / comp_total, np.nan)
+
+    shares = np.concatenate([shares, comp_shares[None]], axis=0)
+    totals = np.concatenate([np.nan_to_num(totals), comp_total[None]], axis=0)
+
+    weights = np.array([1.0, 2.0, 3.0])[None, :, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_level = (shares * weights).sum(axis=1) / shares.sum(axis=1)
+    pct_below = shares[:, 0, :] + shares[:, 1, :]
+
+    # suppression: any level count/percent reported as '*' (or blank) for the domain
+    suppressed = {}
+    for k in keys:
+        cells = [df[f"{k}_{lv}_{kind}"] for lv in levels for kind in ("count", "pct")
+                 if f"{k}_{lv}_{kind}" in df.columns]
+        mask = np.zeros(len(df), dtype=bool)
+        for cell in cells:
+            mask |= cell.isna().to_numpy() | cell.astype(str).str.strip().isin(SUPPRESSED_MARKERS).to_numpy()
+        suppressed[k] = mask
+    suppressed[_key(COMPOSITE)] = np.logical_or.reduce([suppressed[k] for k in keys])
+
+    cols = {}
+    for i, k in enumerate(keys + [_key(COMPOSITE)]):
+        cols[f"{k}_total"] = totals[i].astype(int)
+        cols[f"{k}_suppressed"] = suppressed[k]
+        for j, lv in enumerate(levels):
+            cols[f"{k}_{lv}_share"] = shares[i, j]
+        cols[f"{k}_pct_below"] = pct_below[i]
+        cols[f"{k}_avg_level"] = avg_level[i]
+    return pd.concat([out, pd.DataFrame(cols, index=out.index)], axis=1)
+
+
+def elpac_metrics(filepath: str | None = None) -> pd.DataFrame:
+    """
+    Per-row ELPAC metrics for every domain plus the composite (cached per file).
+    Columns: county_code, district_code, school_code (ints, school_code 0 = district level),
+    county_name, district_name, school_name, grade ('1'.., 'KN', ...), and for each domain
+    key d in listening/speaking/reading/writing/composite: {d}_total, {d}_suppressed,
+    {d}_begin_share, {d}_moderate_share, {d}_developed_share, {d}_pct_below, {d}_avg_level.
+    The frame is shared between callers: filter/copy before mutating it.
+    """
+    path = resolve_elpac_path(filepath)
+    return _load_elpac_metrics(str(path), path.stat().st_mtime)
 
 
-def district_elpac_speaking_by_grade(district_name: str, filepath: str = ELPAC_PATH):
+def elpac_grade_table(filepath: str | None = None) -> pd.DataFrame:
+    """
+    Long per-entity, per-grade ELPAC table: one row per (domain, entity, grade) with
+      level (state/county/district/school), CDS codes and names, grade,
+      total, pct_below, avg_level.
+    Duplicate rows for an entity/grade/domain keep the largest total (the All Students row),
+    matching the per-grade pick of the report functions.
+    """
+    m = elpac_metrics(filepath)
+    ids = [c for c in ID_COLS if c != "grade"]
+    parts = []
+    for domain in ELPAC_DOMAINS + [COMPOSITE]:
+        k = _key(domain)
+        part = m[ids + ["grade", f"{k}_total", f"{k}_pct_below", f"{k}_avg_level"]].rename(columns={
+            f"{k}_total": "total", f"{k}_pct_below": "pct_below", f"{k}_avg_level": "avg_level",
+        })
+        part = (part.sort_values("total", ascending=False, kind="stable")
+                    .drop_duplicates(subset=["county_code", "district_code", "school_code", "grade"]))
+        part.insert(0, "domain", domain)
+        parts.append(part)
+    out = pd.concat(parts, ignore_index=True)
+    out.insert(1, "level", cds_level(out))
+    return out
+
+
+def _district_grade_rows(district_name: str, domain: str, filepath: str | None, cds=None) -> pd.DataFrame:
     """
-    Returns (labels, values, tested) for grades 1–5 using ELPAC Speaking domain.
-    Value = weighted average performance level (1–3).
-    Uses district-level rows (SchoolCode == 0/0000000).
+    District-level rows for grades 1–5, one per grade (largest domain total wins). The
+    district is picked by its codes `cds` (county, district, school) when given.
     """
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"Missing {filepath}. Save the statewide Summative ELPAC research file there.")
-
-    # This file uses caret-delimited, camelCase headers.
-    df = pd.read_csv(filepath, sep="^", engine="python", header=0, dtype=str, encoding="latin1")
-
-    # Column names in your file (from your traceback)
-    COL_DNAME   = "DistrictName"
-    COL_SCODE   = "SchoolCode"
-    COL_GRADE   = "Grade"
-
-    # Speaking domain level counts & total
-    COL_BEGIN   = "SpeakingDomainBeginCount"
-    COL_MOD     = "SpeakingDomainModerateCount"
-    COL_DEV     = "SpeakingDomainDevelopedCount"
-    COL_TOTAL   = "SpeakingDomainTotal"
-
-    required = [COL_DNAME, COL_SCODE, COL_GRADE, COL_BEGIN, COL_MOD, COL_DEV, COL_TOTAL]
-    missing = [c for c in required if c not in df.columns]
-    if missing:
-        raise ValueError(f"ELPAC: missing columns {missing}\nHave: {list(df.columns)}")
-
-    # Filter to target district (tolerant re: 'School District' suffix)
-    norm = lambda s: re.sub(r"\s+school\s+district$", "", str(s or "").strip(), flags=re.I)
-    target = norm(district_name).lower()
-    work = df[df[COL_DNAME].astype(str).str.lower().str.contains(target, na=False)].copy()
-    if work.empty:
-        raise ValueError(f"No ELPAC rows found for district containing '{district_name}'.")
-
-    # District-level rows only
-    if "TypeID" in work.columns:
-        tid = work["TypeID"].astype(str).str.strip().str.upper()
-        # '02' is district-level in your file; keep 'D'/'DISTRICT' for other vintages.
-        work = work[tid.isin(["02", "D", "DISTRICT"])].copy()
+    if domain not in ELPAC_DOMAINS + [COMPOSITE]:
+        raise ValueError(f"Unknown ELPAC domain {domain!r}. Expected one of {ELPAC_DOMAINS + [COMPOSITE]}.")
+    m = elpac_metrics(filepath)
+
+    if cds is not None:
+        work = cds_rows(m, (cds[0], cds[1], 0))
+        if work.empty:
+            raise ValueError(f"No ELPAC rows found for district {district_name!r} (codes {cds[0]}/{cds[1]}).")
     else:
-        sc = work["SchoolCode"].astype(str).str.strip()
-        work = work[(sc == "0") | (sc == "0000000")].copy()
-
-    print("[elpac] rows after district filter:", len(work))  # debug
-    if work.empty:
-        raise ValueError("Found district, but no district-level rows after TypeID/SchoolCode filter.")
-
-
-    
-    #debug for what nameing scheme elpac uses
-    # print("[elpac] candidates for district:", sorted(work["DistrictName"].unique())[:5])
-
-    # # See what aggregate levels we have; ELPAC uses TypeID like 'D' (district) / 'S' (school)
-    # if "TypeID" in work.columns:
-    #     print("[elpac] TypeID uniques:", work["TypeID"].astype(str).unique())
-
-    # # Peek which grades exist and where the speaking totals are nonzero
-    # if "SpeakingDomainTotal" in work.columns:
-    #     tmp = work.copy()
-    #     tmp["GradeNorm"] = tmp["Grade"].astype(str).str.strip().str.replace("^0", "", regex=True)
-    #     nonzero = tmp[tmp["SpeakingDomainTotal"].astype(str) != "0"]
-    #     print("[elpac] grade sample (nonzero SpeakingDomainTotal):",
-    #         nonzero[["Grade", "GradeNorm", "SpeakingDomainTotal"]].head(10).to_dict(orient="records"))
-
-
-    # Keep grades 1–5 only (consistent x-axis) — normalize '01' -> '1'
-    axis = ["1", "2", "3", "4", "5"]
-    work["GradeNorm"] = (
-        work[COL_GRADE]
-        .astype(str)
-        .str.strip()
-        .str.replace(r"^0", "", regex=True)  # remove a single leading zero
-    )
-    work = work[work["GradeNorm"].isin(axis)].copy()
-
-    # Coerce to numeric
-    for c in [COL_BEGIN, COL_MOD, COL_DEV, COL_TOTAL]:
-        work[c] = pd.to_numeric(work[c], errors="coerce").fillna(0).astype(int)
-
-    # If multiple rows per grade, keep the one with largest SpeakingDomainTotal
-    work = work.sort_values(["GradeNorm", COL_TOTAL], ascending=[True, False]) \
-               .drop_duplicates(subset=["GradeNorm"], keep="first")
-
-    # Compute avg level per grade (1..3)
-    values_by_grade = {g: None for g in axis}
-    tested_by_grade = {g: 0    for g in axis}
-
-    for _, r in work.iterrows():
-        g = r["GradeNorm"]
-        total = int(r[COL_TOTAL])
-        if total > 0:
-            begin = int(r[COL_BEGIN])
-            moderate = int(r[COL_MOD])
-            developed = int(r[COL_DEV])
-            avg_level = (1*begin + 2*moderate + 3*developed) / total
-            values_by_grade[g] = float(avg_level)
-            tested_by_grade[g] = total
-
-    labels = axis
-    values = [values_by_grade[g] for g in labels]
-    tested = [tested_by_grade[g] for g in labels]
-    print("[debug] ELPAC speaking by grade:", list(zip(labels, values)))  # debug
-    return labels, values, tested
+        # --- district match (tolerant of “School District” suffix) ---
+        norm = lambda s: re.sub(r"\s+school\s+district$", "", str(s or "").strip(), flags=re.I)
+        target = norm(district_name).lower()
+        work = m[m["district_name"].str.lower().str.contains(target, na=False, regex=False)]
+        if work.empty:
+            raise ValueError(f"No ELPAC rows found for district containing '{district_name}'.")
+
+        # --- district-level only ---
+        work = work[work["school_code"] == 0]
+        if work.empty:
+            raise ValueError("Found district, but no district-level rows (SchoolCode == 0000000).")
+
+    tot = f"{_key(domain)}_total"
+    return (work[work["grade"].isin(GRADES_1_5)]
+                .sort_values(["grade", tot], ascending=[True, False])
+                .drop_duplicates(subset=["grade"], keep="first"))
+
+
+def district_elpac_pct_below_by_grade(district_name: str, domain: str = "Speaking",
+                                      filepath: str | None = None, cds=None):
+    """
+    Returns (labels, pct_below, tested) for grades 1–5 where:
+      pct_below = {domain}Begin + {domain}Moderate (percent of the domain total for the grade).
+    `domain` is Listening, Speaking, Reading, Writing or Composite; `cds` picks the district
+    by its codes instead of its name.
+    """
+    rows = _district_grade_rows(district_name, domain, filepath, cds).set_index("grade")
+    k = _key(domain)
+    pct_below = [None] * len(GRADES_1_5)
+    tested    = [0] * len(GRADES_1_5)
+    for i, g in enumerate(GRADES_1_5):
+        if g in rows.index:
+            tested[i] = int(rows.at[g, f"{k}_total"])
+            p = rows.at[g, f"{k}_pct_below"]
+            pct_below[i] = float(p) if pd.notna(p) else None
+    return list(GRADES_1_5), pct_below, tested
+
+
+def district_elpac_level_by_grade(district_name: str, domain: str = "Speaking",
+                                  filepath: str | None = None, cds=None):
+    """
+    Returns (labels, values, tested) for grades 1–5 where value is the weighted
+    average performance level (1–3) for `domain` (`cds`: see district_elpac_pct_below_by_grade).
+    """
+    rows = _district_grade_rows(district_name, domain, filepath, cds).set_index("grade")
+    k = _key(domain)
+    values = [None] * len(GRADES_1_5)
+    tested = [0] * len(GRADES_1_5)
+    for i, g in enumerate(GRADES_1_5):
+        if g in rows.index and rows.at[g, f"{k}_total"] > 0:
+            v = rows.at[g, f"{k}_avg_level"]
+            values[i] = float(v) if pd.notna(v) else None
+            tested[i] = int(rows.at[g, f"{k}_total"])
+    return list(GRADES_1_5), values, tested
+
+
+def district_elpac_speaking_pct_below_by_grade(district_name: str, filepath: str | None = None, cds=None):
+    """Speaking-domain % in Levels 1+2 by grade (see district_elpac_pct_below_by_grade)."""
+    return district_elpac_pct_below_by_grade(district_name, "Speaking", filepath, cds)
+
+
+def district_elpac_speaking_by_grade(district_name: str, filepath: str | None = None, cds=None):
+    """Speaking-domain average performance level by grade (see district_elpac_level_by_grade)."""
+    return district_elpac_level_by_grade(district_name, "Speaking", filepath, cds)
 
 def load_elpac(filepath: str | None = None):
     """Public wrapper for reading the full ELPAC dataset."""
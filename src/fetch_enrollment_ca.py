@@ -4,31 +4,54 @@ import pandas as pd
 from pandas.api.types import is_numeric_dtype
 from pathlib import Path
 
+from cde_io import BASE_DIR, normalize_code, open_text, read_chunked, resolve_data_path
+import snapshot
+
+DEFAULT_ENROLLMENT_PATH = BASE_DIR / "data_raw" / "cdenroll2425.txt"
+
+def resolve_enrollment_path(filepath: str | None = None) -> Path:
+    # plain .txt, or the CDE .zip / a .gz / .xz copy next to it
+    return resolve_data_path(filepath, DEFAULT_ENROLLMENT_PATH, "Save cdenroll2425.txt (or its .zip) into data_raw/.")
+
+WIDE_COLUMNS = [
+    "AcademicYear", "AggregateLevel", "CountyCode", "DistrictCode", "SchoolCode",
+    "CountyName", "DistrictName", "SchoolName", "Charter", "ReportingCategory",
+    "TOTAL_ENR", "GR_TK", "GR_KN", "GR_01", "GR_02", "GR_03", "GR_04", "GR_05",
+    "GR_06", "GR_07", "GR_08", "GR_09", "GR_10", "GR_11", "GR_12"
+]
+COUNT_COLUMNS = [c for c in WIDE_COLUMNS if c == "TOTAL_ENR" or c.startswith("GR_")]
+
+def _compact_enrollment(df):
+    """Wide TSV chunk -> only the columns we read, with counts as numbers instead of str objects."""
+    if not set(WIDE_COLUMNS).issubset(df.columns):
+        return df  # narrow/unknown layout: leave it for the schema sniffing below
+    df = df[WIDE_COLUMNS].copy()
+    for c in COUNT_COLUMNS:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    return df
+
 def _read_tsv(filepath):
-    # Try TSV first (common for the statewide demo-downloads)
-    return pd.read_csv(filepath, sep="\t", header=0, encoding="latin1", engine="python")
+    # Try TSV first (common for the statewide demo-downloads); .zip/.gz/.xz are streamed,
+    # and chunked under a memory budget (cde_io.MEMORY_BUDGET_MB / CA_REPORT_MEMORY_MB)
+    return read_chunked(filepath, "\t", reduce=_compact_enrollment)
 
 def _read_fwf(filepath):
-    return pd.read_fwf(filepath, header=None, encoding="latin1")
+    with open_text(filepath) as fh:
+        return pd.read_fwf(fh, header=None)
 
 def fetch_enrollment_school_row(school_name: str, filepath: str = "data_raw/cdenroll2425.txt"):
     """
     Return a single-row DataFrame shaped like:
       School | K | 1 | 2 | 3 | 4 | 5 | Total
-    for the given SCHOOL (case-insensitive). Works on the statewide TSV.
+    for the given SCHOOL (case-insensitive). Works on the statewide TSV (plain or compressed).
     """
+    filepath = resolve_enrollment_path(filepath)
     # --- read exactly like your district function does
     df = _read_tsv(filepath)
     if df.shape[1] <= 2:
         df = _read_fwf(filepath)
 
-    required = [
-        "AcademicYear","AggregateLevel","CountyCode","DistrictCode","SchoolCode",
-        "CountyName","DistrictName","SchoolName","Charter","ReportingCategory",
-        "TOTAL_ENR","GR_TK","GR_KN","GR_01","GR_02","GR_03","GR_04","GR_05",
-        "GR_06","GR_07","GR_08","GR_09","GR_10","GR_11","GR_12"
-    ]
-    missing = [c for c in required if c not in df.columns]
+    missing = [c for c in WIDE_COLUMNS if c not in df.columns]
     if missing:
         raise ValueError(f"Expected headers missing from TSV: {missing}")
 
@@ -66,20 +89,9 @@ def fetch_enrollment_from_txt(district_name, filepath=None, include_charters=Tru
     """
     Load the statewide enrollment file and filter to one district.
     If `filepath` is None or a relative path, resolve it relative to the project root.
+    A zipped/gzipped/xz download next to the .txt is read directly.
     """
-    # project root = one level up from src/
-    BASE_DIR = Path(__file__).resolve().parents[1]
-
-    # default file location
-    if filepath is None:
-        filepath = BASE_DIR / "data_raw" / "cdenroll2425.txt"
-    else:
-        filepath = Path(filepath)
-        if not filepath.is_absolute():
-            filepath = BASE_DIR / filepath
-
-    if not filepath.exists():
-        raise FileNotFoundError(f"Missing {filepath}. Save cdenroll2425.txt into data_raw/.")
+    filepath = resolve_enrollment_path(filepath)
 
     # --- 1) Read as TSV first; if it looks like 1-2 columns only, try FWF
     df = _read_tsv(filepath)
@@ -100,13 +112,7 @@ def fetch_enrollment_from_txt(district_name, filepath=None, include_charters=Tru
     # -----------------------
     if col_count >= 20:
         # We already read with header=0, so columns are real names.
-        required = [
-            "AcademicYear", "AggregateLevel", "CountyCode", "DistrictCode", "SchoolCode",
-            "CountyName", "DistrictName", "SchoolName", "Charter", "ReportingCategory",
-            "TOTAL_ENR", "GR_TK", "GR_KN", "GR_01", "GR_02", "GR_03", "GR_04", "GR_05",
-            "GR_06", "GR_07", "GR_08", "GR_09", "GR_10", "GR_11", "GR_12"
-        ]
-        missing = [c for c in required if c not in df.columns]
+        missing = [c for c in WIDE_COLUMNS if c not in df.columns]
         if missing:
             raise ValueError(f"Expected headers missing from TSV: {missing}")
 
@@ -245,3 +251,47 @@ def fetch_enrollment_from_txt(district_name, filepath=None, include_charters=Tru
     if out.empty:
         raise ValueError("Parsed narrow file but got no rows after filtering K–5.")
     return out
+
+
+def enrollment_k5_table(filepath=None):
+    """
+    Statewide K–5 enrollment by school from the wide TSV, one row per school:
+      county_code | district_code | school_code | county_name | district_name | school_name |
+      charter | K | 1 | 2 | 3 | 4 | 5 | Total
+    Same row pick as fetch_enrollment_from_txt (school-level rows, largest TOTAL_ENR per school),
+    done for every district at once so it can be stored and rolled up.
+    Read from the file's snapshot (snapshot.py) when one exists.
+    """
+    filepath = resolve_enrollment_path(filepath)
+    cached = snapshot.load("enrollment", filepath)
+    if cached is not None:
+        return cached["k5"]
+    df = _read_tsv(filepath)
+    missing = [c for c in WIDE_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Expected headers missing from TSV: {missing}")
+
+    agg = df["AggregateLevel"].astype(str).str.lower()
+    work = df[agg.isin(["school", "s", "schl"])]
+    if work.empty:
+        work = df[df["SchoolName"].astype(str).str.strip().ne("")]
+
+    work = work.assign(TOTAL_ENR=pd.to_numeric(work["TOTAL_ENR"], errors="coerce").fillna(0))
+    work = (work.sort_values("TOTAL_ENR", ascending=False, kind="stable")
+                .drop_duplicates(subset=["CountyCode", "DistrictCode", "SchoolCode"], keep="first"))
+
+    out = pd.DataFrame({
+        "county_code":   normalize_code(work["CountyCode"]),
+        "district_code": normalize_code(work["DistrictCode"]),
+        "school_code":   normalize_code(work["SchoolCode"]),
+        "county_name":   work["CountyName"].fillna("").astype(str).str.strip(),
+        "district_name": work["DistrictName"].fillna("").astype(str).str.strip(),
+        "school_name":   work["SchoolName"].fillna("").astype(str).str.strip(),
+        "charter":       work["Charter"].astype(str).str.upper().eq("Y"),
+    })
+    for col, g in [("GR_KN", "K"), ("GR_01", "1"), ("GR_02", "2"), ("GR_03", "3"), ("GR_04", "4"), ("GR_05", "5")]:
+        out[g] = pd.to_numeric(work[col], errors="coerce").fillna(0).astype(int)
+    out["Total"] = out[["K", "1", "2", "3", "4", "5"]].sum(axis=1)
+    out = out.sort_values(["district_name", "school_name"]).reset_index(drop=True)
+    snapshot.save("enrollment", filepath, {"k5": out})
+    return out
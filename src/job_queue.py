@@ -0,0 +1,421 @@
+# src/job_queue.py
+# Durable report-build queue in a single SQLite file, for sharding statewide runs across
+# hosts that share storage (no broker). Workers claim one job at a time under a lease and
+# renew it while building; a job whose worker dies is picked up again once its lease
+# expires. Failed builds are retried with backoff up to max_attempts. Each build writes to
+# a worker-private file that is renamed over the final PDF, so a retried or duplicated job
+# never leaves a half-written report. Reports are built with assemble.build_pdf: each worker
+# keeps a warm pool of --section-workers processes that lay out a report's sections in parallel.
+#
+#   python src/job_queue.py enqueue district --all                    # every district
+#   python src/job_queue.py enqueue district --query "read_gap >= 55"
+#   python src/job_queue.py enqueue district "Irvine Unified" "Alameda Unified"
+#   python src/job_queue.py enqueue school 19647336016323             # one school by CDS code
+#   python src/job_queue.py work --workers 4                          # local worker processes
+#   python src/job_queue.py status
+#   python src/job_queue.py requeue                                   # failed jobs back to queued
+#
+# Jobs are keyed by CDS codes (county/district/school), not names: hundreds of schools share
+# a name, so names are resolved to codes when enqueued, and the codes name the output file
+# and pick the entity in the build.
+#
+# The queue file uses SQLite's rollback journal (not WAL), which only needs POSIX locks
+# from the shared filesystem; keep it on storage where those work (local disk, NFSv4).
+import argparse
+import multiprocessing
+import os
+import socket
+import sqlite3
+import statistics
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from build_context import REPORTS_DIR, report_filename
+from cde_io import BASE_DIR, cds_code, parse_cds
+from report_template import IMAGE_PROFILES
+
+QUEUE_PATH = BASE_DIR / "output" / "queue" / "jobs.sqlite"
+LEASE_SECONDS = 120        # a claim is lost if not renewed for this long
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 30         # seconds before the first retry; doubles per attempt
+STRAGGLER_FACTOR = 3.0     # running longer than this x the median build time
+THROUGHPUT_WINDOW = 600    # seconds of history for the recent rate in `status`
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY,
+    entity_type  TEXT NOT NULL,
+    entity_name  TEXT NOT NULL,                    -- label; the codes identify the entity
+    county_code  INTEGER NOT NULL,
+    district_code INTEGER NOT NULL,
+    school_code  INTEGER NOT NULL,                 -- 0 for a district
+    out_path     TEXT NOT NULL,
+    state        TEXT NOT NULL DEFAULT 'queued',   -- queued | running | done | failed
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker       TEXT,
+    lease_until  REAL,
+    not_before   REAL NOT NULL DEFAULT 0,
+    enqueued_at  REAL NOT NULL,
+    started_at   REAL,
+    finished_at  REAL,
+    last_error   TEXT,
+    UNIQUE (entity_type, county_code, district_code, school_code)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, not_before);
+"""
+
+
+def connect(db_path=None) -> sqlite3.Connection:
+    """Open (creating if needed) the queue file. Autocommit; writers take BEGIN IMMEDIATE."""
+    path = Path(db_path or QUEUE_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+    if columns and "school_code" not in columns:
+        conn.close()
+        raise ValueError(f"{path} holds name-keyed jobs from an older version; move it aside and enqueue again.")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def report_path(entity_name: str, cds, out_dir=None) -> str:
+    """Where a report lands (absolute, so every host on the shared mount agrees)."""
+    return str(Path(out_dir or REPORTS_DIR).resolve() / report_filename(entity_name, cds))
+
+
+def job_cds(job) -> tuple[int, int, int]:
+    return job["county_code"], job["district_code"], job["school_code"]
+
+
+def job_label(job) -> str:
+    """'Lincoln Elementary (19647336016323)' for log lines."""
+    return f"{job['entity_name']} ({cds_code(job_cds(job))})"
+
+
+def enqueue(conn, entity_type: str, entities, out_dir=None, max_attempts: int = MAX_ATTEMPTS) -> int:
+    """
+    Add one job per (name, (county, district, school) codes); entities already in the queue
+    are left as they are. Returns jobs added.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        added = 0
+        for name, cds in entities:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO jobs (entity_type, entity_name, county_code, district_code, school_code, "
+                "out_path, max_attempts, enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (entity_type, name, *(int(c) for c in cds), report_path(name, cds, out_dir), max_attempts, now))
+            added += cur.rowcount
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return added
+
+
+def claim(conn, worker: str, lease: float = LEASE_SECONDS) -> sqlite3.Row | None:
+    """
+    Take the oldest runnable job: queued and past its backoff, or running under an expired
+    lease (its worker is presumed dead; that counts as a failed attempt). None = nothing to do.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")  # one claimer at a time, across processes and hosts
+    try:
+        # expired leases that have used up their attempts are not coming back
+        conn.execute(
+            "UPDATE jobs SET state = 'failed', finished_at = ?, "
+            "last_error = coalesce(last_error, '') || '[lease expired: ' || worker || ']' "
+            "WHERE state = 'running' AND lease_until < ? AND attempts >= max_attempts", (now, now))
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE (state = 'queued' AND not_before <= ?) "
+            "OR (state = 'running' AND lease_until < ?) ORDER BY id LIMIT 1", (now, now)).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, "
+                "lease_until = ?, started_at = ? WHERE id = ?", (worker, now + lease, now, row["id"]))
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def renew(conn, job_id: int, worker: str, lease: float = LEASE_SECONDS) -> bool:
+    """Extend our lease; False if the job was taken over (our result will still be harmless)."""
+    cur = conn.execute(
+        "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'running'",
+        (time.time() + lease, job_id, worker))
+    return cur.rowcount == 1
+
+
+def complete(conn, job_id: int, worker: str):
+    conn.execute(
+        "UPDATE jobs SET state = 'done', finished_at = ?, lease_until = NULL, last_error = NULL "
+        "WHERE id = ? AND worker = ?", (time.time(), job_id, worker))
+
+
+def fail(conn, job_id: int, worker: str, error: str):
+    """Back to the queue with exponential backoff, or 'failed' once attempts run out."""
+    now = time.time()
+    conn.execute(
+        "UPDATE jobs SET lease_until = NULL, finished_at = ?, last_error = ?, "
+        "state = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+        "not_before = ? + ? * (1 << (attempts - 1)) "
+        "WHERE id = ? AND worker = ?", (now, error[-2000:], now, RETRY_BACKOFF, job_id, worker))
+
+
+def requeue(conn, states=("failed",)) -> int:
+    """Reset jobs in `states` to a fresh queued job (attempts cleared)."""
+    marks = ",".join("?" * len(states))
+    cur = conn.execute(
+        f"UPDATE jobs SET state = 'queued', attempts = 0, not_before = 0, worker = NULL, "
+        f"lease_until = NULL, last_error = NULL WHERE state IN ({marks})", tuple(states))
+    return cur.rowcount
+
+
+class _Heartbeat(threading.Thread):
+    """Renews a job's lease every lease/3 seconds while the build runs (own connection)."""
+
+    def __init__(self, db_path, job_id, worker, lease):
+        super().__init__(daemon=True)
+        self.args = (db_path, job_id, worker, lease)
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        db_path, job_id, worker, lease = self.args
+        conn = connect(db_path)
+        try:
+            while not self.stopped.wait(lease / 3):
+                if not renew(conn, job_id, worker, lease):
+                    self.lost = True
+                    return
+        finally:
+            conn.close()
+
+
+def _build_one(job, image_profile: str | None = None, pool=None) -> None:
+    """
+    Build to a worker-private file, then rename over the final report (atomic, last writer wins).
+    pool: assemble.make_pool() executor the report's sections are laid out in.
+    """
+    from assemble import build_pdf
+    final = job["out_path"]
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    part = f"{final}.{socket.gethostname()}-{os.getpid()}.part"
+    try:
+        built = build_pdf(job["entity_type"], job["entity_name"], out_path=part, pool=pool,
+                          image_profile=image_profile, cds=job_cds(job))
+        os.replace(built, final)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+
+def work(db_path=None, worker: str | None = None, lease: float = LEASE_SECONDS, wait: bool = False,
+         image_profile: str | None = None, section_workers: int | None = None) -> int:
+    """
+    Claim and build jobs until none are runnable (or forever with wait=True, polling).
+    image_profile: chart quality for every build (report_template.IMAGE_PROFILES; "archive"
+    for smaller batch output). section_workers: processes laying out each report's sections
+    (assemble.py; default one per section, up to the CPU count), started with the first job
+    and kept for the rest. Returns the number of reports this worker completed.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    conn = connect(db_path)
+    done = 0
+    pool = None
+    while True:
+        job = claim(conn, worker, lease)
+        if job is None:
+            if not wait:
+                break
+            time.sleep(5)
+            continue
+        if pool is None:
+            from assemble import make_pool
+            from pipeline import preload_sources
+            preload_sources()  # so the section workers fork with it loaded
+            pool = make_pool(section_workers)
+        beat = _Heartbeat(db_path, job["id"], worker, lease)
+        beat.start()
+        try:
+            _build_one(job, image_profile, pool)
+        except Exception as e:
+            beat.stopped.set()
+            print(f"[queue] {worker} {job_label(job)} failed (attempt {job['attempts']}):", e)
+            fail(conn, job["id"], worker, traceback.format_exc())
+            continue
+        beat.stopped.set()
+        complete(conn, job["id"], worker)
+        done += 1
+        print(f"[queue] {worker} built {job_label(job)}")
+    if pool is not None:
+        pool.shutdown()
+    conn.close()
+    return done
+
+
+def run_local_workers(n: int, db_path=None, lease: float = LEASE_SECONDS, wait: bool = False,
+                      image_profile: str | None = None, section_workers: int | None = None):
+    """
+    n worker processes on this host (what another host would run as `work`); each lays its
+    reports out with section_workers processes (default: the CPUs shared out between them).
+    """
+    section_workers = section_workers or max(1, (os.cpu_count() or 1) // max(n, 1))
+    if n <= 1:
+        work(db_path, lease=lease, wait=wait, image_profile=image_profile, section_workers=section_workers)
+        return
+    procs = [multiprocessing.Process(target=work, args=(db_path, None, lease, wait, image_profile, section_workers))
+             for _ in range(n)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+
+def status(conn, now: float | None = None) -> dict:
+    """
+    Queue counts by state, per-worker completions, throughput (overall and over the last
+    THROUGHPUT_WINDOW seconds) and stragglers: running jobs past their lease, or running
+    longer than STRAGGLER_FACTOR x the median build time.
+    """
+    now = now or time.time()
+    counts = {r["state"]: r["n"] for r in conn.execute("SELECT state, count(*) AS n FROM jobs GROUP BY state")}
+    finished = conn.execute(
+        "SELECT worker, started_at, finished_at FROM jobs WHERE state = 'done'").fetchall()
+    durations = [r["finished_at"] - r["started_at"] for r in finished]
+    median = statistics.median(durations) if durations else None
+
+    per_worker = {}
+    for r in finished:
+        per_worker[r["worker"]] = per_worker.get(r["worker"], 0) + 1
+    first = conn.execute("SELECT min(started_at) FROM jobs WHERE started_at IS NOT NULL").fetchone()[0]
+    window = min(THROUGHPUT_WINDOW, now - first) if first else THROUGHPUT_WINDOW
+    recent = sum(1 for r in finished if r["finished_at"] >= now - window)
+
+    stragglers = []
+    for r in conn.execute("SELECT * FROM jobs WHERE state = 'running' ORDER BY started_at"):
+        elapsed = now - r["started_at"]
+        if r["lease_until"] < now:
+            reason = "lease expired"
+        elif median and elapsed > STRAGGLER_FACTOR * median:
+            reason = f"{elapsed / median:.1f}x median"
+        else:
+            continue
+        stragglers.append({"entity": job_label(r), "worker": r["worker"],
+                           "elapsed": elapsed, "attempts": r["attempts"], "reason": reason})
+
+    return {
+        "counts": {s: counts.get(s, 0) for s in ("queued", "running", "done", "failed")},
+        "per_worker": per_worker,
+        "median_seconds": median,
+        "overall_per_min": 60 * len(finished) / (now - first) if finished and first and now > first else 0.0,
+        "recent_per_min": 60 * recent / window if window > 0 else 0.0,
+        "stragglers": stragglers,
+        "failed": [(job_label(r), (r["last_error"] or "").strip().splitlines()[-1:])
+                   for r in conn.execute("SELECT * FROM jobs WHERE state = 'failed'")],
+    }
+
+
+def _print_status(st: dict):
+    c = st["counts"]
+    total = sum(c.values())
+    print(f"[queue] {total} job(s): " + ", ".join(f"{k} {v}" for k, v in c.items()))
+    med = f"{st['median_seconds']:.1f}s" if st["median_seconds"] is not None else "–"
+    print(f"[queue] throughput {st['overall_per_min']:.1f}/min overall, "
+          f"{st['recent_per_min']:.1f}/min last {THROUGHPUT_WINDOW // 60} min; median build {med}")
+    if st["per_worker"] and c["queued"] + c["running"]:
+        rate = st["recent_per_min"] or st["overall_per_min"]
+        if rate:
+            print(f"[queue] ~{(c['queued'] + c['running']) / rate:.1f} min remaining at the current rate")
+    for w, n in sorted(st["per_worker"].items(), key=lambda kv: -kv[1]):
+        print(f"[queue]   {w:<32} {n:>6} done")
+    for s in st["stragglers"]:
+        print(f"[straggler] {s['entity']} on {s['worker']}: {s['elapsed']:.0f}s "
+              f"(attempt {s['attempts']}, {s['reason']})")
+    for name, err in st["failed"]:
+        print(f"[failed] {name}: {err[0] if err else ''}")
+
+
+def _entities(rows, entity_type: str) -> list:
+    """[(name, (county, district, school))] for KPI/metric-table rows."""
+    col = "district_name" if entity_type == "district" else "school_name"
+    return [(r[col], (int(r["county_code"]), int(r["district_code"]), int(r["school_code"])))
+            for _, r in rows.iterrows()]
+
+
+def _entities_for(entity_type: str, args) -> list:
+    """
+    The entities to enqueue, resolved to CDS codes. A name on the command line queues every
+    entity of that exact name (with a note when there are several); a 14-digit CDS code, one.
+    """
+    if args.query is not None:
+        from metric_query import query
+        return _entities(query(args.query, level=entity_type), entity_type)
+    from kpi import kpi_table
+    t = kpi_table()
+    t = t[t["level"] == entity_type]
+    if args.all:
+        return _entities(t, entity_type)
+    col = "district_name" if entity_type == "district" else "school_name"
+    out = []
+    for arg in args.names:
+        if arg.strip().isdigit():
+            c, d, s = parse_cds(arg)
+            hit = t[(t["county_code"] == c) & (t["district_code"] == d) & (t["school_code"] == s)]
+        else:
+            hit = t[t[col].fillna("").str.lower() == arg.strip().lower()]
+        if hit.empty:
+            print(f"[warn] no {entity_type} {arg!r} in the KPI table; skipped")
+        elif len(hit) > 1:
+            print(f"[queue] {arg!r} matches {len(hit)} {entity_type}s; queuing each (pass a CDS code for one)")
+        out += _entities(hit, entity_type)
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Shared-storage job queue for report builds")
+    ap.add_argument("--db", default=None, help=f"queue file (default {QUEUE_PATH})")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    enq = sub.add_parser("enqueue", help="add report jobs")
+    enq.add_argument("entity_type", choices=["district", "school"])
+    enq.add_argument("names", nargs="*", help="names (every entity of that name) or 14-digit CDS codes")
+    enq.add_argument("--all", action="store_true", help="every entity of this type in the KPI table")
+    enq.add_argument("--query", help="entities matching a metric_query condition string")
+    enq.add_argument("--out-dir", help=f"report directory (default {REPORTS_DIR})")
+    enq.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS)
+    wk = sub.add_parser("work", help="claim and build jobs")
+    wk.add_argument("--workers", type=int, default=1, help="local worker processes")
+    wk.add_argument("--lease", type=float, default=LEASE_SECONDS)
+    wk.add_argument("--wait", action="store_true", help="keep polling when the queue is empty")
+    wk.add_argument("--image-profile", choices=sorted(IMAGE_PROFILES), help="chart dpi/palette/compression")
+    wk.add_argument("--section-workers", type=int, default=None,
+                    help="processes laying out each report's sections (default: CPUs / --workers)")
+    sub.add_parser("status", help="counts, throughput and stragglers")
+    rq = sub.add_parser("requeue", help="put failed (or stuck running) jobs back in the queue")
+    rq.add_argument("--running", action="store_true", help="also reset jobs currently marked running")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "work":
+        run_local_workers(args.workers, args.db, args.lease, args.wait, args.image_profile, args.section_workers)
+    conn = connect(args.db)
+    if args.cmd == "enqueue":
+        entities = _entities_for(args.entity_type, args)
+        added = enqueue(conn, args.entity_type, entities, args.out_dir, args.max_attempts)
+        print(f"[queue] {added} job(s) added, {len(entities) - added} already queued")
+    elif args.cmd == "requeue":
+        n = requeue(conn, ("failed", "running") if args.running else ("failed",))
+        print(f"[queue] {n} job(s) requeued")
+    else:
+        _print_status(status(conn))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# src/kpi.py
+# Page-one KPI tiles for every district and school, computed in one vectorized pass.
+#
+#   total_k5   K–5 enrollment (schools; districts = sum of their schools)
+#   read_gap   CAASPP ELA % below standard (Levels 1+2), grades 3–5, weighted by tested
+#   speak_gap  ELPAC Speaking % below Developed (Levels 1+2), grades K–5, weighted by total
+#
+# Each metric also gets statewide and within-county percentile ranks among entities of
+# the same level, from one grouped rank per metric, so a report reads its ranks off the
+# table instead of comparing itself against every other entity.
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from caaspp_summary import caaspp_grade_table, resolve_caaspp_path
+from cde_io import cds_rows
+from fetch_elpac import elpac_grade_table, resolve_elpac_path
+from fetch_enrollment_ca import enrollment_k5_table, resolve_enrollment_path
+
+ENTITY_KEY = ["county_code", "district_code", "school_code"]
+NAME_COLS = ["county_name", "district_name", "school_name"]
+LEVELS = ("district", "school")
+READ_GRADES = ["3", "4", "5"]
+SPEAK_GRADES = ["KN", "1", "2", "3", "4", "5"]
+METRICS = ["total_k5", "read_gap", "speak_gap"]
+
+
+def _weighted_by_entity(df: pd.DataFrame, value: str, weight: str) -> pd.DataFrame:
+    """Weighted mean of `value` per entity; rows with a suppressed (NaN) value carry no weight."""
+    w = df[weight].where(df[value].notna(), 0).astype(float)
+    work = df[ENTITY_KEY + NAME_COLS].assign(_vw=df[value].fillna(0) * w, _w=w)
+    g = work.groupby(ENTITY_KEY, as_index=False).agg(
+        **{c: (c, "first") for c in NAME_COLS}, _vw=("_vw", "sum"), _w=("_w", "sum"))
+    g[value] = np.where(g["_w"] > 0, g["_vw"] / g["_w"].where(g["_w"] > 0, 1), np.nan)
+    return g.drop(columns=["_vw", "_w"])
+
+
+def _reading_gaps(caaspp_path) -> pd.DataFrame:
+    t = caaspp_grade_table(caaspp_path)
+    t = t[(t["subject"] == "ELA") & t["level"].isin(LEVELS) & t["grade"].isin(READ_GRADES)]
+    return _weighted_by_entity(t, "pct_below", "tested").rename(columns={"pct_below": "read_gap"})
+
+
+def _speaking_gaps(elpac_path) -> pd.DataFrame:
+    t = elpac_grade_table(elpac_path)
+    t = t[(t["domain"] == "Speaking") & t["level"].isin(LEVELS) & t["grade"].isin(SPEAK_GRADES)]
+    return _weighted_by_entity(t, "pct_below", "total").rename(columns={"pct_below": "speak_gap"})
+
+
+def _enrollment_totals(enrollment_path) -> pd.DataFrame:
+    schools = enrollment_k5_table(enrollment_path)
+    schools = schools[ENTITY_KEY + NAME_COLS + ["Total"]].rename(columns={"Total": "total_k5"})
+    districts = (schools.groupby(["county_code", "district_code"], as_index=False)
+                        .agg(county_name=("county_name", "first"), district_name=("district_name", "first"),
+                             total_k5=("total_k5", "sum")))
+    districts["school_code"] = 0
+    districts["school_name"] = ""
+    return pd.concat([schools, districts[schools.columns]], ignore_index=True)
+
+
+def add_percentile_ranks(df: pd.DataFrame, metrics=METRICS) -> pd.DataFrame:
+    """
+    For each metric add {m}_state_pctl and {m}_county_pctl: the share (0–100) of entities of
+    the same level — statewide, and within the county — whose value is <= this one.
+    NaN metrics get NaN ranks and are left out of the denominators.
+    """
+    for m in metrics:
+        df[f"{m}_state_pctl"] = df.groupby("level")[m].rank(method="max", pct=True) * 100
+        df[f"{m}_county_pctl"] = df.groupby(["level", "county_code"])[m].rank(method="max", pct=True) * 100
+    return df
+
+
+@lru_cache(maxsize=4)
+def _build(caaspp: str, elpac: str, enrollment: str, mtimes: tuple) -> pd.DataFrame:
+    parts = []
+    for loader, path in ((_enrollment_totals, enrollment), (_reading_gaps, caaspp), (_speaking_gaps, elpac)):
+        try:
+            parts.append(loader(path))
+        except (FileNotFoundError, ValueError) as e:
+            print(f"[warn] KPI source skipped ({loader.__name__}):", e)
+    if not parts:
+        return pd.DataFrame(columns=ENTITY_KEY + NAME_COLS + ["level"] + METRICS)
+
+    out = parts[0]
+    for p in parts[1:]:
+        out = out.merge(p, on=ENTITY_KEY, how="outer", suffixes=("", "_r"))
+        for c in NAME_COLS:  # keep the first source's spelling, fill gaps from the others
+            out[c] = out[c].where(out[c].fillna("") != "", out.pop(f"{c}_r"))
+    for m in METRICS:
+        if m not in out.columns:
+            out[m] = np.nan
+    for c in ENTITY_KEY:
+        out[c] = out[c].astype("Int64")
+    out.insert(3, "level", np.where(out["school_code"] == 0, "district", "school"))
+    return add_percentile_ranks(out).reset_index(drop=True)
+
+
+def kpi_table(caaspp_path=None, elpac_path=None, enrollment_path=None) -> pd.DataFrame:
+    """
+    KPI values and percentile ranks for every district and school (cached per file set + mtimes):
+      county/district/school codes and names, level, total_k5, read_gap, speak_gap,
+      {metric}_state_pctl, {metric}_county_pctl.
+    Shared between callers: filter/copy before mutating it.
+    """
+    caaspp = resolve_caaspp_path(caaspp_path)
+    elpac = resolve_elpac_path(elpac_path)
+    enrollment = resolve_enrollment_path(enrollment_path)
+    mtimes = tuple(p.stat().st_mtime for p in (caaspp, elpac, enrollment))
+    return _build(str(caaspp), str(elpac), str(enrollment), mtimes)
+
+
+def kpi_for(entity_type: str, entity_name: str, cds=None, **paths) -> dict | None:
+    """
+    The precomputed KPI row for one district or school as a dict (None if not found).
+    By its (county, district, school) codes when `cds` is given; otherwise exact
+    (case-insensitive) name match first, then the largest-enrollment name containing it.
+    """
+    if entity_type not in LEVELS:
+        raise ValueError(f"Unknown entity_type: {entity_type}")
+    t = kpi_table(**paths)
+    name_col = "district_name" if entity_type == "district" else "school_name"
+    rows = t[t["level"] == entity_type]
+    if cds is not None:
+        hit = cds_rows(rows, cds)
+    else:
+        names = rows[name_col].fillna("").str.lower()
+        target = entity_name.strip().lower()
+        hit = rows[names == target]
+        if hit.empty:
+            hit = rows[names.str.contains(target, regex=False)]
+    if hit.empty:
+        return None
+    row = hit.sort_values("total_k5", ascending=False, na_position="last").iloc[0]
+    return {k: (None if pd.isna(v) else v) for k, v in row.items()}
@@ -0,0 +1,198 @@
+# src/metric_query.py
+# Range / threshold / top-N queries over every district and school at once.
+#
+# One wide table holds a row per entity (KPI columns plus per-grade CAASPP and ELPAC
+# metrics); each column gets a sorted index (argsort, built on first use), so a
+# condition is two binary searches and a ranking is a slice of the sort order.
+#
+#   python src/metric_query.py "ela_g3_pct_below > 60 and ela_g3_tested > 500"
+#   python src/metric_query.py --top 50 --by speak_gap
+#   python src/metric_query.py "read_gap >= 55" --build        # feed matches to the report builder
+#
+# Columns: total_k5, read_gap, speak_gap (+ _state_pctl / _county_pctl),
+#   {ela|math}_g{grade}_{pct_below|tested|mean_scale_score}            grades 3–8, 11
+#   {listening|speaking|reading|writing|composite}_g{grade}_{pct_below|avg_level|total}
+#                                                                       grades kn, 1–12
+import argparse
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from caaspp_summary import caaspp_grade_table, resolve_caaspp_path
+from fetch_elpac import elpac_grade_table, resolve_elpac_path
+from fetch_enrollment_ca import resolve_enrollment_path
+from kpi import ENTITY_KEY, NAME_COLS, kpi_table
+
+CAASPP_METRICS = ["pct_below", "tested", "mean_scale_score"]
+ELPAC_METRICS = ["pct_below", "avg_level", "total"]
+INFO_COLS = ENTITY_KEY + ["level"] + NAME_COLS
+
+OPS = (">", ">=", "<", "<=", "==")
+CONDITION = re.compile(r"^\s*(\w+)\s*(>=|<=|==|>|<)\s*(-?[\d.]+)\s*$")
+
+
+def _grade_columns(table: pd.DataFrame, by: str, metrics) -> pd.DataFrame:
+    """Long (by, entity, grade) rows -> one row per entity, columns {by}_g{grade}_{metric}."""
+    t = table[table["level"].isin(["district", "school"])]
+    wide = t.pivot_table(index=ENTITY_KEY, columns=[by, "grade"], values=metrics, aggfunc="first")
+    wide.columns = [f"{b.lower()}_g{str(g).lower()}_{m}" for m, b, g in wide.columns]
+    return wide
+
+
+def build_metric_table(caaspp_path=None, elpac_path=None, enrollment_path=None) -> pd.DataFrame:
+    """The wide per-entity table the query index runs over (see module header for columns)."""
+    kpi = kpi_table(caaspp_path, elpac_path, enrollment_path).set_index(ENTITY_KEY)
+    parts = [kpi]
+    for loader, by, metrics in ((caaspp_grade_table, "subject", CAASPP_METRICS),
+                                (elpac_grade_table, "domain", ELPAC_METRICS)):
+        try:
+            parts.append(_grade_columns(loader(caaspp_path if by == "subject" else elpac_path), by, metrics))
+        except (FileNotFoundError, ValueError) as e:
+            print(f"[warn] query columns skipped ({by}):", e)
+    return pd.concat(parts, axis=1, join="outer").reset_index()
+
+
+class MetricIndex:
+    """
+    Sorted per-column indexes over a wide entity table.
+    where() intersects binary-searched ranges; top() reads the sort order from the end.
+    """
+
+    def __init__(self, table: pd.DataFrame):
+        self.table = table.reset_index(drop=True)
+        self.n = len(self.table)
+        self.level_mask = {lv: (self.table["level"] == lv).to_numpy() for lv in ("district", "school")}
+        self._sorted = {}
+
+    @property
+    def columns(self) -> list:
+        return [c for c in self.table.columns if c not in INFO_COLS and pd.api.types.is_numeric_dtype(self.table[c])]
+
+    def _index(self, col: str):
+        """(row order, sorted values) for `col`, NaN rows excluded. Built once per column."""
+        if col not in self._sorted:
+            if col not in self.table.columns:
+                raise KeyError(f"Unknown metric {col!r}. Try one of: {', '.join(self.columns[:12])}, ...")
+            vals = self.table[col].to_numpy(dtype=np.float64)
+            order = np.argsort(vals, kind="stable")
+            order = order[~np.isnan(vals[order])]
+            self._sorted[col] = (order, vals[order])
+        return self._sorted[col]
+
+    def _range(self, col: str, op: str, value: float) -> np.ndarray:
+        order, vals = self._index(col)
+        if op == ">":
+            return order[np.searchsorted(vals, value, "right"):]
+        if op == ">=":
+            return order[np.searchsorted(vals, value, "left"):]
+        if op == "<":
+            return order[:np.searchsorted(vals, value, "left")]
+        if op == "<=":
+            return order[:np.searchsorted(vals, value, "right")]
+        if op == "==":
+            return order[np.searchsorted(vals, value, "left"):np.searchsorted(vals, value, "right")]
+        raise ValueError(f"Unknown operator {op!r}. Expected one of {OPS}.")
+
+    def mask(self, conditions=(), level: str | None = "district") -> np.ndarray:
+        """Boolean row mask for all `conditions` [(column, op, value), ...] at `level`."""
+        m = self.level_mask[level].copy() if level else np.ones(self.n, dtype=bool)
+        for col, op, value in conditions:
+            hit = np.zeros(self.n, dtype=bool)
+            hit[self._range(col, op, float(value))] = True
+            m &= hit
+        return m
+
+    def where(self, conditions=(), level: str | None = "district", order_by: str | None = None,
+              descending: bool = True, limit: int | None = None) -> pd.DataFrame:
+        """
+        Entities matching every condition, e.g.
+          where([("ela_g3_pct_below", ">", 60), ("ela_g3_tested", ">", 500)])
+        ranked by `order_by` (rows without that metric drop out) or by CDS code.
+        Returns the entity columns plus every referenced metric.
+        """
+        m = self.mask(conditions, level)
+        if order_by:
+            order, _ = self._index(order_by)
+            ranked = order[::-1] if descending else order
+            rows = ranked[m[ranked]]
+        else:
+            rows = np.flatnonzero(m)
+        if limit is not None:
+            rows = rows[:limit]
+        cols = list(dict.fromkeys([c for c, _, _ in conditions] + ([order_by] if order_by else [])))
+        return self.table.iloc[rows][INFO_COLS + cols].reset_index(drop=True)
+
+    def top(self, col: str, n: int = 50, level: str | None = "district", descending: bool = True) -> pd.DataFrame:
+        """The n entities with the largest (or smallest) `col`."""
+        return self.where((), level, order_by=col, descending=descending, limit=n)
+
+
+def parse_conditions(text: str) -> list:
+    """'ela_g3_pct_below > 60 and ela_g3_tested > 500' -> [(col, op, value), ...]"""
+    out = []
+    for part in re.split(r"\s+and\s+|,", text or "", flags=re.I):
+        if not part.strip():
+            continue
+        m = CONDITION.match(part)
+        if not m:
+            raise ValueError(f"Can't parse condition {part.strip()!r} (expected e.g. 'read_gap > 50').")
+        out.append((m.group(1).lower(), m.group(2), float(m.group(3))))
+    return out
+
+
+@lru_cache(maxsize=2)
+def _build(caaspp: str, elpac: str, enrollment: str, mtimes: tuple) -> MetricIndex:
+    return MetricIndex(build_metric_table(caaspp, elpac, enrollment))
+
+
+def get_index(caaspp_path=None, elpac_path=None, enrollment_path=None) -> MetricIndex:
+    """Query index for the current data vintage (cached per source files + mtimes)."""
+    paths = (resolve_caaspp_path(caaspp_path), resolve_elpac_path(elpac_path),
+             resolve_enrollment_path(enrollment_path))
+    return _build(*(str(p) for p in paths), tuple(p.stat().st_mtime for p in paths))
+
+
+def query(text: str = "", level: str | None = "district", order_by: str | None = None,
+          descending: bool = True, limit: int | None = None) -> pd.DataFrame:
+    """String form of MetricIndex.where over the default data files."""
+    return get_index().where(parse_conditions(text), level, order_by, descending, limit)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Threshold / top-N queries over per-entity metrics")
+    ap.add_argument("conditions", nargs="?", default="", help="e.g. \"ela_g3_pct_below > 60 and ela_g3_tested > 500\"")
+    ap.add_argument("--level", choices=["district", "school", "any"], default="district")
+    ap.add_argument("--by", help="rank by this metric (descending)")
+    ap.add_argument("--asc", action="store_true", help="rank ascending")
+    ap.add_argument("--top", type=int, help="keep the first N")
+    ap.add_argument("--columns", action="store_true", help="list queryable metrics and exit")
+    ap.add_argument("--build", action="store_true", help="build a PDF report for every matching entity")
+    args = ap.parse_args(argv)
+
+    ix = get_index()
+    if args.columns:
+        print("\n".join(ix.columns))
+        return
+    level = None if args.level == "any" else args.level
+    res = ix.where(parse_conditions(args.conditions), level, args.by, not args.asc, args.top)
+    with pd.option_context("display.max_rows", 200, "display.width", 200):
+        print(res.to_string(index=False))
+    print(f"[query] {len(res)} match(es)")
+
+    if args.build:
+        from build_report import BUILD_TIMINGS, build_pdf  # heavy import only when building
+        from report_template import batch_summary
+        for r in res.itertuples(index=False):
+            etype = r.level
+            ename = r.district_name if etype == "district" else r.school_name
+            try:
+                print(f"[build] {etype} {ename}: {build_pdf(etype, ename)}")
+            except Exception as e:
+                print(f"[build] {etype} {ename} failed:", e)
+        print(batch_summary(BUILD_TIMINGS))
+
+
+if __name__ == "__main__":
+    main()
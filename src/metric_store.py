@@ -0,0 +1,199 @@
+# src/metric_store.py
+# Append-only, year-partitioned store of pre-aggregated per-entity metrics.
+#
+#   output/store/<dataset>/year=<YYYY>/part.pkl       compact per-entity/per-grade table
+#   output/store/<dataset>/year=<YYYY>/rollup.pkl     school/district/county/state rollup of it
+#   output/store/<dataset>/year=<YYYY>/manifest.json  source file fingerprint + row count
+#
+# Adding a new year's files ingests only that year's partitions; trend queries read the
+# small partitions instead of re-parsing every historical research file.
+#
+#   python src/metric_store.py ingest 2025 --caaspp data_raw/caaspp_2025.zip --elpac ... --enrollment ...
+#   python src/metric_store.py list
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+from caaspp_summary import caaspp_grade_table
+from cde_io import BASE_DIR, cds_rows
+from fetch_elpac import elpac_grade_table
+from fetch_enrollment_ca import enrollment_k5_table
+from rollups import rollup
+
+STORE_DIR = BASE_DIR / "output" / "store"
+
+# dataset -> builder(filepath) returning the compact table kept per year
+DATASETS = {
+    "caaspp": caaspp_grade_table,
+    "elpac": elpac_grade_table,
+    "enrollment": enrollment_k5_table,
+}
+ENTITY_KEY = ["county_code", "district_code", "school_code"]
+
+
+def _partition_dir(dataset: str, year: int, store_dir: Path = None) -> Path:
+    return Path(store_dir or STORE_DIR) / dataset / f"year={int(year)}"
+
+
+def file_fingerprint(path) -> str:
+    """sha256 of the source file (compressed bytes as downloaded)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_manifest(dataset: str, year: int, store_dir: Path = None) -> dict | None:
+    mf = _partition_dir(dataset, year, store_dir) / "manifest.json"
+    return json.loads(mf.read_text()) if mf.exists() else None
+
+
+def ingest(dataset: str, year: int, source, replace: bool = False, store_dir: Path = None) -> bool:
+    """
+    Build and write one (dataset, year) partition from `source`.
+    Returns False when the partition already holds this exact file (nothing to do).
+    A different file for an existing year (e.g. a corrected re-release) needs replace=True;
+    partitions are otherwise never rewritten.
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset {dataset!r}. Expected one of {list(DATASETS)}.")
+    source = Path(source).resolve()
+    digest = file_fingerprint(source)
+
+    existing = read_manifest(dataset, year, store_dir)
+    if existing and existing["sha256"] == digest:
+        return False
+    if existing and not replace:
+        raise ValueError(
+            f"{dataset} {year} is already stored from {existing['source']} (sha256 {existing['sha256'][:12]}). "
+            "Pass replace=True (--replace) to swap in a re-release."
+        )
+
+    table = DATASETS[dataset](str(source))
+    part_dir = _partition_dir(dataset, year, store_dir)
+    part_dir.mkdir(parents=True, exist_ok=True)
+
+    # write-then-rename so readers never see a half-written partition
+    for name, frame in (("part.pkl", table), ("rollup.pkl", rollup(dataset, table))):
+        tmp = part_dir / f"{name}.tmp"
+        frame.to_pickle(tmp)
+        os.replace(tmp, part_dir / name)
+    manifest = {
+        "dataset": dataset,
+        "year": int(year),
+        "source": str(source),
+        "sha256": digest,
+        "rows": int(len(table)),
+        "ingested_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    (part_dir / "manifest.json.tmp").write_text(json.dumps(manifest, indent=2))
+    os.replace(part_dir / "manifest.json.tmp", part_dir / "manifest.json")
+    return True
+
+
+def ingest_year(year: int, caaspp=None, elpac=None, enrollment=None, replace: bool = False,
+                store_dir: Path = None) -> dict:
+    """Ingest whichever of the three source files are given for `year`; returns {dataset: written?}."""
+    sources = {"caaspp": caaspp, "elpac": elpac, "enrollment": enrollment}
+    return {ds: ingest(ds, year, src, replace=replace, store_dir=store_dir)
+            for ds, src in sources.items() if src is not None}
+
+
+def years(dataset: str, store_dir: Path = None) -> list:
+    """Years with a stored partition for `dataset`, ascending."""
+    root = Path(store_dir or STORE_DIR) / dataset
+    if not root.exists():
+        return []
+    return sorted(int(p.name.split("=", 1)[1]) for p in root.glob("year=*") if (p / "part.pkl").exists())
+
+
+@lru_cache(maxsize=64)
+def _read_partition(path: str, mtime: float) -> pd.DataFrame:
+    return pd.read_pickle(path)
+
+
+def load(dataset: str, year_list=None, store_dir: Path = None, rollups: bool = False) -> pd.DataFrame:
+    """
+    Stored partitions for `dataset` (all years by default), concatenated with a `year` column.
+    rollups=True returns the stored school/district/county/state rollups instead
+    (computed from part.pkl for partitions ingested before rollups were stored).
+    """
+    parts = []
+    for y in (year_list or years(dataset, store_dir)):
+        part_dir = _partition_dir(dataset, y, store_dir)
+        pkl = part_dir / "part.pkl"
+        if not pkl.exists():
+            continue
+        if rollups and (part_dir / "rollup.pkl").exists():
+            pkl = part_dir / "rollup.pkl"
+        frame = _read_partition(str(pkl), pkl.stat().st_mtime)
+        if rollups and pkl.name == "part.pkl":
+            frame = rollup(dataset, frame)
+        parts.append(frame.assign(year=int(y)))
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts, ignore_index=True)
+
+
+def trend(entity_type: str, entity_name: str, dataset: str = "caaspp", metric: str = "pct_below",
+          subject: str = "ELA", domain: str = "Speaking", store_dir: Path = None, cds=None) -> pd.DataFrame:
+    """
+    Year-over-year table for one district or school: index = year, columns = grade.
+    The entity is followed by its CDS codes (`cds`, or those of its name in the latest
+    year), so renamed districts still line up across years.
+      dataset 'caaspp' (metric: pct_below | mean_scale_score | tested; `subject`)
+      dataset 'elpac'  (metric: pct_below | avg_level | total; `domain`)
+    """
+    df = load(dataset, store_dir=store_dir)
+    if df.empty:
+        return pd.DataFrame()
+    if dataset == "caaspp":
+        df = df[df["subject"] == subject]
+    elif dataset == "elpac":
+        df = df[df["domain"] == domain]
+    else:
+        raise ValueError("Trends are available for the 'caaspp' and 'elpac' datasets.")
+
+    name_col = "district_name" if entity_type == "district" else "school_name"
+    df = df[df["level"] == entity_type]
+    if cds is None:
+        named = df[df[name_col].str.lower() == entity_name.strip().lower()]
+        if named.empty:
+            return pd.DataFrame()
+        cds = tuple(named.sort_values("year").iloc[-1][ENTITY_KEY])
+    rows = cds_rows(df, cds)
+    return rows.pivot_table(index="year", columns="grade", values=metric, aggfunc="first")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Year-partitioned metric store")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ing = sub.add_parser("ingest", help="ingest one year's source files")
+    ing.add_argument("year", type=int)
+    ing.add_argument("--caaspp")
+    ing.add_argument("--elpac")
+    ing.add_argument("--enrollment")
+    ing.add_argument("--replace", action="store_true", help="replace an existing partition (re-release)")
+    sub.add_parser("list", help="show stored partitions")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "ingest":
+        done = ingest_year(args.year, args.caaspp, args.elpac, args.enrollment, replace=args.replace)
+        for ds, written in done.items():
+            print(f"[store] {ds} {args.year}: {'ingested' if written else 'unchanged'}")
+    else:
+        for ds in DATASETS:
+            for y in years(ds):
+                m = read_manifest(ds, y)
+                print(f"{ds:<11} {y}  rows={m['rows']:<8} {m['ingested_at']}  {m['source']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# src/peers.py
+# "Similar districts": nearest neighbours over per-district metric vectors.
+#
+# Each district is described by log K–5 enrollment, CAASPP ELA % below standard for
+# grades 3–5 and ELPAC Speaking % in Levels 1+2 for grades 1–5 (z-scored; a missing
+# grade counts as the state average). The full distance matrix is computed once per data
+# vintage in row batches and only each district's nearest PEERS_K are kept, so a report's
+# lookup is a dict hit plus an array slice.
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from caaspp_summary import caaspp_grade_table, resolve_caaspp_path
+from fetch_elpac import elpac_grade_table, resolve_elpac_path
+from fetch_enrollment_ca import resolve_enrollment_path
+from kpi import kpi_table
+
+DISTRICT_KEY = ["county_code", "district_code"]
+READ_GRADES = ["3", "4", "5"]
+SPEAK_GRADES = ["1", "2", "3", "4", "5"]
+PEERS_K = 10         # neighbours kept per district at build time
+BATCH_ROWS = 1024    # distance-matrix rows per batch (bounds peak memory at ~BATCH_ROWS * n floats)
+
+# relative weight of each feature group in the distance
+FEATURE_WEIGHTS = {"size": 1.0, "read": 1.0, "speak": 1.0}
+
+
+@dataclass
+class Peer:
+    district_name: str
+    county_name: str
+    distance: float
+    total_k5: int | None
+    read_gap: float | None
+    speak_gap: float | None
+
+
+def _grade_matrix(table: pd.DataFrame, grades, prefix: str) -> pd.DataFrame:
+    """District-level pct_below pivoted to one column per grade ({prefix}_{grade})."""
+    t = table[(table["level"] == "district") & table["grade"].isin(grades)]
+    wide = t.pivot_table(index=DISTRICT_KEY, columns="grade", values="pct_below", aggfunc="first")
+    wide = wide.reindex(columns=grades)
+    wide.columns = [f"{prefix}_{g}" for g in grades]
+    return wide
+
+
+def district_vectors(caaspp_path=None, elpac_path=None, enrollment_path=None) -> pd.DataFrame:
+    """
+    One row per district: names, kpi columns and the raw feature columns
+    size (log1p K–5 enrollment), read_3..read_5, speak_1..speak_5.
+    """
+    kpi = kpi_table(caaspp_path, elpac_path, enrollment_path)
+    d = kpi[kpi["level"] == "district"].set_index(DISTRICT_KEY)
+    d = d[["county_name", "district_name", "total_k5", "read_gap", "speak_gap"]]
+    caaspp = caaspp_grade_table(caaspp_path)
+    elpac = elpac_grade_table(elpac_path)
+    d = d.join(_grade_matrix(caaspp[caaspp["subject"] == "ELA"], READ_GRADES, "read"), how="left")
+    d = d.join(_grade_matrix(elpac[elpac["domain"] == "Speaking"], SPEAK_GRADES, "speak"), how="left")
+    d.insert(2, "size", np.log1p(d["total_k5"].astype(float)))
+    return d.reset_index()
+
+
+class PeerIndex:
+    """Top-k nearest districts for every district, precomputed from a batched distance matrix."""
+
+    def __init__(self, vectors: pd.DataFrame, k: int = PEERS_K):
+        self.info = vectors.reset_index(drop=True)
+        groups = {"size": ["size"],
+                  "read": [f"read_{g}" for g in READ_GRADES],
+                  "speak": [f"speak_{g}" for g in SPEAK_GRADES]}
+        cols, weights = [], []
+        for name, gcols in groups.items():
+            cols += gcols
+            # spread a group's weight over its columns so 5 speaking grades don't outvote size
+            weights += [FEATURE_WEIGHTS[name] / np.sqrt(len(gcols))] * len(gcols)
+        x = self.info[cols].to_numpy(dtype=np.float64)
+        mu = np.nanmean(x, axis=0)
+        sd = np.nanstd(x, axis=0)
+        z = (x - mu) / np.where(sd > 0, sd, 1.0)
+        z = np.nan_to_num(z, nan=0.0) * np.array(weights)  # missing -> state average
+        self.x = z.astype(np.float32)
+
+        n = len(self.x)
+        self.k = min(k, max(n - 1, 0))
+        self.neighbors = np.zeros((n, self.k), dtype=np.int32)
+        self.distances = np.zeros((n, self.k), dtype=np.float32)
+        sq = (self.x ** 2).sum(axis=1)
+        for start in range(0, n, BATCH_ROWS):
+            block = self.x[start:start + BATCH_ROWS]
+            d2 = sq[start:start + BATCH_ROWS, None] + sq[None, :] - 2.0 * block @ self.x.T
+            np.maximum(d2, 0, out=d2)
+            d2[np.arange(len(block)), np.arange(start, start + len(block))] = np.inf  # not your own peer
+            if self.k == 0:
+                continue
+            top = np.argpartition(d2, self.k - 1, axis=1)[:, :self.k]
+            top_d = np.take_along_axis(d2, top, axis=1)
+            order = np.argsort(top_d, axis=1, kind="stable")
+            self.neighbors[start:start + len(block)] = np.take_along_axis(top, order, axis=1)
+            self.distances[start:start + len(block)] = np.sqrt(np.take_along_axis(top_d, order, axis=1))
+
+        # plain-Python rows so a query never touches pandas
+        self.records = [
+            (r.district_name, r.county_name,
+             None if pd.isna(r.total_k5) else int(r.total_k5),
+             None if pd.isna(r.read_gap) else float(r.read_gap),
+             None if pd.isna(r.speak_gap) else float(r.speak_gap))
+            for r in self.info[["district_name", "county_name", "total_k5", "read_gap", "speak_gap"]].itertuples(index=False)
+        ]
+        names = self.info["district_name"].fillna("").str.strip().str.lower()
+        self.by_name = {}
+        for i, name in enumerate(names):
+            self.by_name.setdefault(name, i)
+        self.by_code = {(int(c), int(d)): i for i, (c, d) in enumerate(self.info[DISTRICT_KEY].itertuples(index=False))}
+
+    def _row(self, district_name: str, cds=None) -> int | None:
+        if cds is not None:
+            return self.by_code.get((int(cds[0]), int(cds[1])))
+        target = district_name.strip().lower()
+        if target in self.by_name:
+            return self.by_name[target]
+        hits = [i for name, i in self.by_name.items() if target in name]
+        return hits[0] if hits else None
+
+    def peers(self, district_name: str, k: int = 5, cds=None) -> list:
+        """
+        Up to k most similar districts (nearest first); [] when the district is unknown.
+        `cds` = (county, district, school) codes picks the district instead of its name.
+        """
+        i = self._row(district_name, cds)
+        if i is None:
+            return []
+        out = []
+        for j, dist in zip(self.neighbors[i, :k].tolist(), self.distances[i, :k].tolist()):
+            name, county, total_k5, read_gap, speak_gap = self.records[j]
+            out.append(Peer(name, county, round(dist, 3), total_k5, read_gap, speak_gap))
+        return out
+
+
+@lru_cache(maxsize=2)
+def _build(caaspp: str, elpac: str, enrollment: str, mtimes: tuple) -> PeerIndex:
+    return PeerIndex(district_vectors(caaspp, elpac, enrollment))
+
+
+def get_peer_index(caaspp_path=None, elpac_path=None, enrollment_path=None) -> PeerIndex:
+    """Peer index for the current data vintage (cached per source files + mtimes)."""
+    paths = (resolve_caaspp_path(caaspp_path), resolve_elpac_path(elpac_path),
+             resolve_enrollment_path(enrollment_path))
+    return _build(*(str(p) for p in paths), tuple(p.stat().st_mtime for p in paths))
+
+
+def peer_districts(district_name: str, k: int = 5, cds=None) -> list:
+    """The k districts most similar to `district_name` (see PeerIndex)."""
+    return get_peer_index().peers(district_name, k, cds)
@@ -0,0 +1,192 @@
+# src/pipeline.py
+# Overlapped report builds: the three source files load concurrently, each report section
+# (metrics + its matplotlib charts) starts in a worker thread as soon as the sources it
+# reads are ready, and the PDF is laid out once every section's flowables are in.
+#
+#   python src/pipeline.py district "Irvine Unified"
+#   python src/pipeline.py district "Irvine Unified" "Alameda Unified"    # several reports
+#
+# Sections build into their own story lists and are concatenated in page order, so the
+# output is the same document build_report.build_pdf produces. Charts use matplotlib's
+# Figure API (no pyplot state) and write to their own PNG names in the build's private
+# workspace (build_context.BuildContext), so sections and whole builds can render side by
+# side. How much overlaps is bounded by the GIL: pandas parsing and Agg rendering release
+# it only part of the time, so the gain is largest on cold caches.
+import argparse
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import build_report as br
+from build_context import BuildContext
+from caaspp_summary import caaspp_grade_table, load_caaspp_subject, summarize_district_ela
+from fetch_elpac import elpac_grade_table
+from kpi import kpi_table
+from peers import get_peer_index
+from report_template import BuildTimings, batch_summary, get_template, timed
+from rollups import rollup_table
+
+SECTION_WORKERS = 4
+
+
+def load_caaspp_sources():
+    load_caaspp_subject()  # per-subject frames used by the district charts
+    caaspp_grade_table()
+    rollup_table("caaspp")
+
+
+def load_elpac_sources():
+    elpac_grade_table()
+    rollup_table("elpac")
+
+
+def _ela_summary(entity_type, entity_name, cds=None):
+    try:
+        return summarize_district_ela(entity_type, entity_name, cds=cds)
+    except Exception as e:
+        print("[warn] ELA summary failed:", e)
+        return {}
+
+
+def cross_source_indexes():
+    """KPI table + peer index: both need all three sources."""
+    for build in (kpi_table, get_peer_index):
+        try:
+            build()
+        except Exception as e:
+            print(f"[warn] {build.__name__} unavailable:", e)
+
+
+def preload_sources():
+    """Load everything the page builders read (the sequential form of the graph below)."""
+    load_caaspp_sources()
+    load_elpac_sources()
+    cross_source_indexes()
+
+
+def _section(build, ctx, doc) -> list:
+    """Run one page builder into its own story list."""
+    story = []
+    build(ctx, doc, story)
+    return story
+
+
+async def build_pdf_async(entity_type, entity_name, out_path=None, executor=None, image_profile=None, cds=None):
+    """
+    Async build_report.build_pdf. Dependency graph:
+      enrollment file  -> page two (top-10 chart + school table)
+      CAASPP file      -> ELA page,   ELA summary
+      ELPAC file       -> ELPAC page
+      all three        -> KPI table + peer index -> page one
+      metric store     -> trends page
+    "pages" times the whole overlapped load + section phase (loads are not split out).
+    cds: the entity's (county, district, school) codes, as for build_report.build_pdf.
+    """
+    ctx = BuildContext(entity_type, entity_name, out_path, image_profile=image_profile, cds=cds)
+    out_path = ctx.out_path
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    executor = executor or ThreadPoolExecutor(SECTION_WORKERS, thread_name_prefix="report")
+    submitted, tasks = [], []  # pool jobs and dependency tasks, for the error path
+
+    def run(fn, *args):
+        job = executor.submit(fn, *args)
+        submitted.append(job)
+        return asyncio.wrap_future(job)
+
+    timings = BuildTimings(entity=f"{entity_type}:{entity_name}", template_reused=bool(br.BUILD_TIMINGS))
+    t0 = time.perf_counter()
+
+    try:
+        with timed(timings, "template"):
+            tpl = get_template()
+            merge_static = br.PdfWriter is not None
+            buf = io.BytesIO() if merge_static else None
+            doc = tpl.doc(buf if merge_static else out_path)
+
+        with timed(timings, "pages"):
+            # sources, each in its own thread
+            enrollment = run(br.get_enrollment_for_report, entity_type, entity_name, cds)
+            caaspp = run(load_caaspp_sources)
+            elpac = run(load_elpac_sources)
+            trends = run(_section, br.build_page_trends, ctx, doc)
+            if merge_static:
+                references = run(br.references_fragment, None, ctx.cache_dir)
+
+            # sections, each started as soon as its inputs are loaded
+            def after(deps, fn, *args):
+                async def go():
+                    await asyncio.gather(*deps)
+                    return await run(fn, *args)
+                task = asyncio.ensure_future(go())
+                tasks.append(task)
+                return task
+
+            ela_page = after([caaspp], _section, br.build_page_caaspp_ela, ctx, doc)
+            elpac_page = after([elpac], _section, br.build_page_elpac_speaking, ctx, doc)
+            ela_info = after([caaspp], _ela_summary, entity_type, entity_name, cds)
+            indexes = after([enrollment, caaspp, elpac], cross_source_indexes)
+
+            ctx.df_enr = await enrollment
+            page_two = run(_section, br.build_page_two_enrollment_table, ctx, doc)
+            await asyncio.gather(indexes, ela_info)
+            ctx.ela_info = ela_info.result()
+            page_one = run(_section, br.build_page_one, ctx, doc)
+
+            story = []
+            for part in await asyncio.gather(page_one, page_two, ela_page, elpac_page, trends):
+                story += part
+            if not merge_static:
+                br.build_references_page(story)
+
+        with timed(timings, "layout"):
+            await run(doc.build, story)
+        if merge_static:
+            with timed(timings, "merge"):
+                br.append_static_pages(buf.getvalue(), [await references], out_path,
+                                         ctx.image_profile.compress_level)
+    except BaseException:
+        # Nothing may still be writing into the workspace when it is removed (or run on
+        # into the next report on a shared pool): drop what hasn't started, wait for the
+        # rest and collect their exceptions.
+        for task in tasks:
+            task.cancel()
+        for job in submitted:
+            job.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*(asyncio.wrap_future(job) for job in submitted), return_exceptions=True)
+        raise
+    finally:
+        ctx.close()
+        if own_executor:
+            executor.shutdown(wait=False)
+
+    br.BUILD_TIMINGS.append(timings)
+    print(f"[timing] {entity_name}: {time.perf_counter() - t0:.2f}s wall")
+    return out_path
+
+
+def build_pdf(entity_type, entity_name, out_path=None, image_profile=None, cds=None):
+    """Synchronous entry point for build_pdf_async."""
+    return asyncio.run(build_pdf_async(entity_type, entity_name, out_path, image_profile=image_profile, cds=cds))
+
+
+async def build_many(entity_type, names):
+    """Several reports in sequence sharing one worker pool (and the warm source caches)."""
+    with ThreadPoolExecutor(SECTION_WORKERS, thread_name_prefix="report") as pool:
+        return [await build_pdf_async(entity_type, n, executor=pool) for n in names]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build reports with overlapped loading, charting and layout")
+    ap.add_argument("entity_type", choices=["district", "school"])
+    ap.add_argument("names", nargs="+")
+    args = ap.parse_args(argv)
+    for path in asyncio.run(build_many(args.entity_type, args.names)):
+        print(f"[info] PDF successfully built at: {path}")
+    print(batch_summary(br.BUILD_TIMINGS))
+
+
+if __name__ == "__main__":
+    main()
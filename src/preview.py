@@ -0,0 +1,315 @@
+# src/preview.py
+# Fast HTML preview of a report: one self-contained page (inline CSS + SVG charts, no
+# images, no external assets) with the same sections and numbers as build_report.build_pdf:
+# KPI tiles, enrollment by grade, similar districts, enrollment by school, CAASPP reading
+# gap and ELPAC speaking gap (each with the county/state comparison), and the references.
+# Nothing is rasterized and reportlab is not involved, so a preview renders in
+# milliseconds once the data caches are warm; the PDF is built only when downloaded.
+#
+#   python src/preview.py district "Irvine Unified" --out reports/Irvine_Unified.html
+#   python src/preview.py district "Irvine Unified" --pdf-href /reports/Irvine_Unified_Report.pdf
+import argparse
+import html
+import math
+import os
+import time
+from datetime import date
+from functools import lru_cache
+
+import pandas as pd
+
+from build_context import REPORTS_DIR
+from caaspp_summary import district_ela_pct_below_standard_by_grade
+from fetch_elpac import district_elpac_speaking_pct_below_by_grade
+from fetch_enrollment_ca import enrollment_k5_table, resolve_enrollment_path
+from kpi import kpi_for
+from peers import peer_districts
+from report_template import REFERENCES, REFERENCES_NOTE
+from rollups import comparison
+
+# matplotlib's default cycle, so preview bars match the PDF charts
+PALETTE = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd"]
+SVG_W, SVG_H = 640, 300
+PLOT = dict(left=56, right=16, top=36, bottom=40)
+GRADES_1_5 = ["1", "2", "3", "4", "5"]
+K5_COLS = ["K", "1", "2", "3", "4", "5", "Total"]
+
+CSS = """
+body{font-family:Helvetica,Arial,sans-serif;max-width:760px;margin:24px auto;color:#111827;padding:0 12px}
+h1{font-size:26px;margin:0 0 4px}h2{font-size:19px;margin:28px 0 8px;border-bottom:1px solid #E5E7EB}
+h3{font-size:15px;margin:16px 0 6px}.muted{color:#6B7280;font-size:13px}.note{font-style:italic;font-size:13px}
+.tiles{display:flex;gap:0;margin:12px 0}.tile{flex:1;text-align:center;color:#fff}
+.tile .v{background:#2563EB;font-size:28px;font-weight:bold;padding:18px 0}
+.tile .k{background:#1E40AF;font-weight:bold;padding:8px 4px}.tile .r{background:#1E40AF;font-size:11px;padding:0 4px 8px}
+table{border-collapse:collapse;width:100%;font-size:12px}th,td{border:1px solid #CBD5E1;padding:3px 6px}
+th{background:#E5E7EB}td.n,th.n{text-align:right}tr:nth-child(even) td{background:#F8FAFC}
+.download{display:inline-block;margin:8px 0;padding:6px 12px;background:#1E40AF;color:#fff;text-decoration:none;border-radius:4px}
+svg text{font-family:Helvetica,Arial,sans-serif}
+"""
+
+
+def _esc(v) -> str:
+    return html.escape(str(v), quote=True)
+
+
+def _is_num(v) -> bool:
+    return isinstance(v, (int, float)) and not (isinstance(v, float) and math.isnan(v))
+
+
+def _gap_y_max(values) -> float:
+    """Same axis rule as the PDF gap charts: 5 above the max rounded up to 5, within [30, 100]."""
+    valid = [v for v in values if _is_num(v)]
+    return max(30, min(100, math.ceil((max(valid) if valid else 0) / 5.0) * 5 + 5))
+
+
+def _nice_max(v: float) -> float:
+    if v <= 0:
+        return 1
+    step = 10 ** math.floor(math.log10(v))
+    for m in (1, 2, 2.5, 5, 10):
+        if v <= m * step:
+            return m * step
+    return 10 * step
+
+
+def _svg_open(title, y_label):
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {SVG_W} {SVG_H}" width="100%" role="img" aria-label="{_esc(title)}">',
+             f'<text x="{SVG_W / 2}" y="20" text-anchor="middle" font-size="15">{_esc(title)}</text>']
+    if y_label:
+        cy = (PLOT["top"] + SVG_H - PLOT["bottom"]) / 2
+        parts.append(f'<text x="14" y="{cy}" font-size="11" text-anchor="middle" transform="rotate(-90 14 {cy})">{_esc(y_label)}</text>')
+    return parts
+
+
+def _y_axis(parts, y_max, fmt="{:g}"):
+    x0, x1 = PLOT["left"], SVG_W - PLOT["right"]
+    y0, h = SVG_H - PLOT["bottom"], SVG_H - PLOT["bottom"] - PLOT["top"]
+    for i in range(6):
+        v = y_max * i / 5
+        y = y0 - h * i / 5
+        parts.append(f'<line x1="{x0}" x2="{x1}" y1="{y:.1f}" y2="{y:.1f}" stroke="#E5E7EB"/>')
+        parts.append(f'<text x="{x0 - 6}" y="{y + 4:.1f}" font-size="10" text-anchor="end">{fmt.format(v)}</text>')
+    parts.append(f'<line x1="{x0}" x2="{x0}" y1="{PLOT["top"]}" y2="{y0}" stroke="#111827"/>')
+    parts.append(f'<line x1="{x0}" x2="{x1}" y1="{y0}" y2="{y0}" stroke="#111827"/>')
+
+
+def svg_bar_chart(labels, values, title="", y_label="", y_max=None, value_fmt=None) -> str:
+    """Vertical bars; None/NaN values draw as an 'N/A' label on the axis."""
+    y_max = y_max or _nice_max(max([v for v in values if _is_num(v)] or [0]))
+    parts = _svg_open(title, y_label)
+    _y_axis(parts, y_max)
+    x0, plot_w = PLOT["left"], SVG_W - PLOT["left"] - PLOT["right"]
+    y0, h = SVG_H - PLOT["bottom"], SVG_H - PLOT["bottom"] - PLOT["top"]
+    slot = plot_w / max(len(labels), 1)
+    for i, (lab, v) in enumerate(zip(labels, values)):
+        cx = x0 + slot * (i + 0.5)
+        if _is_num(v):
+            bh = h * min(v, y_max) / y_max
+            parts.append(f'<rect x="{cx - slot * 0.4:.1f}" y="{y0 - bh:.1f}" width="{slot * 0.8:.1f}" height="{bh:.1f}" fill="{PALETTE[0]}"><title>{_esc(lab)}: {v:,.1f}</title></rect>')
+            if value_fmt:
+                parts.append(f'<text x="{cx:.1f}" y="{y0 - bh - 4:.1f}" font-size="11" text-anchor="middle">{_esc(value_fmt(v))}</text>')
+        else:
+            parts.append(f'<text x="{cx:.1f}" y="{y0 - 4}" font-size="11" text-anchor="middle">N/A</text>')
+        parts.append(f'<text x="{cx:.1f}" y="{y0 + 16}" font-size="11" text-anchor="middle">{_esc(lab)}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def svg_grouped_bars(labels, series: dict, title="", y_label="", y_max=100) -> str:
+    """One group per label, one bar per series (entity / county / state), with a legend."""
+    parts = _svg_open(title, y_label)
+    _y_axis(parts, y_max)
+    x0, plot_w = PLOT["left"], SVG_W - PLOT["left"] - PLOT["right"]
+    y0, h = SVG_H - PLOT["bottom"], SVG_H - PLOT["bottom"] - PLOT["top"]
+    slot = plot_w / max(len(labels), 1)
+    n = max(len(series), 1)
+    bw = slot * 0.8 / n
+    for s, (name, values) in enumerate(series.items()):
+        color = PALETTE[s % len(PALETTE)]
+        for i, v in enumerate(values):
+            if not _is_num(v):
+                continue
+            x = x0 + slot * (i + 0.1) + bw * s
+            bh = h * min(v, y_max) / y_max
+            parts.append(f'<rect x="{x:.1f}" y="{y0 - bh:.1f}" width="{bw:.1f}" height="{bh:.1f}" fill="{color}"><title>{_esc(name)}, grade {_esc(labels[i])}: {v:.1f}</title></rect>')
+        ly = PLOT["top"] + 4 + 14 * s
+        lx = SVG_W - PLOT["right"] - 190
+        parts.append(f'<rect x="{lx}" y="{ly}" width="10" height="10" fill="{color}"/>'
+                     f'<text x="{lx + 14}" y="{ly + 9}" font-size="10">{_esc(name)}</text>')
+    for i, lab in enumerate(labels):
+        parts.append(f'<text x="{x0 + slot * (i + 0.5):.1f}" y="{y0 + 16}" font-size="11" text-anchor="middle">Grade {_esc(lab)}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def svg_hbar_chart(names, values, title="", x_label="") -> str:
+    """Horizontal bars, first item on top (top-10 schools)."""
+    left, right, top, bottom = 200, 24, 32, 36
+    row = (SVG_H - top - bottom) / max(len(names), 1)
+    x_max = _nice_max(max(values or [0]))
+    w = SVG_W - left - right
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {SVG_W} {SVG_H}" width="100%" role="img" aria-label="{_esc(title)}">',
+             f'<text x="{SVG_W / 2}" y="20" text-anchor="middle" font-size="15">{_esc(title)}</text>']
+    for i in range(6):
+        x = left + w * i / 5
+        parts.append(f'<line x1="{x:.1f}" x2="{x:.1f}" y1="{top}" y2="{SVG_H - bottom}" stroke="#E5E7EB"/>'
+                     f'<text x="{x:.1f}" y="{SVG_H - bottom + 14}" font-size="10" text-anchor="middle">{x_max * i / 5:,.0f}</text>')
+    for i, (name, v) in enumerate(zip(names, values)):
+        y = top + row * i
+        label = name if len(name) <= 32 else name[:31] + "…"
+        parts.append(f'<text x="{left - 6}" y="{y + row * 0.65:.1f}" font-size="10" text-anchor="end">{_esc(label)}</text>'
+                     f'<rect x="{left}" y="{y + row * 0.15:.1f}" width="{w * v / x_max:.1f}" height="{row * 0.7:.1f}" fill="{PALETTE[0]}"><title>{_esc(name)}: {v:,}</title></rect>')
+    parts.append(f'<text x="{left + w / 2}" y="{SVG_H - 6}" font-size="11" text-anchor="middle">{_esc(x_label)}</text></svg>')
+    return "".join(parts)
+
+
+@lru_cache(maxsize=2)
+def _k5_table(path: str, mtime: float) -> pd.DataFrame:
+    return enrollment_k5_table(path)
+
+
+def enrollment_rows(entity_type: str, entity_name: str) -> pd.DataFrame:
+    """
+    School | K..5 | Total for the report, from the statewide K–5 table (the same row pick
+    as build_report.get_enrollment_for_report, without re-reading the file per report).
+    """
+    path = resolve_enrollment_path()
+    t = _k5_table(str(path), path.stat().st_mtime)
+    col = "district_name" if entity_type == "district" else "school_name"
+    names = t[col].str.lower()
+    target = entity_name.strip().lower()
+    rows = t[names == target]
+    if rows.empty:
+        rows = t[names.str.contains(target, regex=False)]
+    if rows.empty:
+        raise ValueError(f"No enrollment rows found for {entity_type} '{entity_name}'.")
+    return rows.rename(columns={"school_name": "School"})[["School"] + K5_COLS].reset_index(drop=True)
+
+
+def _kpi_section(df_enr, kpi, entity_type) -> list:
+    total_k5 = int(df_enr["Total"].sum())
+    if kpi is None:
+        return [f"<p><b>Total K-5 Enrollment:</b> {total_k5:,}</p>"]
+    pct = lambda v: f"{v:.0f}%" if v is not None else "–"
+    pctl = lambda m, scope: f"{kpi[f'{m}_{scope}_pctl']:.0f}" if kpi.get(f"{m}_{scope}_pctl") is not None else "–"
+    tiles = [("Total K-5 Enrollment", f"{total_k5:,}", "total_k5"),
+             ("Avg Reading Gap (3–5)", pct(kpi.get("read_gap")), "read_gap"),
+             ("Avg Speaking Gap (K–5 ELs)", pct(kpi.get("speak_gap")), "speak_gap")]
+    out = ['<div class="tiles">']
+    for label, value, m in tiles:
+        out.append(f'<div class="tile"><div class="v">{_esc(value)}</div><div class="k">{_esc(label)}</div>'
+                   f'<div class="r">State pctl {pctl(m, "state")} · County pctl {pctl(m, "county")}</div></div>')
+    out.append("</div>")
+    out.append(f'<p class="note">Percentiles compare against all California {entity_type}s '
+               "(and those in the same county); higher = larger value.</p>")
+    return out
+
+
+def _table(headers, rows, numeric_from=1) -> str:
+    head = "".join(f'<th{" class=n" if i >= numeric_from else ""}>{_esc(h)}</th>' for i, h in enumerate(headers))
+    body = "".join("<tr>" + "".join(f'<td{" class=n" if i >= numeric_from else ""}>{_esc(v)}</td>' for i, v in enumerate(r)) + "</tr>"
+                   for r in rows)
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+
+def _gap_section(heading, labels, own, dataset, entity_type, entity_name, chart_title, y_label,
+                 compare_title, note, **filters) -> list:
+    out = [f"<h2>{_esc(heading)}</h2>",
+           svg_bar_chart(labels, own, chart_title, y_label, y_max=_gap_y_max(own), value_fmt=lambda v: f"{v:.0f}%")]
+    try:
+        parents = comparison(dataset, entity_type, entity_name, grades=labels, include_self=False, **filters)
+    except Exception as e:
+        print("[warn] rollup comparison unavailable:", e)
+        parents = {}
+    if parents:
+        out.append(svg_grouped_bars(labels, {entity_name: own, **parents}, compare_title, y_label))
+    out.append(f'<p class="note">{note}</p>')
+    return out
+
+
+def render_preview(entity_type: str, entity_name: str, pdf_href: str | None = None) -> str:
+    """The report as one self-contained HTML document (string)."""
+    heading = f"{entity_name} — Executive Summary" if entity_name else "Executive Summary"
+    body = [f"<h1>{_esc(heading)}</h1>", f'<div class="muted">{date.today():%B %d, %Y}</div>']
+    if pdf_href:
+        body.append(f'<a class="download" href="{_esc(pdf_href)}">Download PDF</a>')
+
+    df_enr = enrollment_rows(entity_type, entity_name)
+    try:
+        kpi = kpi_for(entity_type, entity_name)
+    except Exception as e:
+        print("[warn] KPI table unavailable:", e)
+        kpi = None
+    body += _kpi_section(df_enr, kpi, entity_type)
+    body.append(svg_bar_chart(GRADES_1_5, [int(df_enr[g].sum()) for g in GRADES_1_5],
+                              "Enrollment by Grade (1–5)", "Students"))
+
+    if entity_type == "district":
+        try:
+            peers = peer_districts(entity_name)
+        except Exception as e:
+            print("[warn] peer index unavailable:", e)
+            peers = []
+        if peers:
+            fmt = lambda v, spec, suffix="": format(v, spec) + suffix if v is not None else "–"
+            body.append("<h3>Similar Districts</h3>")
+            body.append(_table(["District", "County", "K-5 Enrollment", "Reading Gap", "Speaking Gap"],
+                               [[p.district_name, p.county_name, fmt(p.total_k5, ","), fmt(p.read_gap, ".0f", "%"),
+                                 fmt(p.speak_gap, ".0f", "%")] for p in peers], numeric_from=2))
+
+    body.append("<h2>" + ("Enrollment by School (K–5)" if entity_type == "district"
+                          else f"Enrollment — {_esc(entity_name)} (K–5)") + "</h2>")
+    rows = df_enr[["School"] + K5_COLS].values.tolist()
+    if entity_type == "district":
+        top10 = sorted(rows, key=lambda r: r[-1], reverse=True)[:10]
+        body.append(svg_hbar_chart([r[0] for r in top10], [int(r[-1]) for r in top10],
+                                   "Top 10 Schools by K–5 Enrollment", "Students"))
+    body.append(_table(["School"] + K5_COLS, [[r[0]] + [f"{int(v):,}" for v in r[1:]] for r in rows]))
+
+    if entity_type == "school":
+        body.append("<h2>Reading (CAASPP ELA) — % Not Meeting Standard</h2><p class=note>School-level CAASPP wiring coming soon.</p>")
+        body.append("<h2>Speaking (ELPAC) by Grade (1–5)</h2><p class=note>School-level ELPAC wiring coming soon.</p>")
+    else:
+        labels, pct_below, _ = district_ela_pct_below_standard_by_grade(entity_name)
+        body += _gap_section(
+            "Reading (CAASPP ELA) — % Not Meeting Standard", labels, pct_below, "caaspp", entity_type, entity_name,
+            "Reading Gap by Grade", "% Below Standard (L1 + L2)", "Reading Gap vs County and State",
+            "Note: CAASPP ELA is administered starting in grade 3; grades 1–2 display as N/A. "
+            "Chart displays % of students in Levels 1 + 2 (Standard Not Met + Nearly Met).", subject="ELA")
+        labels, pct_below, _ = district_elpac_speaking_pct_below_by_grade(entity_name)
+        body += _gap_section(
+            "Speaking (ELPAC) by Grade (1–5)", labels, pct_below, "elpac", entity_type, entity_name,
+            "Speaking Gap by Grade", "% in Levels 1 + 2 (Speaking)", "Speaking Gap vs County and State",
+            "Note: ELPAC Speaking uses performance levels (1 = Begin, 2 = Moderate, 3 = Developed). "
+            "Chart shows the percentage of students in Levels 1 + 2 per grade.", domain="Speaking")
+
+    accessed = f"{date.today():%B %d, %Y}"
+    body.append("<h2>Data Sources &amp; References</h2><ul>")
+    for r in REFERENCES:
+        body.append(f'<li><b>{_esc(r["title"])}</b><br><span class="muted">{_esc(r["desc"])}<br>Accessed: {accessed}</span>'
+                    f'<br><a href="{_esc(r["url"])}">{_esc(r["url"])}</a></li>')
+    body.append(f'</ul><p class="note">{_esc(REFERENCES_NOTE)}</p>')
+
+    return ("<!DOCTYPE html><html lang=\"en\"><head><meta charset=\"utf-8\">"
+            f"<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\"><title>{_esc(heading)}</title>"
+            f"<style>{CSS}</style></head><body>{''.join(body)}</body></html>")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Self-contained HTML/SVG preview of a report")
+    ap.add_argument("entity_type", choices=["district", "school"])
+    ap.add_argument("entity_name", nargs="+")
+    ap.add_argument("--out", help=f"output .html (default {REPORTS_DIR}/<name>_Preview.html)")
+    ap.add_argument("--pdf-href", help="link target for the 'Download PDF' button")
+    args = ap.parse_args(argv)
+    name = " ".join(args.entity_name).strip()
+    t0 = time.perf_counter()
+    page = render_preview(args.entity_type, name, args.pdf_href)
+    out = args.out or os.path.join(REPORTS_DIR, f"{name.replace(' ', '_')}_Preview.html")
+    with open(out, "w", encoding="utf-8") as fh:
+        fh.write(page)
+    print(f"[preview] {out} ({len(page) / 1024:.0f} KB) in {1000 * (time.perf_counter() - t0):.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+# src/report_template.py
+# Paragraph styles, table styles and page geometry for the PDF reports, compiled once per
+# process and shared by every build, so a batch run does not rebuild the same stylesheet
+# and TableStyles for each page of each report.
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Table, TableStyle
+
+PAGE_MARGINS = dict(left=0.5*inch, right=0.5*inch, top=0.5*inch, bottom=0.5*inch)
+FRAME_PADDING = 6  # SimpleDocTemplate's frame padding per side, points
+
+TABLE_FONT = "Helvetica"
+TABLE_FONT_BOLD = "Helvetica-Bold"
+TABLE_FONT_SIZE = 9
+
+# Data sources listed on the references page (PDF and HTML preview)
+REFERENCES = [
+    {
+        "title": "California Department of Education — Enrollment by Grade (2024–25)",
+        "desc": "Official enrollment counts by grade for all public schools and districts in California.",
+        "url": "https://www.cde.ca.gov/ds/sd/sd/",
+    },
+    {
+        "title": "CAASPP Research Files — 2024 ELA Summative Assessment",
+        "desc": "ELA (English Language Arts) results for grades 3–8 and 11, including mean scale scores and proficiency levels.",
+        "url": "https://caaspp-elpac.ets.org/caaspp/ResearchFileListSB.aspx",
+    },
+    {
+        "title": "CAASPP Program Overview & Documentation",
+        "desc": "Benchmarks and performance level descriptors for CAASPP ELA.",
+        "url": "https://www.cde.ca.gov/ta/tg/ca/",
+    },
+    {
+        "title": "ELPAC Research Files — 2024 Summative Assessment",
+        "desc": "Speaking domain results for grades 1–5, including performance levels and counts for California public schools and districts.",
+        "url": "https://www.cde.ca.gov/ta/tg/ep/elpacresearch.asp",
+    },
+    {
+        "title": "ELPAC Program Overview & Documentation",
+        "desc": "Benchmarks, domains, and performance level descriptors for the ELPAC.",
+        "url": "https://www.cde.ca.gov/ta/tg/ep/",
+    },
+]
+
+REFERENCES_NOTE = (
+    "Notes: Enrollment is sourced from CDE’s statewide census file; CAASPP ELA results are computed as weighted averages across tested grades. "
+    "District-level CAASPP rows are identified by School Code 0000000; “All Students” corresponds to Student Group ID 1."
+)
+
+
+class ReportTemplate:
+    """
+    Shared, read-only layout objects:
+      styles        sample stylesheet + the report's own paragraph styles (Tile, Val, Rank)
+      table_styles  TableStyles by name: kpi_tiles, peers, school_table
+      doc(target)   a new SimpleDocTemplate with the report's page size/margins
+    Flowables only read these, so one instance serves every build in the process.
+    """
+
+    def __init__(self, pagesize=letter, margins=None):
+        t0 = time.perf_counter()
+        self.pagesize = pagesize
+        self.margins = dict(margins or PAGE_MARGINS)
+
+        self.styles = getSampleStyleSheet()
+        self.styles.add(ParagraphStyle(
+            "Tile", parent=self.styles["Heading3"], alignment=1, textColor=colors.white))
+        self.styles.add(ParagraphStyle(
+            "Val", parent=self.styles["Title"], alignment=1, textColor=colors.white))
+        self.styles.add(ParagraphStyle(
+            "Rank", parent=self.styles["BodyText"], alignment=1, fontSize=8, leading=10, textColor=colors.white))
+
+        self.table_styles = {
+            "kpi_tiles": TableStyle([
+                ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#2563EB")),  # values row
+                ("BACKGROUND", (0,1), (-1,-1), colors.HexColor("#1E40AF")),  # labels (+ ranks) rows
+                ("ALIGN", (0,0), (-1,-1), "CENTER"),
+                ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+                ("TEXTCOLOR", (0,0), (-1,-1), colors.white),
+                ("INNERGRID", (0,0), (-1,-1), 0.0, colors.white),
+                ("BOX", (0,0), (-1,-1), 0.0, colors.white),
+                ("BOTTOMPADDING", (0,1), (-1,1), 6),
+            ]),
+            "peers": TableStyle([
+                ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#1E40AF")),
+                ("TEXTCOLOR", (0,0), (-1,0), colors.white),
+                ("FONTSIZE", (0,0), (-1,-1), 9),
+                ("ALIGN", (2,0), (-1,-1), "CENTER"),
+                ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.white, colors.HexColor("#F1F5F9")]),
+                ("GRID", (0,0), (-1,-1), 0.25, colors.HexColor("#CBD5E1")),
+            ]),
+            # Only the per-cell commands that differ from reportlab's defaults (Helvetica, 6 pt
+            # side padding): each one is applied cell by cell on every chunk.
+            "school_table": TableStyle([
+                ("FONTNAME", (0,0), (-1,0), TABLE_FONT_BOLD),
+                ("FONTSIZE", (0,0), (-1,0), TABLE_FONT_SIZE + 1),
+                ("FONTSIZE", (0,1), (-1,-1), TABLE_FONT_SIZE),
+                ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#E5E7EB")),  # header gray
+                ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.whitesmoke, colors.white]),
+                ("GRID", (0,0), (-1,-1), 0.25, colors.HexColor("#9CA3AF")),
+                ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+                ("ALIGN", (1,0), (-1,-1), "RIGHT"),
+            ]),
+        }
+
+        # usable frame (width, height), measured once from a probe doc with the same settings
+        probe = self.doc(None)
+        self.frame_size = (probe.width - 2 * FRAME_PADDING, probe.height - 2 * FRAME_PADDING)
+        self.compile_seconds = time.perf_counter() - t0
+
+    def doc(self, target, profile: bool = False) -> SimpleDocTemplate:
+        """
+        A fresh doc template (docs and their frames hold layout state: one per build).
+        profile=True returns a ProfilingDocTemplate that times every flowable.
+        """
+        cls = ProfilingDocTemplate if profile else SimpleDocTemplate
+        return cls(target, pagesize=self.pagesize, **self.margins)
+
+
+@lru_cache(maxsize=4)
+def get_template(pagesize=letter) -> ReportTemplate:
+    """The process-wide template for `pagesize` (compiled on first use)."""
+    return ReportTemplate(pagesize)
+
+
+@dataclass
+class BuildTimings:
+    """Wall-clock seconds per build stage, for batch instrumentation."""
+    entity: str
+    stages: dict = field(default_factory=dict)
+    template_reused: bool = False
+
+    @property
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+
+@contextmanager
+def timed(timings: BuildTimings, stage: str):
+    """with timed(t, "layout"): ...  -> adds the elapsed seconds to t.stages["layout"]."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.stages[stage] = timings.stages.get(stage, 0.0) + time.perf_counter() - t0
+
+
+def batch_summary(builds: list, template: ReportTemplate = None) -> str:
+    """
+    Per-stage means over a batch plus the layout setup avoided by reusing one template:
+    every report after the first skips a full style compile (template.compile_seconds).
+    """
+    if not builds:
+        return "[timing] no reports built"
+    template = template or get_template()
+    stages = {}
+    for b in builds:
+        for k, v in b.stages.items():
+            stages.setdefault(k, []).append(v)
+    lines = [f"[timing] {len(builds)} report(s), {sum(b.total for b in builds):.2f}s total"]
+    for k, vals in stages.items():
+        lines.append(f"[timing]   {k:<10} mean {1000 * sum(vals) / len(vals):8.1f} ms")
+    reused = sum(b.template_reused for b in builds)
+    lines.append(f"[timing] styles compiled once in {1000 * template.compile_seconds:.1f} ms; "
+                 f"reused by {reused} report(s), ~{1000 * template.compile_seconds * reused:.1f} ms layout setup saved")
+    return "\n".join(lines)
+
+
+# ---- Layout profiling ----
+PROFILED_PHASES = ("wrap", "split", "drawOn")
+
+
+def _flowable_label(f) -> str:
+    """Short identifying label for a profile frame: paragraph text, image file, table shape."""
+    if isinstance(f, Paragraph):
+        text = " ".join(f.getPlainText().split())
+        label = text[:40] + ("…" if len(text) > 40 else "")
+    elif isinstance(f, Image):
+        label = os.path.basename(str(getattr(f, "filename", "") or "image"))
+    elif isinstance(f, Table):
+        label = f"{f._nrows}x{f._ncols}"
+    else:
+        label = type(f).__name__
+    return label.replace(";", ",") or type(f).__name__
+
+
+class LayoutProfile:
+    """
+    Seconds spent per (page, flowable, phase) during one doc.build, plus each page's wall
+    time, so reportlab's own per-page work shows up as "(page overhead)".
+    """
+
+    def __init__(self):
+        self.records = []     # (page, kind, label, phase, seconds)
+        self.pages = {}       # page -> wall seconds from beforePage to afterPage
+        self.total = 0.0      # whole build, including the final canvas save
+
+    def add(self, page, kind, label, phase, seconds):
+        self.records.append((page, kind, label, phase, seconds))
+
+    def by_kind(self) -> dict:
+        """{kind -> {phase -> seconds}}, e.g. {"Table": {"wrap": .., "drawOn": ..}, "Image": ...}"""
+        out = {}
+        for _, kind, _, phase, sec in self.records:
+            out.setdefault(kind, {}).setdefault(phase, 0.0)
+            out[kind][phase] += sec
+        return out
+
+    def folded(self) -> list:
+        """
+        Collapsed-stack lines ("layout;page 3;Table;42x8;drawOn 1234", values in µs) for
+        flamegraph.pl / speedscope / inferno.
+        """
+        stacks = {}
+        for page, kind, label, phase, sec in self.records:
+            key = f"layout;page {page};{kind};{label};{phase}"
+            stacks[key] = stacks.get(key, 0.0) + sec
+        flowable_secs = {}
+        for page, _, _, _, sec in self.records:
+            flowable_secs[page] = flowable_secs.get(page, 0.0) + sec
+        for page, wall in self.pages.items():
+            rest = wall - flowable_secs.get(page, 0.0)
+            if rest > 0:
+                stacks[f"layout;page {page};(page overhead)"] = rest
+        rest = self.total - sum(self.pages.values())
+        if rest > 0:
+            stacks["layout;(setup + canvas save)"] = rest
+        return [f"{k} {max(int(round(v * 1e6)), 1)}" for k, v in stacks.items()]
+
+    def write_folded(self, path):
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write("\n".join(self.folded()) + "\n")
+
+    def summary(self, top: int = 8) -> str:
+        lines = [f"[layout] {1000 * self.total:.1f} ms over {len(self.pages)} page(s)"]
+        kinds = sorted(self.by_kind().items(), key=lambda kv: -sum(kv[1].values()))
+        for kind, phases in kinds:
+            detail = ", ".join(f"{ph} {1000 * sec:.1f}" for ph, sec in phases.items())
+            lines.append(f"[layout]   {kind:<12} {1000 * sum(phases.values()):8.1f} ms  ({detail})")
+        per_flowable = {}
+        for page, kind, label, _, sec in self.records:
+            per_flowable[(page, kind, label)] = per_flowable.get((page, kind, label), 0.0) + sec
+        for (page, kind, label), sec in sorted(per_flowable.items(), key=lambda kv: -kv[1])[:top]:
+            lines.append(f"[layout]   p{page:<3} {kind:<10} {label:<42} {1000 * sec:8.1f} ms")
+        return "\n".join(lines)
+
+
+class ProfilingDocTemplate(SimpleDocTemplate):
+    """
+    SimpleDocTemplate that times each flowable's wrap / split / drawOn (split-off parts
+    too) and each page; results in self.profile (LayoutProfile). Output is unchanged.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profile = LayoutProfile()
+        self._page_t0 = None
+
+    def _instrument(self, f):
+        if getattr(f, "_layout_profiled", False):
+            return f
+        kind, label, prof = type(f).__name__, _flowable_label(f), self.profile
+        for phase in PROFILED_PHASES:
+            orig = getattr(f, phase)
+
+            def timed(*args, _orig=orig, _phase=phase, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    out = _orig(*args, **kwargs)
+                finally:
+                    prof.add(self.page, kind, label, _phase, time.perf_counter() - t0)
+                if _phase == "split":
+                    out = [self._instrument(part) for part in out]
+                return out
+
+            setattr(f, phase, timed)
+        f._layout_profiled = True
+        return f
+
+    def beforePage(self):
+        self._page_t0 = time.perf_counter()
+
+    def afterPage(self):
+        if self._page_t0 is not None:
+            self.profile.pages[self.page] = time.perf_counter() - self._page_t0
+
+    def build(self, flowables, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            super().build([self._instrument(f) for f in flowables], *args, **kwargs)
+        finally:
+            self.profile.total = time.perf_counter() - t0
+
+
+# ---- Chart images ----
+@dataclass(frozen=True)
+class ImageProfile:
+    """
+    How chart images are rendered and stored:
+      dpi             effective resolution in the PDF (None: each chart's own savefig dpi)
+      colors          quantize to a palette of this many colors (0: keep full RGB)
+      compress_level  zlib level the finished PDF's streams are re-deflated at (None: keep
+                      reportlab's); needs pypdf, applied where the PDF is written
+    dpi and colors shrink the PDF by giving the images fewer pixels and runs that deflate
+    well (build_report.save_figure); compress_level trades write time for a little more.
+    reportlab names an embedded image by a digest of its pixels, so identical charts are
+    stored once per document whatever their file names.
+    """
+    name: str
+    dpi: int | None = None
+    colors: int = 0
+    compress_level: int | None = None
+
+
+IMAGE_PROFILES = {
+    "default": ImageProfile("default"),
+    "archive": ImageProfile("archive", dpi=150, colors=64, compress_level=9),
+    "draft": ImageProfile("draft", dpi=100, colors=32),
+}
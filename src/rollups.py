@@ -0,0 +1,150 @@
+# src/rollups.py
+# School -> district -> county -> state rollups of the per-grade metric tables.
+#
+# Every school row is projected onto its four aggregation keys (its own CDS code, its
+# district, its county, the state) and the stacked frame is aggregated with a single
+# groupby, so all levels come out of one pass:
+#   caaspp      tested-weighted mean_scale_score / pct_below, summed tested (by subject, grade)
+#   elpac       total-weighted pct_below / avg_level, summed total (by domain, grade)
+#   enrollment  summed K..5 and Total
+# Suppressed (NaN) values carry no weight. Values are built from reported school rows,
+# so they can differ slightly from CDE's own district/county rows where schools are suppressed.
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from caaspp_summary import caaspp_grade_table, resolve_caaspp_path
+from cde_io import cds_rows
+from fetch_elpac import elpac_grade_table, resolve_elpac_path
+from fetch_enrollment_ca import enrollment_k5_table, resolve_enrollment_path
+
+ENTITY_KEY = ["county_code", "district_code", "school_code"]
+LEVEL_KEYS = {
+    "school":   ["county_code", "district_code", "school_code"],
+    "district": ["county_code", "district_code"],
+    "county":   ["county_code"],
+    "state":    [],
+}
+NAME_COLS = {"school": "school_name", "district": "district_name", "county": "county_name"}
+# name column -> levels that carry it
+NAMED_AT = {
+    "county_name":   ("school", "district", "county"),
+    "district_name": ("school", "district"),
+    "school_name":   ("school",),
+}
+
+# dataset -> (group-by columns, weight column, weighted means, summed counts)
+ROLLUP_SPECS = {
+    "caaspp":     (["subject", "grade"], "tested", ["mean_scale_score", "pct_below"], ["tested"]),
+    "elpac":      (["domain", "grade"], "total", ["pct_below", "avg_level"], ["total"]),
+    "enrollment": ([], None, [], ["K", "1", "2", "3", "4", "5", "Total"]),
+}
+
+
+def rollup(dataset: str, table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate a per-school table (caaspp_grade_table / elpac_grade_table / enrollment_k5_table)
+    to every level. Output: level, CDS codes (coarser codes 0), county/district/school names,
+    the spec's group-by columns, summed counts and weighted means.
+    """
+    if dataset not in ROLLUP_SPECS:
+        raise ValueError(f"Unknown dataset {dataset!r}. Expected one of {list(ROLLUP_SPECS)}.")
+    by, weight, means, sums = ROLLUP_SPECS[dataset]
+    base = table[table["level"] == "school"] if "level" in table.columns else table
+    base = base.reset_index(drop=True)
+
+    vals = {c: base[c].astype(float) for c in sums}
+    for m in means:
+        w = base[weight].where(base[m].notna(), 0).astype(float)
+        vals[f"{m}__vw"] = base[m].fillna(0) * w
+        vals[f"{m}__w"] = w
+    vals = pd.DataFrame(vals)
+
+    # project each school row onto its four aggregation keys, then one groupby
+    stacked = []
+    for level, keys in LEVEL_KEYS.items():
+        proj = pd.DataFrame({"level": level}, index=base.index)
+        for c in ENTITY_KEY:
+            proj[c] = base[c].astype("int64") if c in keys else 0
+        for name, levels in NAMED_AT.items():
+            proj[name] = base[name] if level in levels else ""
+        stacked.append(pd.concat([proj, base[by], vals], axis=1))
+    stacked = pd.concat(stacked, ignore_index=True)
+
+    key = ["level"] + ENTITY_KEY + by
+    agg = stacked.groupby(key, sort=False).agg({**{n: "first" for n in NAMED_AT}, **{c: "sum" for c in vals.columns}})
+    out = agg.reset_index()
+    for m in means:
+        w = out.pop(f"{m}__w")
+        vw = out.pop(f"{m}__vw")
+        out[m] = np.where(w > 0, vw / w.where(w > 0, 1), np.nan)
+    for c in sums:
+        out[c] = out[c].astype(int)
+    return out
+
+
+def _rollup_source(dataset: str):
+    if dataset == "caaspp":
+        return resolve_caaspp_path(), caaspp_grade_table
+    if dataset == "elpac":
+        return resolve_elpac_path(), elpac_grade_table
+    return resolve_enrollment_path(), enrollment_k5_table
+
+
+@lru_cache(maxsize=8)
+def _rollup_cached(dataset: str, path: str, mtime: float) -> pd.DataFrame:
+    builder = _rollup_source(dataset)[1]
+    return rollup(dataset, builder(path))
+
+
+def rollup_table(dataset: str, filepath=None) -> pd.DataFrame:
+    """Rollup of the current source file for `dataset` (cached per path + mtime; shared, don't mutate)."""
+    default, _ = _rollup_source(dataset)
+    path = Path(filepath) if filepath else default
+    return _rollup_cached(dataset, str(path), path.stat().st_mtime)
+
+
+def comparison(dataset: str, entity_type: str, entity_name: str, metric: str = "pct_below",
+               grades=("1", "2", "3", "4", "5"), table: pd.DataFrame = None, include_self: bool = True,
+               cds=None, **filters) -> dict:
+    """
+    {label -> [value per grade]} for the entity and the levels above it, e.g.
+      {"Irvine Unified": [...], "Orange County": [...], "California": [...]}
+    `filters` pick the slice (subject="ELA" / domain="Speaking"). None = no data for that grade.
+    include_self=False leaves out the entity's own series (callers that already have the
+    official CDE row for it). `cds` = (county, district, school) codes picks the entity by
+    code instead of by name.
+    """
+    t = rollup_table(dataset) if table is None else table
+    for col, val in filters.items():
+        t = t[t[col] == val]
+    name_col = NAME_COLS[entity_type]
+    rows = t[t["level"] == entity_type]
+    if cds is not None:
+        hit = cds_rows(rows, cds)
+    else:
+        names = rows[name_col].str.lower()
+        target = entity_name.strip().lower()
+        hit = rows[names == target]
+        if hit.empty:
+            hit = rows[names.str.contains(target, regex=False)]
+    if hit.empty:
+        return {}
+    county = hit["county_code"].iloc[0]
+
+    scopes = [(hit.iloc[0][name_col], hit)] if include_self else []
+    if entity_type == "school":
+        district = hit["district_code"].iloc[0]
+        d = t[(t["level"] == "district") & (t["county_code"] == county) & (t["district_code"] == district)]
+        scopes.append((d["district_name"].iloc[0] if not d.empty else "District", d))
+    c = t[(t["level"] == "county") & (t["county_code"] == county)]
+    scopes.append((f"{c['county_name'].iloc[0]} County" if not c.empty else "County", c))
+    scopes.append(("California", t[t["level"] == "state"]))
+
+    out = {}
+    for label, rows in scopes:
+        by_grade = rows.drop_duplicates("grade").set_index("grade")[metric] if "grade" in rows else pd.Series(dtype=float)
+        out[label] = [float(by_grade[g]) if g in by_grade.index and pd.notna(by_grade[g]) else None for g in grades]
+    return out
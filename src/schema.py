@@ -0,0 +1,114 @@
+# src/schema.py
+# Canonical column names for the CDE research files.
+# Each file vintage spells its headers a little differently ("District Name" vs
+# "DistrictName", "Total Students Tested with Scores" vs "Total Students Tested").
+# A file's header is mapped to one canonical set here, once per file, and the loaders
+# rename on read, so the metric code only ever sees the canonical names.
+from functools import lru_cache
+from pathlib import Path
+
+from cde_io import open_text
+
+# canonical name -> accepted headers, in order of preference
+CAASPP_SCHEMA = {
+    "county_code":      ["County Code", "CountyCode"],
+    "district_code":    ["District Code", "DistrictCode"],
+    "school_code":      ["School Code", "SchoolCode"],
+    "test_year":        ["Test Year", "TestYear"],
+    "test_id":          ["Test ID", "TestID"],
+    "student_group":    ["Student Group ID", "StudentGroupID"],
+    "grade":            ["Grade"],
+    "tested":           ["Total Students Tested with Scores", "Total Students Tested", "TotalTested"],
+    "enrolled":         ["Students Enrolled", "StudentsEnrolled"],
+    "mean_scale_score": ["Mean Scale Score", "MeanScaleScore"],
+    "pct_exceeded":     ["Percentage Standard Exceeded"],
+    "pct_met":          ["Percentage Standard Met"],
+    "pct_nearly_met":   ["Percentage Standard Nearly Met"],
+    "pct_not_met":      ["Percentage Standard Not Met"],
+    "county_name":      ["County Name", "CountyName"],
+    "district_name":    ["District Name", "DistrictName"],
+    "school_name":      ["School Name", "SchoolName"],
+}
+CAASPP_REQUIRED = ["district_code", "school_code", "grade", "tested", "district_name"]
+
+ELPAC_DOMAINS = ["Listening", "Speaking", "Reading", "Writing"]
+ELPAC_LEVELS  = ["Begin", "Moderate", "Developed"]
+
+ELPAC_SCHEMA = {
+    "county_code":   ["CountyCode", "County Code"],
+    "district_code": ["DistrictCode", "District Code"],
+    "school_code":   ["SchoolCode", "School Code"],
+    "type_id":       ["TypeID", "Type ID"],
+    "test_year":     ["TestYear", "Test Year"],
+    "student_group": ["StudentGroupID", "Student Group ID"],
+    "grade":         ["Grade"],
+    "county_name":   ["CountyName", "County Name"],
+    "district_name": ["DistrictName", "District Name"],
+    "school_name":   ["SchoolName", "School Name"],
+}
+for _d in ELPAC_DOMAINS:
+    for _lv in ELPAC_LEVELS:
+        ELPAC_SCHEMA[f"{_d.lower()}_{_lv.lower()}_count"] = [f"{_d}Domain{_lv}Count"]
+        ELPAC_SCHEMA[f"{_d.lower()}_{_lv.lower()}_pct"]   = [f"{_d}Domain{_lv}Pcnt"]
+    ELPAC_SCHEMA[f"{_d.lower()}_total"] = [f"{_d}DomainTotal"]
+ELPAC_REQUIRED = ["district_name", "school_code", "grade"]
+
+# *_entities.txt lookup files shipped alongside the research files (same caret layout)
+ENTITIES_SCHEMA = {
+    "county_code":   ["County Code", "CountyCode"],
+    "district_code": ["District Code", "DistrictCode"],
+    "school_code":   ["School Code", "SchoolCode"],
+    "type_id":       ["Type ID", "TypeID"],
+    "test_year":     ["Test Year", "TestYear"],
+    "county_name":   ["County Name", "CountyName"],
+    "district_name": ["District Name", "DistrictName"],
+    "school_name":   ["School Name", "SchoolName"],
+    "zip_code":      ["Zip Code", "ZipCode"],
+}
+ENTITIES_REQUIRED = ["county_code", "district_code", "school_code", "district_name", "school_name"]
+
+
+def column_map(columns, schema: dict, required=(), source: str = "file") -> dict:
+    """
+    {file header -> canonical name} for the headers present in `columns`.
+    Raises ValueError if a `required` canonical column has no match.
+    """
+    have = set(columns)
+    mapping = {}
+    for canon, aliases in schema.items():
+        hit = next((a for a in aliases if a in have), None)
+        if hit is not None:
+            mapping[hit] = canon
+    missing = [c for c in required if c not in mapping.values()]
+    if missing:
+        raise ValueError(f"{source}: missing columns {missing}\nHave: {list(columns)}")
+    return mapping
+
+
+def canonical_column(columns, schema: dict, canon: str) -> str:
+    """The file header that carries canonical column `canon` (ValueError if none)."""
+    return next(k for k, v in column_map(columns, schema, [canon], canon).items() if v == canon)
+
+
+@lru_cache(maxsize=16)
+def _file_column_map(path: str, mtime: float, sep: str, source: str) -> tuple:
+    schema, required = SCHEMAS[source]
+    with open_text(path) as fh:
+        header = fh.readline().rstrip("\r\n").split(sep)
+    return tuple(column_map(header, schema, required, source).items())
+
+
+def file_column_map(path, sep: str, source: str) -> dict:
+    """
+    Header mapping for one file, read from its first line and cached per (path, mtime),
+    so a vintage is probed once no matter how many loaders/metrics touch it.
+    """
+    path = Path(path)
+    return dict(_file_column_map(str(path), path.stat().st_mtime, sep, source))
+
+
+SCHEMAS = {
+    "CAASPP": (CAASPP_SCHEMA, CAASPP_REQUIRED),
+    "ELPAC":  (ELPAC_SCHEMA, ELPAC_REQUIRED),
+    "ENTITIES": (ENTITIES_SCHEMA, ENTITIES_REQUIRED),
+}
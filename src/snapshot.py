@@ -0,0 +1,168 @@
+# src/snapshot.py
+# Warm-start snapshots of the normalized source frames, so a new process skips parsing.
+#
+# The first parse of a research file writes its normalized frame(s) (what the loaders'
+# lru_caches hold: CAASPP rows per subject, ELPAC metric rows, K–5 enrollment by school)
+# as one .npy per column plus a manifest; later processes memory-map the columns back.
+#
+#   output/snapshot/<dataset>/<source file>-v<SNAPSHOT_VERSION>-<size>-<mtime_ns>/
+#       manifest.json            frames, row counts, column kinds and dtypes
+#       <frame>/<column>.npy     numeric / bool values (nullable ints: + <column>.mask.npy)
+#       <frame>/<column>.npy     string columns as int32 codes, labels in the manifest
+#       <frame>/__index__.npy
+#
+# A snapshot is only used for the exact source file it was built from (size + mtime) and
+# the current SNAPSHOT_VERSION; bump the version whenever normalization changes.
+#
+#   python src/snapshot.py build        # parse every source file and write its snapshot
+#   python src/snapshot.py status
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cde_io import BASE_DIR
+
+SNAPSHOT_DIR = BASE_DIR / "output" / "snapshot"
+SNAPSHOT_VERSION = 1
+# CA_REPORT_SNAPSHOT=0 disables reading and writing snapshots (always parse)
+ENABLED = os.environ.get("CA_REPORT_SNAPSHOT", "1") != "0"
+
+
+def _snapshot_dir(dataset: str, source) -> Path:
+    st = Path(source).stat()
+    return SNAPSHOT_DIR / dataset / f"{Path(source).name}-v{SNAPSHOT_VERSION}-{st.st_size}-{st.st_mtime_ns}"
+
+
+def _write_column(folder: Path, name: str, col: pd.Series) -> dict:
+    dtype = str(col.dtype)
+    if pd.api.types.is_bool_dtype(col) and not col.hasnans:
+        np.save(folder / f"{name}.npy", col.to_numpy(dtype=bool))
+        return {"name": name, "kind": "num", "dtype": "bool"}
+    if isinstance(col.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_numeric_dtype(col):
+        # nullable ints: values + NA mask
+        mask = col.isna().to_numpy()
+        np.save(folder / f"{name}.npy", col.to_numpy(dtype=col.dtype.numpy_dtype, na_value=0))
+        np.save(folder / f"{name}.mask.npy", mask)
+        return {"name": name, "kind": "masked", "dtype": dtype}
+    if pd.api.types.is_numeric_dtype(col):
+        np.save(folder / f"{name}.npy", col.to_numpy())
+        return {"name": name, "kind": "num", "dtype": dtype}
+    codes, labels = pd.factorize(col, use_na_sentinel=True)
+    np.save(folder / f"{name}.npy", codes.astype(np.int32))
+    return {"name": name, "kind": "str", "dtype": dtype, "labels": [str(v) for v in labels]}
+
+
+def _read_column(folder: Path, spec: dict):
+    # copy-on-write map (callers may assign), viewed as a plain ndarray so ops don't return memmaps
+    values = np.load(folder / f"{spec['name']}.npy", mmap_mode="c").view(np.ndarray)
+    if spec["kind"] == "num":
+        return values
+    if spec["kind"] == "masked":
+        arr = pd.array(values, dtype=spec["dtype"])
+        mask = np.load(folder / f"{spec['name']}.mask.npy")
+        if mask.any():
+            arr[mask] = pd.NA
+        return arr
+    labels = np.array(spec["labels"] + [None], dtype=object)
+    return pd.array(labels[values], dtype=spec["dtype"])  # code -1 -> the trailing None
+
+
+def save(dataset: str, source, frames: dict) -> Path | None:
+    """
+    Write `frames` ({name -> DataFrame}) as the snapshot of `source`. The snapshot is
+    written to a temp folder and renamed into place, so readers never see a partial one;
+    snapshots of older versions of the same source file are removed.
+    """
+    if not ENABLED:
+        return None
+    final = _snapshot_dir(dataset, source)
+    if final.exists():
+        return final
+    tmp = final.with_name(f".{final.name}.{os.getpid()}.tmp")
+    manifest = {"version": SNAPSHOT_VERSION, "dataset": dataset, "source": str(source),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "frames": {}}
+    try:
+        for fname, df in frames.items():
+            folder = tmp / fname
+            folder.mkdir(parents=True)
+            np.save(folder / "__index__.npy", df.index.to_numpy(dtype=np.int64))
+            manifest["frames"][fname] = {
+                "rows": len(df),
+                "columns": [_write_column(folder, str(c), df[c]) for c in df.columns],
+            }
+        (tmp / "manifest.json").write_text(json.dumps(manifest))
+        os.rename(tmp, final)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        return final if final.exists() else None  # another process got there first
+    for old in final.parent.iterdir():
+        if old.name.startswith(f"{Path(source).name}-v") and old != final:
+            shutil.rmtree(old, ignore_errors=True)
+    return final
+
+
+def load(dataset: str, source) -> dict | None:
+    """{name -> DataFrame} from the snapshot of `source`, or None if there is no current one."""
+    if not ENABLED:
+        return None
+    folder = _snapshot_dir(dataset, source)
+    try:
+        manifest = json.loads((folder / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return None
+    frames = {}
+    for fname, spec in manifest["frames"].items():
+        sub = folder / fname
+        cols = {c["name"]: _read_column(sub, c) for c in spec["columns"]}
+        index = pd.Index(np.load(sub / "__index__.npy"))
+        frames[fname] = pd.DataFrame(cols, index=index, copy=False)
+    return frames
+
+
+def build() -> dict:
+    """Parse every default source file (writing any missing snapshot). {dataset -> folder}."""
+    from caaspp_summary import caaspp_grade_table, resolve_caaspp_path
+    from fetch_elpac import elpac_metrics, resolve_elpac_path
+    from fetch_enrollment_ca import enrollment_k5_table, resolve_enrollment_path
+
+    out = {}
+    for dataset, loader, resolve in (
+        ("caaspp", caaspp_grade_table, resolve_caaspp_path),
+        ("elpac", elpac_metrics, resolve_elpac_path),
+        ("enrollment", enrollment_k5_table, resolve_enrollment_path),
+    ):
+        try:
+            loader(None)
+            out[dataset] = _snapshot_dir(dataset, resolve())
+        except (FileNotFoundError, ValueError) as e:
+            print(f"[warn] snapshot skipped ({dataset}):", e)
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Warm-start snapshots of the normalized source data")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("build", help="parse the source files and write missing snapshots")
+    sub.add_parser("status", help="list snapshots on disk")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "build":
+        t0 = time.perf_counter()
+        for dataset, folder in build().items():
+            print(f"[snapshot] {dataset:<11} {folder.name if folder.exists() else '(not written)'}")
+        print(f"[snapshot] done in {time.perf_counter() - t0:.2f}s")
+    else:
+        for folder in sorted(SNAPSHOT_DIR.glob("*/*/manifest.json")):
+            m = json.loads(folder.read_text())
+            rows = ", ".join(f"{k}={v['rows']}" for k, v in m["frames"].items())
+            print(f"{m['dataset']:<11} {folder.parent.name}  {rows}  {m['created_at']}")
+
+
+if __name__ == "__main__":
+    main()
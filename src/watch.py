@@ -0,0 +1,295 @@
+# src/watch.py
+# Watch data_raw/ and rebuild only the reports whose numbers moved.
+#
+# Polls the three source files (CAASPP, ELPAC, enrollment; plain or compressed) for size /
+# mtime changes. A change is acted on once every changed file has been stable for
+# DEBOUNCE_SECONDS, so a bulk copy (or a download still in progress) is handled as one
+# release. Then:
+#   1. each changed file is ingested into the metric store for its vintage year (replacing a
+#      partition from an earlier release of the same year: corrected re-releases),
+#   2. the per-entity metric table (metric_query.build_metric_table: KPIs, ranks, per-grade
+#      CAASPP/ELPAC values) is diffed against the one from the previous vintage,
+#   3. districts/schools with a moved number are queued for a rebuild (a district also when
+#      a school's enrollment moved), deduplicated, and built at most MAX_BUILDS_PER_MINUTE
+#      with assemble.build_pdf (sections laid out in a pool forked once the new sources are
+#      loaded, kept until that release's queue is drained).
+# Only reports that already exist in the reports directory are rebuilt unless --all is given.
+# Entities are followed by their CDS codes (school names are not unique): a report is the
+# code-named file (job_queue, or an earlier rebuild here), or a name-only file from
+# build_report when no other entity of that level shares the name.
+# County/state comparison bars are not diffed: one school's correction would otherwise
+# rebuild every report in its county.
+# The previous vintage is kept in output/watch/state.pkl, so a restart does not rebuild.
+#
+#   python src/watch.py                     # long-running
+#   python src/watch.py --once --dry-run    # one check, print what would be rebuilt
+import argparse
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from build_context import REPORTS_DIR, report_filename
+from caaspp_summary import resolve_caaspp_path
+from cde_io import BASE_DIR
+from fetch_elpac import resolve_elpac_path
+from fetch_enrollment_ca import resolve_enrollment_path
+from kpi import ENTITY_KEY
+
+STATE_PATH = BASE_DIR / "output" / "watch" / "state.pkl"
+POLL_SECONDS = 10
+DEBOUNCE_SECONDS = 30        # a changed file must keep the same size/mtime this long
+MAX_BUILDS_PER_MINUTE = 30
+METRIC_TOLERANCE = 0.05      # smaller moves don't change what the report shows (1 decimal)
+PCTL_TOLERANCE = 0.5         # percentile ranks are shown as whole numbers
+
+SOURCES = {
+    "caaspp": resolve_caaspp_path,
+    "elpac": resolve_elpac_path,
+    "enrollment": resolve_enrollment_path,
+}
+
+
+def source_signatures() -> dict:
+    """{dataset -> (path, size, mtime_ns)} for the source files present now (None if missing)."""
+    out = {}
+    for dataset, resolve in SOURCES.items():
+        try:
+            path = resolve()
+            st = path.stat()
+            out[dataset] = (str(path), st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            out[dataset] = None
+    return out
+
+
+def vintage_year(path) -> int | None:
+    """Test year from a CDE file name: caaspp_2024_ela.txt -> 2024, cdenroll2425.txt -> 2025."""
+    name = Path(path).name
+    m = re.search(r"cdenroll(\d\d)(\d\d)", name)
+    if m:
+        return 2000 + int(m.group(2))
+    m = re.search(r"(20\d\d)", name)
+    return int(m.group(1)) if m else None
+
+
+def diff_metrics(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Entities whose metrics moved between two metric tables (build_metric_table output):
+    ENTITY_KEY, level, names and `changed` (list of moved columns). New entities count as
+    moved; entities that disappeared are ignored (there is nothing to rebuild).
+    """
+    info = [c for c in ("level", "county_name", "district_name", "school_name") if c in new.columns]
+    new_i = new.set_index(ENTITY_KEY)
+    old_i = old.set_index(ENTITY_KEY).reindex(new_i.index)
+    cols = [c for c in new_i.columns if c not in info and pd.api.types.is_numeric_dtype(new_i[c])]
+    changed = pd.DataFrame(False, index=new_i.index, columns=cols)
+    for c in cols:
+        a = new_i[c].to_numpy(dtype=np.float64, na_value=np.nan)
+        b = (old_i[c].to_numpy(dtype=np.float64, na_value=np.nan) if c in old_i.columns
+             else np.full(len(a), np.nan))
+        tol = PCTL_TOLERANCE if c.endswith("_pctl") else METRIC_TOLERANCE
+        with np.errstate(invalid="ignore"):
+            changed[c] = (np.isnan(a) != np.isnan(b)) | (np.abs(a - b) > tol)
+    is_new = ~new_i.index.isin(old.set_index(ENTITY_KEY).index)
+    moved = changed.any(axis=1).to_numpy() | is_new
+    out = new_i.loc[moved, info].reset_index()
+    out["changed"] = [["(new)"] if n else [c for c in cols if flags[c]]
+                      for n, (_, flags) in zip(is_new[moved], changed[moved].iterrows())]
+    return out
+
+
+def rebuild_targets(moved: pd.DataFrame) -> list:
+    """
+    (entity_type, name, (county, district, school) codes) to rebuild: every moved district
+    and school, plus the district of each school whose enrollment moved (its row is in the
+    district's school table). Deduplicated on the codes, so same-named schools stay apart.
+    """
+    targets = OrderedDict()
+    for r in moved.itertuples(index=False):
+        county, district, school = int(r.county_code), int(r.district_code), int(r.school_code)
+        if r.level == "district":
+            targets.setdefault(("district", (county, district, 0)), r.district_name)
+        else:
+            targets.setdefault(("school", (county, district, school)), r.school_name)
+            if "total_k5" in r.changed or "(new)" in r.changed:
+                targets.setdefault(("district", (county, district, 0)), r.district_name)
+    return [(entity_type, name, cds) for (entity_type, cds), name in targets.items() if name]
+
+
+def report_file(entity_type: str, name: str, cds, present, shared_names) -> str | None:
+    """
+    The report file of an entity among the file names `present`: its code-named file, else a
+    name-only one when the name is not in `shared_names` (names used by several entities of
+    this level, whose name-only file could be any of them). None when it has no report.
+    """
+    if report_filename(name, cds) in present:
+        return report_filename(name, cds)
+    if report_filename(name) in present and (entity_type, name.lower()) not in shared_names:
+        return report_filename(name)
+    return None
+
+
+class Watcher:
+    def __init__(self, reports_dir=REPORTS_DIR, state_path=STATE_PATH, debounce=DEBOUNCE_SECONDS,
+                 per_minute=MAX_BUILDS_PER_MINUTE, build_all=False, dry_run=False, ingest=True,
+                 section_workers=None):
+        self.reports_dir = reports_dir
+        self.state_path = Path(state_path)
+        self.debounce = debounce
+        self.per_minute = per_minute
+        self.build_all = build_all
+        self.dry_run = dry_run
+        self.ingest = ingest
+        self.section_workers = section_workers
+        self.pool = None               # assemble.make_pool() while the queue is being built
+        self.pending = {}              # dataset -> (signature, first seen at that signature)
+        self.queue = OrderedDict()     # (entity_type, cds) -> (name, file); insertion order, no duplicates
+        self.tokens = float(per_minute)
+        self.last_refill = time.monotonic()
+        self.state = pd.read_pickle(self.state_path) if self.state_path.exists() else None
+
+    def _save_state(self, sources: dict, metrics: pd.DataFrame):
+        self.state = {"sources": sources, "metrics": metrics}
+        if self.dry_run:
+            return
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix(".tmp")
+        pd.to_pickle(self.state, tmp)
+        os.replace(tmp, self.state_path)
+
+    def check(self, settle_now: bool = False) -> bool:
+        """
+        Poll the sources once. When every changed file has settled, ingest, diff and queue
+        rebuilds; returns True if a release was processed.
+        """
+        from metric_query import build_metric_table
+        now = time.monotonic()
+        current = source_signatures()
+        if self.state is None:
+            print("[watch] no previous vintage: recording the current data as the baseline")
+            self._save_state(current, build_metric_table())
+            return False
+
+        known = self.state["sources"]
+        for dataset, sig in current.items():
+            if sig == known.get(dataset) or sig is None:
+                self.pending.pop(dataset, None)
+            elif dataset not in self.pending or self.pending[dataset][0] != sig:
+                print(f"[watch] {dataset} changed: {Path(sig[0]).name}; waiting for it to settle")
+                self.pending[dataset] = (sig, now)
+        if not self.pending:
+            return False
+        if not settle_now and any(now - since < self.debounce for _, since in self.pending.values()):
+            return False  # something is still being written
+
+        changed = sorted(self.pending)
+        self.pending.clear()
+        if self.ingest:
+            self._ingest(changed, current)
+        metrics = build_metric_table()
+        moved = diff_metrics(self.state["metrics"], metrics)
+        targets = rebuild_targets(moved)
+        present = set(os.listdir(self.reports_dir)) if os.path.isdir(self.reports_dir) else set()
+        shared_names = set()
+        for level, col in (("district", "district_name"), ("school", "school_name")):
+            names = metrics.loc[metrics["level"] == level, col].dropna().str.lower()
+            shared_names |= {(level, n) for n in names[names.duplicated()]}
+        queued = 0
+        for entity_type, name, cds in targets:
+            fname = report_file(entity_type, name, cds, present, shared_names)
+            if fname is None and self.build_all:
+                fname = report_filename(name, cds)
+            if fname is not None:
+                self.queue[(entity_type, cds)] = (name, fname)
+                queued += 1
+        print(f"[watch] {', '.join(changed)} changed: {len(moved)} entit(ies) moved, "
+              f"{queued} report(s) queued ({len(self.queue)} pending)")
+        self._save_state(current, metrics)
+        return True
+
+    def _ingest(self, datasets, sources):
+        import metric_store
+        for dataset in datasets:
+            path = sources[dataset][0]
+            year = vintage_year(path)
+            if year is None:
+                print(f"[warn] {Path(path).name}: no year in the file name; not ingested into the metric store")
+                continue
+            if self.dry_run:
+                print(f"[watch] would ingest {dataset} {year} from {Path(path).name}")
+                continue
+            try:
+                written = metric_store.ingest(dataset, year, path, replace=True)
+                print(f"[watch] {dataset} {year}: {'ingested' if written else 'unchanged'}")
+            except (FileNotFoundError, ValueError) as e:
+                print(f"[warn] {dataset} ingest failed:", e)
+
+    def build_pending(self) -> int:
+        """Build queued reports, no more than the rate limit allows (token bucket). Returns builds run."""
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self.last_refill) * self.per_minute / 60)
+        self.last_refill = now
+        built = 0
+        while self.queue and self.tokens >= 1:
+            (entity_type, cds), (name, fname) = self.queue.popitem(last=False)
+            self.tokens -= 1
+            built += 1
+            if self.dry_run:
+                print(f"[watch] would rebuild {entity_type} {name} -> {fname}")
+                continue
+            from assemble import build_pdf, make_pool
+            if self.pool is None:
+                from pipeline import preload_sources
+                preload_sources()  # the new release, so the section workers fork with it loaded
+                self.pool = make_pool(self.section_workers)
+            try:
+                path = build_pdf(entity_type, name, out_path=os.path.join(self.reports_dir, fname),
+                                 pool=self.pool, cds=cds)
+                print(f"[watch] rebuilt {path}")
+            except Exception as e:
+                print(f"[watch] {entity_type} {name} failed:", e)
+        if not self.queue and self.pool is not None:
+            self.pool.shutdown()  # the next release gets workers forked after its own load
+            self.pool = None
+        return built
+
+    def run(self, poll=POLL_SECONDS):
+        print(f"[watch] polling every {poll}s (debounce {self.debounce}s, <= {self.per_minute} builds/min)")
+        while True:
+            self.check()
+            self.build_pending()
+            time.sleep(poll if not self.queue else min(poll, 60 / self.per_minute))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Rebuild reports whose numbers moved when data_raw/ changes")
+    ap.add_argument("--reports-dir", default=REPORTS_DIR)
+    ap.add_argument("--poll", type=float, default=POLL_SECONDS)
+    ap.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS)
+    ap.add_argument("--per-minute", type=float, default=MAX_BUILDS_PER_MINUTE, help="build rate limit")
+    ap.add_argument("--all", action="store_true", help="also build moved entities that have no report yet")
+    ap.add_argument("--no-ingest", action="store_true", help="don't update the metric store")
+    ap.add_argument("--once", action="store_true", help="check once (no debounce), build what moved, exit")
+    ap.add_argument("--dry-run", action="store_true", help="report what would be ingested/rebuilt; change nothing")
+    ap.add_argument("--section-workers", type=int, default=None,
+                    help="processes laying out each report's sections (default: one per section, up to the CPU count)")
+    args = ap.parse_args(argv)
+
+    w = Watcher(args.reports_dir, debounce=args.debounce, per_minute=args.per_minute,
+                build_all=args.all, dry_run=args.dry_run, ingest=not args.no_ingest,
+                section_workers=args.section_workers)
+    if not args.once:
+        w.run(args.poll)
+    w.check(settle_now=True)
+    while w.queue:
+        if not w.build_pending():
+            time.sleep(60 / w.per_minute)
+
+
+if __name__ == "__main__":
+    main()